@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+滑块缺口定位基准测试脚本
+对比旧版逐行循环实现与向量化实现的单张耗时，并校验两者偏移量是否一致
+
+用法：
+    python captcha_bench.py faile_captcha            # 读取 save_failed_img_path 下的 ibig/isma 样本
+    python captcha_bench.py faile_captcha --repeat 5
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+from captcha_solver import match_slider_offset
+
+
+def legacy_match_slider_offset(small_image_b64, big_image_b64):
+    """旧版实现（Python 逐行扫描），仅用于基准对比"""
+    small_bytes = base64.b64decode(small_image_b64)
+    big_bytes = base64.b64decode(big_image_b64)
+
+    with Image.open(io.BytesIO(small_bytes)) as sm:
+        sw, sh = sm.size
+
+    big_img = np.asarray(Image.open(io.BytesIO(big_bytes)).convert("RGB"))
+    resized = big_img[::2, ::2]
+    h, w = resized.shape[:2]
+    min_side = max(1, int(min(sw, sh) * 0.25))
+    skip_left = sw // 4
+    good_enough = (min_side * min_side * 3) // 2
+
+    q = (resized.astype(np.int32) & ~3)
+    color_id = q[:, :, 0] + q[:, :, 1] * 256 + q[:, :, 2] * 65536
+
+    flat = color_id.ravel()
+    unique, counts = np.unique(flat, return_counts=True)
+    top_indices = np.argpartition(counts, max(-3, -len(counts)))[-3:]
+
+    best_area = 0
+    best_x = 0
+    col_run = np.empty((h, w), dtype=np.int32)
+
+    for idx in top_indices:
+        c = unique[idx]
+        mask = color_id == c
+        col_run[0] = mask[0]
+        for y in range(1, h):
+            col_run[y] = (col_run[y - 1] + 1) * mask[y]
+
+        for y in range(min_side, h):
+            row = col_run[y]
+            x = skip_left
+            while x < w:
+                if row[x] < min_side:
+                    x += 1
+                    continue
+                s = x
+                while x < w and row[x] >= min_side:
+                    x += 1
+                run_w = x - s
+                run_h = int(row[s])
+                if run_h > 0:
+                    ratio = run_w / run_h
+                    area = run_w * run_h
+                    if 0.7 < ratio < 1.4 and area > best_area:
+                        best_area = area
+                        best_x = s
+                        if best_area >= good_enough:
+                            return True, best_x * 2
+
+    if best_area == 0:
+        return False, "未找到缺口"
+    return True, best_x * 2
+
+
+def load_corpus(path):
+    """读取 check_img 保存的失败样本目录（ibig/ 与 isma/ 下同名文件）"""
+    big_dir = os.path.join(path, "ibig")
+    small_dir = os.path.join(path, "isma")
+    samples = []
+    for name in sorted(os.listdir(big_dir)):
+        small_path = os.path.join(small_dir, name)
+        if not os.path.isfile(small_path):
+            continue
+        with open(os.path.join(big_dir, name), "rb") as f:
+            big = base64.b64encode(f.read())
+        with open(small_path, "rb") as f:
+            small = base64.b64encode(f.read())
+        samples.append((name, small, big))
+    return samples
+
+
+def _time_per_image(func, samples, repeat):
+    results = []
+    costs = []
+    for _, small, big in samples:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            res = func(small, big)
+        costs.append((time.perf_counter() - start) / repeat * 1000)
+        results.append(res)
+    return results, costs
+
+
+def _summary(costs):
+    arr = np.asarray(costs)
+    return f"mean={arr.mean():.3f}ms p50={np.percentile(arr, 50):.3f}ms p95={np.percentile(arr, 95):.3f}ms max={arr.max():.3f}ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="滑块缺口定位基准测试")
+    parser.add_argument("corpus", help="验证码样本目录（包含 ibig/ 与 isma/）")
+    parser.add_argument("--repeat", type=int, default=3, help="每张图片重复次数")
+    args = parser.parse_args(argv)
+
+    samples = load_corpus(args.corpus)
+    if not samples:
+        print(f"样本目录为空：{args.corpus}", file=sys.stderr)
+        return 1
+
+    old_results, old_costs = _time_per_image(legacy_match_slider_offset, samples, args.repeat)
+    new_results, new_costs = _time_per_image(match_slider_offset, samples, args.repeat)
+
+    mismatched = 0
+    print(f"{'样本':<40} {'旧版(ms)':>10} {'新版(ms)':>10}  偏移")
+    for (name, _, _), old, new, oc, nc in zip(samples, old_results, new_results, old_costs, new_costs):
+        flag = "" if old == new else f"  不一致: 旧={old} 新={new}"
+        mismatched += old != new
+        print(f"{name:<40} {oc:>10.3f} {nc:>10.3f}  {new[1]}{flag}")
+
+    print(f"\n样本数：{len(samples)}，偏移不一致：{mismatched}")
+    print(f"旧版：{_summary(old_costs)}")
+    print(f"新版：{_summary(new_costs)}")
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
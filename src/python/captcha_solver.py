@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+滑块验证码缺口定位模块
+缺口定位为纯函数实现，全部使用 NumPy 数组运算，不依赖 beian 实例；
+CaptchaSolver 负责将其放到线程池/进程池中执行
+"""
+import asyncio
+import base64
+import io
+import multiprocessing
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from mlog import logger
+from load_config import config
+
+
+def _column_runs(mask):
+    """逐列统计以当前行结尾的连续 True 数量（等价于 col_run[y] = (col_run[y-1] + 1) * mask[y]）"""
+    rows = np.arange(mask.shape[0], dtype=np.int32)[:, None]
+    last_false = np.maximum.accumulate(np.where(mask, -1, rows), axis=0)
+    return rows - last_false
+
+
+def _scan_candidates(col_run, min_side, skip_left):
+    """
+    在每一行中找出高度 >= min_side 的连续段，返回按 (y, x) 顺序排列的
+    候选起点 x 与面积，仅保留宽高比在 (0.7, 1.4) 之间的段
+    """
+    tall = col_run[min_side:, skip_left:] >= min_side
+    if not tall.any():
+        return None, None
+
+    padded = np.pad(tall, ((0, 0), (1, 1)))
+    edges = np.diff(padded.view(np.int8), axis=1)
+    start_y, start_x = np.nonzero(edges == 1)
+    _, end_x = np.nonzero(edges == -1)
+
+    run_w = end_x - start_x
+    run_h = col_run[start_y + min_side, start_x + skip_left]
+    ratio = run_w / run_h
+    keep = (ratio > 0.7) & (ratio < 1.4)
+    return start_x[keep] + skip_left, (run_w * run_h)[keep]
+
+
+def match_slider_offset(small_image_b64, big_image_b64):
+    """在大图上找与滑块同尺寸的纯色正方形缺口区域，返回其 x 偏移量（向量化版）"""
+    small_bytes = base64.b64decode(small_image_b64)
+    big_bytes = base64.b64decode(big_image_b64)
+
+    # 小图只取尺寸，避免完整解码像素
+    with Image.open(io.BytesIO(small_bytes)) as sm:
+        sw, sh = sm.size
+
+    big_img = np.asarray(Image.open(io.BytesIO(big_bytes)).convert("RGB"))
+    # 下采样 + 量化一步完成
+    resized = big_img[::2, ::2]
+    h, w = resized.shape[:2]
+    min_side = max(1, int(min(sw, sh) * 0.25))
+    skip_left = sw // 4
+    good_enough = (min_side * min_side * 3) // 2
+
+    q = (resized.astype(np.int32) & ~3)
+    color_id = q[:, :, 0] + q[:, :, 1] * 256 + q[:, :, 2] * 65536
+
+    flat = color_id.ravel()
+    unique, counts = np.unique(flat, return_counts=True)
+    # 只检查 Top-3 高频色
+    top_indices = np.argpartition(counts, max(-3, -len(counts)))[-3:]
+
+    best_area = 0
+    best_x = 0
+
+    if h > min_side and w > skip_left:
+        for idx in top_indices:
+            col_run = _column_runs(color_id == unique[idx])
+            xs, areas = _scan_candidates(col_run, min_side, skip_left)
+            if xs is None or len(xs) == 0:
+                continue
+
+            # 按扫描顺序第一个达到阈值的候选即为提前结束时的结果
+            enough = np.flatnonzero(areas >= good_enough)
+            if len(enough):
+                offset_x = int(xs[enough[0]]) * 2
+                logger.info(f"缺口定位：x={offset_x}, 滑块={sw}x{sh}")
+                return True, offset_x
+
+            # 严格大于才替换，保留最先出现的最大面积
+            i = int(np.argmax(areas))
+            if areas[i] > best_area:
+                best_area = int(areas[i])
+                best_x = int(xs[i])
+
+    if best_area == 0:
+        return False, "未找到缺口"
+
+    offset_x = best_x * 2
+    logger.info(f"缺口定位：x={offset_x}, 滑块={sw}x{sh}")
+    return True, offset_x
+
+
+def _warm_up():
+    """执行器工作线程/进程初始化：预加载 PIL 解码器与 NumPy 运算路径"""
+    buf = io.BytesIO()
+    Image.new("RGB", (16, 16), (255, 255, 255)).save(buf, "PNG")
+    img = np.asarray(Image.open(io.BytesIO(buf.getvalue())).convert("RGB"))
+    _scan_candidates(_column_runs(img[:, :, 0] > 0), 2, 0)
+
+
+class CaptchaSolver:
+    """验证码识别执行器：在线程池/进程池中定位缺口，避免阻塞事件循环"""
+
+    def __init__(self, workers=None, mode=None, queue_size=None):
+        captcha_config = getattr(config, 'captcha', object())
+        self.workers = int(workers if workers is not None else (getattr(captcha_config, 'solver_workers', None) or 0))
+        self.mode = (mode or getattr(captcha_config, 'solver_mode', None) or "thread").lower()
+        self.queue_size = int(queue_size or getattr(captcha_config, 'solver_queue', None) or max(1, self.workers) * 8)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # 每个事件循环各自的排队信号量（MCP HTTP 线程使用独立事件循环）
+        self._slots = weakref.WeakKeyDictionary()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    if self.mode == "process":
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=multiprocessing.get_context("spawn"),
+                            initializer=_warm_up,
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.workers,
+                            thread_name_prefix="captcha-solver",
+                            initializer=_warm_up,
+                        )
+                    logger.info(f"验证码识别执行器已启动：{self.mode} x {self.workers}，队列上限 {self.queue_size}")
+        return self._executor
+
+    def _get_slots(self, loop):
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = asyncio.Semaphore(self.queue_size)
+            self._slots[loop] = slots
+        return slots
+
+    async def solve(self, small_image_b64, big_image_b64):
+        """定位缺口；队列已满时等待空位（背压），workers 为 0 时在当前协程内直接计算"""
+        if self.workers <= 0:
+            return match_slider_offset(small_image_b64, big_image_b64)
+
+        loop = asyncio.get_running_loop()
+        async with self._get_slots(loop):
+            return await loop.run_in_executor(
+                self._get_executor(), match_slider_offset, small_image_b64, big_image_b64
+            )
+
+    async def start(self):
+        """预先拉起全部工作线程/进程，首个验证码无需等待冷启动"""
+        if self.workers <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*[loop.run_in_executor(executor, _warm_up) for _ in range(self.workers)])
+
+    def shutdown(self):
+        """关闭执行器"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                logger.info("验证码识别执行器已关闭")
+
+
+# 全局验证码识别执行器实例
+_captcha_solver = None
+
+
+def get_captcha_solver() -> CaptchaSolver:
+    """获取全局验证码识别执行器（进程内共享）"""
+    global _captcha_solver
+    if _captcha_solver is None:
+        _captcha_solver = CaptchaSolver()
+    return _captcha_solver
+
+
+async def init_captcha_solver(app):
+    """启动验证码识别执行器（用于app启动时）"""
+    await get_captcha_solver().start()
+
+
+async def cleanup_captcha_solver(app):
+    """关闭验证码识别执行器（用于app关闭时）"""
+    if _captcha_solver is not None:
+        _captcha_solver.shutdown()
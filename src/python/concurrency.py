@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+批量任务自适应并发模块
+AIMD（加性增、乘性减）控制：成功率与延迟正常时每完成一轮（约 limit 个成功请求）并发加 1，
+遇到拦截减半、验证码失败降为 3/4，并发始终限制在 [min_limit, max_limit] 内
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+from load_config import config
+
+
+# 结果类型
+OUTCOME_SUCCESS = "success"
+OUTCOME_BLOCKED = "blocked"
+OUTCOME_CAPTCHA = "captcha"
+OUTCOME_TIMEOUT = "timeout"  # 连接失败或超时
+OUTCOME_ERROR = "error"
+
+# 乘性减因子
+_DECREASE = {OUTCOME_BLOCKED: 0.5, OUTCOME_CAPTCHA: 0.75}
+
+
+def query_outcome(data) -> str:
+    """把单次查询结果归类为结果类型（自适应并发与代理租约共用）"""
+    if data.get("code") == 200:
+        return OUTCOME_SUCCESS
+    message = data.get("message") or ""
+    if "创宇盾" in message:
+        return OUTCOME_BLOCKED
+    if message.startswith("请求验证码时失败") or "Timeout" in (data.get("error") or ""):
+        return OUTCOME_TIMEOUT
+    if "验证码" in message or "滑块" in message:
+        return OUTCOME_CAPTCHA
+    return OUTCOME_ERROR
+
+
+class AdaptiveConcurrency:
+    """可动态调整上限的并发闸门，只在事件循环线程中使用"""
+
+    def __init__(self, initial: int, min_limit: Optional[int] = None, max_limit: Optional[int] = None,
+                 adaptive: Optional[bool] = None):
+        system = config.system
+        if adaptive is None:
+            adaptive = system.batch_adaptive is None or bool(system.batch_adaptive)
+        if not adaptive:
+            # 关闭自适应时保持用户指定的固定并发
+            min_limit = max_limit = initial
+        self.min_limit = max(1, int(min_limit or system.batch_min_concurrency or 1))
+        # 未配置上限时默认 50，但不低于用户指定的初始并发
+        self.max_limit = max(self.min_limit, int(max_limit or system.batch_max_concurrency or max(50, int(initial))))
+        self.limit = min(max(int(initial), self.min_limit), self.max_limit)
+        self.inflight = 0
+        # 延迟超过历史最低平滑延迟的该倍数即视为拥塞，不再加并发
+        self.latency_tolerance = float(system.batch_latency_tolerance or 2)
+        self.latency_ewma = None
+        self.latency_floor = None
+        self._recent = deque(maxlen=20)  # 最近的结果是否成功
+        self._successes = 0  # 本轮累计成功数，达到 limit 后加并发
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+        self._wakers = set()  # 持有唤醒任务的引用，避免任务在完成前被回收
+        self.increases = 0
+        self.decreases = 0
+
+    async def acquire(self) -> float:
+        """等待空闲名额，返回开始时间（传给 record）"""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.inflight < self.limit)
+            self.inflight += 1
+        return time.monotonic()
+
+    async def release(self):
+        async with self._cond:
+            self.inflight -= 1
+            self._cond.notify()
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个名额发出一次上游请求，返回开始时间"""
+        started = await self.acquire()
+        try:
+            yield started
+        finally:
+            await self.release()
+
+    def _healthy(self) -> bool:
+        """成功率不低于 90% 且平滑延迟未明显高于历史最低值"""
+        if self._recent and sum(self._recent) / len(self._recent) < 0.9:
+            return False
+        if self.latency_floor is not None and self.latency_ewma > self.latency_floor * self.latency_tolerance:
+            return False
+        return True
+
+    def record(self, outcome: str, started: float):
+        """记录一次上游请求的结果，started 为 acquire（或 slot）返回的开始时间，延迟按单次请求计算"""
+        now = time.monotonic()
+        self._recent.append(outcome == OUTCOME_SUCCESS)
+
+        if outcome == OUTCOME_SUCCESS:
+            latency = now - started
+            self.latency_ewma = latency if self.latency_ewma is None else self.latency_ewma * 0.8 + latency * 0.2
+            self.latency_floor = self.latency_ewma if self.latency_floor is None else min(self.latency_floor, self.latency_ewma)
+            self._successes += 1
+            if self._successes >= self.limit and self._healthy():
+                self._successes = 0
+                if self.limit < self.max_limit:
+                    self._set_limit(self.limit + 1)
+                    self.increases += 1
+            return
+
+        factor = _DECREASE.get(outcome)
+        # 一次拥塞会让同时在途的多个请求一起失败，只对上次降低之后发出的请求再次降低
+        if factor is None or started < self._last_decrease:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        new_limit = max(self.min_limit, int(self.limit * factor))
+        if new_limit < self.limit:
+            self._set_limit(new_limit)
+            self.decreases += 1
+
+    def _set_limit(self, limit: int):
+        grew = limit > self.limit
+        self.limit = limit
+        if grew:
+            task = asyncio.get_running_loop().create_task(self._wake())
+            self._wakers.add(task)
+            task.add_done_callback(self._wakers.discard)
+
+    async def _wake(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """当前并发状态"""
+        return {
+            "limit": self.limit,
+            "inflight": self.inflight,
+            "min": self.min_limit,
+            "max": self.max_limit,
+            "latency": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
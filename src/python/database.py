@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import sqlite3
 import json
+import time
+import zlib
 from datetime import datetime
 from mlog import logger
 import os
@@ -28,6 +30,9 @@ class Database:
             conn = self._get_connection()
             cursor = conn.cursor()
 
+            # WAL 模式：多个进程（--workers、独立的 MCP 进程）同时访问时读写互不阻塞
+            cursor.execute('PRAGMA journal_mode=WAL')
+
             # 创建历史记录表
             cursor.execute('''
             CREATE TABLE IF NOT EXISTS search_history (
@@ -57,6 +62,46 @@ class Database:
             )
             ''')
 
+            # 兼容旧库：批量任务历史表新增并发数字段，用于重启后恢复任务
+            cursor.execute('PRAGMA table_info(batch_task_history)')
+            if 'query_num' not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE batch_task_history ADD COLUMN query_num INTEGER DEFAULT 20')
+
+            # 创建批量任务关键词队列表（state: pending / in_flight / done / failed）
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS batch_task_items (
+                task_name TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                keyword TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (task_name, idx)
+            )
+            ''')
+
+            # 创建查询结果持久缓存表（payload 为 zlib 压缩的 JSON）
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS query_cache (
+                cache_key TEXT PRIMARY KEY,
+                search_type TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                fetched_at REAL NOT NULL,
+                expire_at REAL NOT NULL
+            )
+            ''')
+
+            # 创建详情持久缓存表（payload 为 zlib 压缩的 JSON）
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS detail_cache (
+                service_type INTEGER NOT NULL,
+                data_id TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                expire_at REAL NOT NULL,
+                PRIMARY KEY (service_type, data_id)
+            )
+            ''')
+
             # 创建索引
             cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_search_time
@@ -74,6 +119,18 @@ class Database:
             CREATE INDEX IF NOT EXISTS idx_batch_status
             ON batch_task_history(status)
             ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_batch_items_state
+            ON batch_task_items(task_name, state)
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_query_cache_expire
+            ON query_cache(expire_at)
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_detail_cache_expire
+            ON detail_cache(expire_at)
+            ''')
 
             conn.commit()
             logger.info(f"数据库初始化完成：{self.db_path}")
@@ -234,18 +291,25 @@ class Database:
 
     # ============ 批量任务历史管理 ============
 
-    def add_batch_task(self, task_name, task_type, total_count=0):
-        """添加批量任务"""
+    def add_batch_task(self, task_name, task_type, total_count=0, keywords=None, query_num=20):
+        """添加批量任务，同时写入关键词队列；任务名已存在于历史记录中时失败（返回 None）"""
         # Bug 1 修复：使用线程锁
         with self._lock:
             try:
                 conn = self._get_connection()
                 cursor = conn.cursor()
                 cursor.execute('''
-                INSERT INTO batch_task_history (task_name, task_type, total_count, status)
-                VALUES (?, ?, ?, 'running')
-                ''', (task_name, task_type, total_count))
-                task_id = cursor.lastrowid
+                INSERT INTO batch_task_history (task_name, task_type, total_count, query_num, status)
+                VALUES (?, ?, ?, ?, 'running')
+                ''', (task_name, task_type, total_count, query_num))
+                # 清理删除历史记录时可能残留的队列
+                cursor.execute('DELETE FROM batch_task_items WHERE task_name = ?', (task_name,))
+                if keywords:
+                    cursor.executemany('''
+                    INSERT INTO batch_task_items (task_name, idx, keyword) VALUES (?, ?, ?)
+                    ''', [(task_name, idx, keyword) for idx, keyword in enumerate(keywords)])
+                cursor.execute('SELECT id FROM batch_task_history WHERE task_name = ?', (task_name,))
+                task_id = cursor.fetchone()[0]
                 conn.commit()
                 conn.close()
                 logger.info(f"添加批量任务成功：{task_name}")
@@ -411,19 +475,256 @@ class Database:
 
                 # 删除数据库记录
                 cursor.execute('DELETE FROM batch_task_history WHERE task_name = ?', (task_name,))
+                cursor.execute('DELETE FROM batch_task_items WHERE task_name = ?', (task_name,))
                 conn.commit()
                 conn.close()
 
-                # 删除结果文件
-                if result_file and os.path.exists(result_file):
-                    try:
-                        os.remove(result_file)
-                        logger.info(f"删除结果文件成功：{result_file}")
-                    except Exception as e:
-                        logger.error(f"删除结果文件失败：{e}")
+                # 删除结果文件（及 JSONL 结果的索引文件）
+                for path in (result_file, result_file + '.idx') if result_file else ():
+                    if os.path.exists(path):
+                        try:
+                            os.remove(path)
+                            logger.info(f"删除结果文件成功：{path}")
+                        except Exception as e:
+                            logger.error(f"删除结果文件失败：{e}")
 
                 logger.info(f"删除批量任务成功：{task_name}")
                 return True
             except Exception as e:
                 logger.error(f"删除批量任务失败：{e}")
                 return False
+
+    # ============ 批量任务关键词队列 ============
+
+    def claim_batch_items(self, task_name, limit):
+        """按顺序领取一批待处理的关键词并标记为 in_flight，返回 [(idx, keyword)]"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                SELECT idx, keyword FROM batch_task_items
+                WHERE task_name = ? AND state = 'pending'
+                ORDER BY idx LIMIT ?
+                ''', (task_name, limit))
+                items = [(row[0], row[1]) for row in cursor.fetchall()]
+                cursor.executemany('''
+                UPDATE batch_task_items SET state = 'in_flight', attempts = attempts + 1,
+                    update_time = CURRENT_TIMESTAMP
+                WHERE task_name = ? AND idx = ?
+                ''', [(task_name, idx) for idx, _ in items])
+                conn.commit()
+                conn.close()
+                return items
+            except Exception as e:
+                logger.error(f"领取批量任务关键词失败：{e}")
+                return []
+
+    def finish_batch_item(self, task_name, idx, state):
+        """记录关键词的处理状态，state 为 done 或 failed（结果写入 JSONL 结果文件）"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                UPDATE batch_task_items SET state = ?, update_time = CURRENT_TIMESTAMP
+                WHERE task_name = ? AND idx = ?
+                ''', (state, task_name, idx))
+                conn.commit()
+                conn.close()
+                return True
+            except Exception as e:
+                logger.error(f"更新批量任务关键词状态失败：{e}")
+                return False
+
+    def mark_batch_items_done(self, task_name, idxs):
+        """将结果文件中已有记录的关键词标记为 done"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                cursor.executemany('''
+                UPDATE batch_task_items SET state = 'done', update_time = CURRENT_TIMESTAMP
+                WHERE task_name = ? AND idx = ? AND state != 'done'
+                ''', [(task_name, idx) for idx in idxs])
+                conn.commit()
+                conn.close()
+                return True
+            except Exception as e:
+                logger.error(f"更新批量任务关键词状态失败：{e}")
+                return False
+
+    def reset_inflight_batch_items(self):
+        """将上次运行中断时处于 in_flight 的关键词重置为 pending，返回重置数量"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                cursor.execute("UPDATE batch_task_items SET state = 'pending' WHERE state = 'in_flight'")
+                count = cursor.rowcount
+                conn.commit()
+                conn.close()
+                return count
+            except Exception as e:
+                logger.error(f"重置批量任务关键词状态失败：{e}")
+                return 0
+
+    def get_batch_item_counts(self, task_name):
+        """按状态统计任务的关键词数量，返回 {state: count}"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                SELECT state, COUNT(*) FROM batch_task_items WHERE task_name = ? GROUP BY state
+                ''', (task_name,))
+                counts = {row[0]: row[1] for row in cursor.fetchall()}
+                conn.close()
+                return counts
+            except Exception as e:
+                logger.error(f"统计批量任务关键词失败：{e}")
+                return {}
+
+    def get_unfinished_batch_tasks(self):
+        """获取上次运行时未完成（状态仍为 running）的批量任务"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                SELECT task_name, task_type, total_count, query_num FROM batch_task_history
+                WHERE status = 'running' ORDER BY create_time
+                ''')
+                tasks = [dict(row) for row in cursor.fetchall()]
+                conn.close()
+                return tasks
+            except Exception as e:
+                logger.error(f"获取未完成批量任务失败：{e}")
+                return []
+
+    # ============ 查询结果持久缓存 ============
+
+    def get_cached_result(self, cache_key, max_age=None):
+        """读取未过期的缓存结果，max_age（秒）限制结果的最大年龄，返回 (结果, 获取时间戳) 或 None"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                now = time.time()
+                min_fetched = now - max_age if max_age is not None else 0
+                cursor.execute('''
+                SELECT payload, fetched_at FROM query_cache
+                WHERE cache_key = ? AND expire_at > ? AND fetched_at >= ?
+                ''', (cache_key, now, min_fetched))
+                row = cursor.fetchone()
+                conn.close()
+
+                if row:
+                    return json.loads(zlib.decompress(row[0]).decode('utf-8')), row[1]
+                return None
+            except Exception as e:
+                logger.error(f"读取持久缓存失败：{e}")
+                return None
+
+    def put_cached_result(self, cache_key, search_type, result_data, ttl):
+        """写入缓存结果"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                now = time.time()
+                payload = zlib.compress(json.dumps(result_data, ensure_ascii=False).encode('utf-8'))
+                cursor.execute('''
+                INSERT OR REPLACE INTO query_cache (cache_key, search_type, payload, fetched_at, expire_at)
+                VALUES (?, ?, ?, ?, ?)
+                ''', (cache_key, search_type, payload, now, now + ttl))
+                conn.commit()
+                conn.close()
+                return True
+            except Exception as e:
+                logger.error(f"写入持久缓存失败：{e}")
+                return False
+
+    def sweep_cached_results(self):
+        """清理已过期的缓存结果，返回清理数量"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM query_cache WHERE expire_at <= ?', (time.time(),))
+                count = cursor.rowcount
+                conn.commit()
+                conn.close()
+                return count
+            except Exception as e:
+                logger.error(f"清理持久缓存失败：{e}")
+                return 0
+
+    def get_cached_results_count(self):
+        """获取持久缓存条目数"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                cursor.execute('SELECT COUNT(*) FROM query_cache')
+                count = cursor.fetchone()[0]
+                conn.close()
+                return count
+            except Exception as e:
+                logger.error(f"获取持久缓存条目数失败：{e}")
+                return 0
+
+    # ============ 详情持久缓存 ============
+
+    def get_cached_detail(self, service_type, data_id):
+        """读取未过期的详情，返回详情字典或 None"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                cursor.execute('''
+                SELECT payload FROM detail_cache
+                WHERE service_type = ? AND data_id = ? AND expire_at > ?
+                ''', (service_type, data_id, time.time()))
+                row = cursor.fetchone()
+                conn.close()
+
+                if row:
+                    return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+                return None
+            except Exception as e:
+                logger.error(f"读取详情缓存失败：{e}")
+                return None
+
+    def put_cached_detail(self, service_type, data_id, detail, ttl):
+        """写入详情"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                payload = zlib.compress(json.dumps(detail, ensure_ascii=False).encode('utf-8'))
+                cursor.execute('''
+                INSERT OR REPLACE INTO detail_cache (service_type, data_id, payload, expire_at)
+                VALUES (?, ?, ?, ?)
+                ''', (service_type, data_id, payload, time.time() + ttl))
+                conn.commit()
+                conn.close()
+                return True
+            except Exception as e:
+                logger.error(f"写入详情缓存失败：{e}")
+                return False
+
+    def sweep_cached_details(self):
+        """清理已过期的详情，返回清理数量"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM detail_cache WHERE expire_at <= ?', (time.time(),))
+                count = cursor.rowcount
+                conn.commit()
+                conn.close()
+                return count
+            except Exception as e:
+                logger.error(f"清理详情缓存失败：{e}")
+                return 0
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+APP/小程序/快应用详情缓存模块
+按 (serviceType, dataId) 缓存 queryDetailByAppAndMiniId 的结果，命中时完全跳过上游请求；
+可选以 SQLite（Database.detail_cache）作为持久层，进程内所有 beian 实例共享；
+读写时复制详情，调用方修改返回值不会影响缓存
+"""
+import asyncio
+import copy
+import threading
+from cachetools import TTLCache
+from mlog import logger
+from load_config import config
+
+
+class DetailCache:
+    """详情缓存：内存 TTL 缓存 + 可选数据库持久层"""
+
+    # 清理持久层中过期详情的间隔（秒）
+    SWEEP_INTERVAL = 600
+
+    def __init__(self, db=None):
+        cache_config = getattr(config, 'detail_cache', None)
+        self.enabled = bool(getattr(cache_config, 'enable', False))
+        self.ttl = float(getattr(cache_config, 'ttl', None) or 86400)
+        self.max_entries = int(getattr(cache_config, 'max_entries', None) or 10000)
+        self.db = db
+        self._entries = TTLCache(maxsize=self.max_entries, ttl=self.ttl)
+        self._sweep_task = None
+        # MCP HTTP 线程与主事件循环共用同一实例
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    async def get(self, service_type, data_id):
+        """读取缓存的详情，未命中返回 None"""
+        if not self.enabled:
+            return None
+        key = (int(service_type), str(data_id))
+        with self._lock:
+            detail = self._entries.get(key)
+            if detail is not None:
+                self.hits += 1
+                return copy.deepcopy(detail)
+
+        if self.db is not None:
+            loop = asyncio.get_running_loop()
+            detail = await loop.run_in_executor(None, self.db.get_cached_detail, key[0], key[1])
+            if detail is not None:
+                with self._lock:
+                    self._entries[key] = copy.deepcopy(detail)
+                    self.disk_hits += 1
+                return detail
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def put(self, service_type, data_id, detail):
+        """写入详情"""
+        if not self.enabled:
+            return
+        key = (int(service_type), str(data_id))
+        with self._lock:
+            self._entries[key] = copy.deepcopy(detail)
+            self.stores += 1
+        if self.db is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.db.put_cached_detail, key[0], key[1], detail, self.ttl)
+
+    async def sweep_loop(self):
+        """定期清理持久层中已过期的详情"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.sleep(self.SWEEP_INTERVAL)
+                removed = await loop.run_in_executor(None, self.db.sweep_cached_details)
+                if removed:
+                    logger.info(f"清理过期详情缓存 {removed} 条")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"清理详情缓存出错: {e}")
+
+    def stats(self) -> dict:
+        """命中统计；saved_requests 为因命中而省去的上游详情请求数"""
+        saved = self.hits + self.disk_hits
+        lookups = saved + self.misses
+        return {
+            "enabled": self.enabled,
+            "persist": self.db is not None,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "saved_requests": saved,
+            "hit_ratio": round(saved / lookups, 4) if lookups else 0.0,
+        }
+
+
+# 全局详情缓存实例
+_detail_cache = None
+_detail_cache_lock = threading.Lock()
+
+
+def get_detail_cache() -> DetailCache:
+    """获取全局详情缓存（进程内共享）"""
+    global _detail_cache
+    if _detail_cache is None:
+        with _detail_cache_lock:
+            if _detail_cache is None:
+                db = None
+                if getattr(getattr(config, 'detail_cache', None), 'persist', False):
+                    try:
+                        from database import Database
+                        db = Database()
+                    except Exception as e:
+                        logger.error(f"详情缓存持久层初始化失败，仅使用内存缓存：{e}")
+                _detail_cache = DetailCache(db=db)
+    return _detail_cache
+
+
+async def init_detail_cache(app):
+    """启用持久层时启动过期详情清理任务（用于app启动时）"""
+    detail_cache = get_detail_cache()
+    if detail_cache.enabled and detail_cache.db is not None:
+        detail_cache._sweep_task = asyncio.create_task(detail_cache.sweep_loop())
+
+
+async def cleanup_detail_cache(app):
+    """停止过期详情清理任务（用于app关闭时）"""
+    detail_cache = get_detail_cache()
+    if detail_cache._sweep_task is not None:
+        detail_cache._sweep_task.cancel()
+        try:
+            await detail_cache._sweep_task
+        except asyncio.CancelledError:
+            pass
+        detail_cache._sweep_task = None
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+跨进程出口状态共享模块
+同一主机上的多个服务进程（多实例部署、--mcp-http 独立进程、多 worker）通过一个本地 SQLite 文件（WAL）
+共享代理池、出口拦截名单、限速令牌桶与 token，避免每个进程各自提取代理、各自用满同一 IP 的请求频率；
+数据库不可用时各调用方回退到进程内状态；事件循环上的读写交给本进程的共享库线程执行，不阻塞事件循环
+"""
+import asyncio
+import functools
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+from load_config import config
+from mlog import logger
+
+
+# 单条 IN 查询携带的参数上限（低于 SQLite 默认的 999）
+_IN_CHUNK = 500
+# 每执行多少次写操作清理一次过期数据
+_SWEEP_EVERY = 1024
+# 直接调用时等待其他进程释放写锁的上限（秒），超时即回退到进程内状态
+BUSY_TIMEOUT = 0.05
+# 共享库线程等待写锁的上限（秒）：不在事件循环上执行，可以多等一会儿，减少回退
+WRITE_TIMEOUT = 0.5
+# 写锁繁忙导致回退时，至多每隔该秒数记录一次警告
+BUSY_WARN_INTERVAL = 60
+# 建表时（服务启动、不在请求路径上）允许等待的时间（秒）
+INIT_TIMEOUT = 5.0
+
+
+def _fallback(default=None):
+    """数据库出错时记录日志并返回 default，由调用方回退到进程内状态"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return func(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    self.errors += 1
+                    logger.warning(f"出口共享状态访问失败（{func.__name__}）：{e}")
+                else:
+                    # 其他进程正持有写锁：本次回退到进程内状态，高并发时可能频繁发生，只计数并定期警告
+                    self.busy += 1
+                    self._warn_busy()
+                return default
+            except sqlite3.Error as e:
+                self.errors += 1
+                logger.warning(f"出口共享状态访问失败（{func.__name__}）：{e}")
+                return default
+        return wrapper
+    return decorator
+
+
+class EgressBroker:
+    """基于 SQLite 的跨进程出口状态，时间统一使用墙钟秒（time.time()）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        # 每个线程（及 fork 后的每个进程）各用一个连接
+        self._local = threading.local()
+        self._writes = 0
+        self.errors = 0
+        self.busy = 0
+        self._busy_warned = 0.0
+        self._busy_reported = 0
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+        self._init_db()
+
+    @property
+    def owner(self) -> str:
+        """当前进程标识，用于代理提取的主进程选举"""
+        return str(os.getpid())
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            timeout = getattr(self._local, "timeout", BUSY_TIMEOUT)
+            conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # 共享的都是可重建的临时状态，不需要落盘保证
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：立即取得写锁，避免读后再升级写锁时与其他进程死锁"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        self._writes += 1
+        if self._writes % _SWEEP_EVERY == 0:
+            self.sweep()
+
+    def _warn_busy(self):
+        now = time.monotonic()
+        if now - self._busy_warned >= BUSY_WARN_INTERVAL:
+            logger.warning(f"出口共享状态写锁繁忙，{self.busy - self._busy_reported} 次操作回退到进程内状态（累计 {self.busy} 次）")
+            self._busy_warned = now
+            self._busy_reported = self.busy
+
+    # ---- 共享库线程 ----
+
+    def _thread_init(self):
+        self._local.timeout = WRITE_TIMEOUT
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """本进程的共享库线程（单线程，写操作按提交顺序执行；fork 出的进程各自新建）"""
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._executor_lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix="egress_broker", initializer=self._thread_init)
+                    self._executor_pid = pid
+        return self._executor
+
+    async def run(self, method, *args):
+        """在共享库线程中执行 method 并等待结果，不阻塞事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), method, *args)
+
+    def post(self, method, *args):
+        """在共享库线程中执行不需要结果的写操作，立即返回（出错时由 _fallback 记录）"""
+        self._get_executor().submit(method, *args)
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute(f"PRAGMA busy_timeout={int(INIT_TIMEOUT * 1000)}")
+        try:
+            self._create_tables()
+        finally:
+            conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+
+    def _create_tables(self):
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS proxies (address TEXT PRIMARY KEY, expire REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS blocks (egress TEXT PRIMARY KEY, until REAL NOT NULL, created REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (egress TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS tokens (egress TEXT PRIMARY KEY, token TEXT NOT NULL, expire INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS leaders (name TEXT PRIMARY KEY, owner TEXT NOT NULL, until REAL NOT NULL)")
+
+    @_fallback()
+    def sweep(self):
+        """清理已过期的代理、拦截记录与 token"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM proxies WHERE expire <= ?", (now,))
+        conn.execute("DELETE FROM blocks WHERE until <= ?", (now,))
+        conn.execute("DELETE FROM tokens WHERE expire <= ?", (int(now * 1000),))
+
+    # ---- 主进程选举 ----
+
+    @_fallback(False)
+    def try_lead(self, name: str, ttl: float) -> bool:
+        """获取或续期名为 name 的主进程租约，租约过期（主进程退出）后其他进程可接管"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, until FROM leaders WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO leaders VALUES (?, ?, ?)", (name, self.owner, now + ttl))
+            return True
+
+    @_fallback()
+    def resign(self, name: str):
+        """主动放弃租约（进程退出时）"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leaders WHERE name = ? AND owner = ?", (name, self.owner))
+
+    # ---- 代理池 ----
+
+    @_fallback(False)
+    def put_proxies(self, items: Iterable[Tuple[str, float]]) -> bool:
+        """在一个事务中写入多个代理 [(地址, 过期时间)]，返回是否成功"""
+        with self._transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO proxies VALUES (?, ?)", items)
+        return True
+
+    @_fallback()
+    def remove_proxy(self, address: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM proxies WHERE address = ?", (address,))
+
+    @_fallback()
+    def list_proxies(self) -> Optional[List[Tuple[str, float]]]:
+        """未过期的代理 [(地址, 过期时间)]"""
+        return self._conn().execute("SELECT address, expire FROM proxies WHERE expire > ?", (time.time(),)).fetchall()
+
+    # ---- 拦截名单 ----
+
+    @_fallback()
+    def block(self, egress: str, seconds: float):
+        """登记出口被拦截，隔离 seconds 秒"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO blocks VALUES (?, ?, ?) "
+                "ON CONFLICT(egress) DO UPDATE SET until = MAX(until, excluded.until), created = excluded.created",
+                (egress, now + seconds, now))
+
+    @_fallback()
+    def blocks_since(self, since: float) -> Optional[List[Tuple[str, float, float]]]:
+        """since 之后登记且仍在隔离中的出口 [(出口, 隔离截止时间, 登记时间)]"""
+        return self._conn().execute(
+            "SELECT egress, until, created FROM blocks WHERE created > ? AND until > ?", (since, time.time())
+        ).fetchall()
+
+    # ---- 限速令牌桶 ----
+
+    @_fallback()
+    def reserve(self, egress: str, rate: float, burst: float) -> Optional[float]:
+        """预约一个令牌，返回需要等待的秒数"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE egress = ?", (egress,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (egress, tokens, now))
+        return 0.0 if tokens >= 0 else -tokens / rate
+
+    @_fallback()
+    def tokens(self, egresses: Iterable[str], rate: float, burst: float) -> Optional[Dict[str, float]]:
+        """各出口当前可用的令牌数，没有记录的出口为 burst"""
+        egresses = list(egresses)
+        now = time.time()
+        result = dict.fromkeys(egresses, burst)
+        conn = self._conn()
+        for start in range(0, len(egresses), _IN_CHUNK):
+            chunk = egresses[start:start + _IN_CHUNK]
+            rows = conn.execute(
+                f"SELECT egress, tokens, updated FROM buckets WHERE egress IN ({','.join('?' * len(chunk))})", chunk)
+            for egress, tokens, updated in rows:
+                result[egress] = min(burst, tokens + (now - updated) * rate)
+        return result
+
+    @_fallback()
+    def prune_buckets(self, rate: float, burst: float):
+        """删除已补满的令牌桶"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM buckets WHERE tokens + (? - updated) * ? >= ?", (time.time(), rate, burst))
+
+    # ---- token ----
+
+    @_fallback()
+    def get_token(self, egress: str) -> Optional[Tuple[str, int]]:
+        """其他进程为该出口申请的有效 token：(token, 过期时间戳毫秒)"""
+        row = self._conn().execute(
+            "SELECT token, expire FROM tokens WHERE egress = ? AND expire > ?", (egress, int(time.time() * 1000))
+        ).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    @_fallback()
+    def put_token(self, egress: str, token: str, expire: int):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)", (egress, token, expire))
+
+    @_fallback()
+    def invalidate_token(self, egress: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM tokens WHERE egress = ?", (egress,))
+
+    @_fallback({})
+    def stats(self) -> dict:
+        """共享状态统计"""
+        conn = self._conn()
+        now = time.time()
+        return {
+            "path": self.path,
+            "proxies": conn.execute("SELECT COUNT(*) FROM proxies WHERE expire > ?", (now,)).fetchone()[0],
+            "blocks": conn.execute("SELECT COUNT(*) FROM blocks WHERE until > ?", (now,)).fetchone()[0],
+            "buckets": conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0],
+            "tokens": conn.execute("SELECT COUNT(*) FROM tokens WHERE expire > ?", (int(now * 1000),)).fetchone()[0],
+            "leaders": dict(conn.execute("SELECT name, owner FROM leaders WHERE until > ?", (now,)).fetchall()),
+            "errors": self.errors,
+            "busy": self.busy,
+        }
+
+
+def wall_to_monotonic(wall: float) -> float:
+    """墙钟时间换算为本进程的 time.monotonic() 时间"""
+    return time.monotonic() + (wall - time.time())
+
+
+def monotonic_to_wall(mono: float) -> float:
+    """time.monotonic() 时间换算为墙钟时间"""
+    return time.time() + (mono - time.monotonic())
+
+
+# 全局共享状态实例
+_broker = None
+_broker_loaded = False
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> Optional[EgressBroker]:
+    """获取跨进程共享状态（未启用或初始化失败时返回 None，各模块只使用进程内状态）"""
+    global _broker, _broker_loaded
+    if not _broker_loaded:
+        with _broker_lock:
+            if not _broker_loaded:
+                broker_config = getattr(config, 'broker', None)
+                if getattr(broker_config, 'enable', False):
+                    path = getattr(broker_config, 'path', None) or "egress_broker.db"
+                    try:
+                        _broker = EgressBroker(path)
+                        logger.info(f"已启用跨进程出口状态共享：{path}")
+                    except sqlite3.Error as e:
+                        logger.error(f"跨进程出口状态共享初始化失败，使用进程内状态：{e}")
+                _broker_loaded = True
+    return _broker
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+出口健康评分模块
+按出口（本地 IPv6、代理、直连）记录请求延迟 EWMA、请求成功率、验证码通过率与最近一次被拦截的时间，
+选择出口时在有限速令牌的候选中随机取两个、选评分较高者（power of two choices），
+被拦截或成功率过低的出口自动隔离一段时间；
+启用跨进程共享（broker）时拦截记录写入共享库，其他进程最迟 SYNC_INTERVAL 秒后同步隔离该出口
+"""
+import random
+import threading
+import time
+from typing import Callable, Iterable, Optional
+from load_config import config
+from egress_broker import get_broker, wall_to_monotonic
+
+
+class _EgressStats:
+    """单个出口的健康状态，未知出口按健康处理以便获得试用机会"""
+
+    __slots__ = ("latency", "success", "captcha", "samples", "last_block", "quarantined_until", "last_seen")
+
+    def __init__(self, now):
+        self.latency = None  # 请求延迟 EWMA（秒）
+        self.success = 1.0  # 请求成功率 EWMA
+        self.captcha = 1.0  # 验证码通过率 EWMA
+        self.samples = 0
+        self.last_block = 0.0
+        self.quarantined_until = 0.0
+        self.last_seen = now
+
+
+class EgressHealth:
+    """出口健康评分与加权选择"""
+
+    # 平滑系数：新样本所占权重
+    ALPHA = 0.2
+    # 跟踪的出口数超过该值时清理长期未使用的出口
+    MAX_EGRESSES = 4096
+    IDLE_TTL = 3600
+    # 从共享库同步其他进程拦截记录的间隔（秒）
+    SYNC_INTERVAL = 1.0
+
+    def __init__(self):
+        health_config = getattr(config, 'egress_health', None)
+        enable = getattr(health_config, 'enable', None)
+        self.enabled = True if enable is None else bool(enable)
+        # 被拦截后的隔离时间，以及隔离结束后评分逐步恢复的时间（秒）
+        self.block_quarantine = float(getattr(health_config, 'block_quarantine', None) or 300)
+        self.block_recovery = float(getattr(health_config, 'block_recovery', None) or 600)
+        # 成功率低于 min_success（且样本数不少于 min_samples）时隔离 quarantine 秒
+        self.min_success = float(getattr(health_config, 'min_success', None) or 0.5)
+        self.min_samples = int(getattr(health_config, 'min_samples', None) or 5)
+        self.quarantine = float(getattr(health_config, 'quarantine', None) or 60)
+        self._egresses = {}  # {egress_key: _EgressStats}
+        # MCP HTTP 线程与主事件循环共用同一实例
+        self._lock = threading.Lock()
+        self.blocks = 0
+        self.quarantines = 0
+        self._broker = get_broker()
+        self._synced_at = 0.0  # 上次同步的单调时间
+        self._synced_wall = 0.0  # 已同步到的登记时间（墙钟）
+        self.shared_blocks = 0
+
+    def _stats(self, key, now) -> _EgressStats:
+        stats = self._egresses.get(key)
+        if stats is None:
+            if len(self._egresses) >= self.MAX_EGRESSES:
+                for old in [k for k, s in self._egresses.items()
+                            if now - s.last_seen > self.IDLE_TTL and s.quarantined_until <= now]:
+                    del self._egresses[old]
+            stats = self._egresses[key] = _EgressStats(now)
+        stats.last_seen = now
+        return stats
+
+    def _quarantine(self, stats, seconds, now):
+        stats.quarantined_until = max(stats.quarantined_until, now + seconds)
+        self.quarantines += 1
+
+    def record(self, key, success: bool, latency: Optional[float] = None):
+        """记录一次上游请求的结果与耗时"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats(key, now)
+            stats.samples += 1
+            stats.success += self.ALPHA * ((1.0 if success else 0.0) - stats.success)
+            if success and latency is not None:
+                stats.latency = latency if stats.latency is None else stats.latency + self.ALPHA * (latency - stats.latency)
+            if (not success and stats.samples >= self.min_samples and stats.success < self.min_success
+                    and stats.quarantined_until <= now):
+                self._quarantine(stats, self.quarantine, now)
+                # 隔离结束后给一次重新证明的机会
+                stats.success = self.min_success
+                stats.samples = 0
+
+    def record_captcha(self, key, passed: bool):
+        """记录一次打码结果"""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stats(key, time.monotonic())
+            stats.captcha += self.ALPHA * ((1.0 if passed else 0.0) - stats.captcha)
+
+    def record_block(self, key):
+        """出口被创宇盾拦截：立即隔离"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats(key, now)
+            stats.last_block = now
+            stats.success += self.ALPHA * (0.0 - stats.success)
+            self.blocks += 1
+            self._quarantine(stats, self.block_quarantine, now)
+        if self._broker is not None:
+            # 写入共享库交给共享库线程，不在事件循环上等待写锁
+            self._broker.post(self._broker.block, key, self.block_quarantine)
+
+    def _sync_blocks(self):
+        """按间隔从共享库拉取其他进程新登记的拦截记录"""
+        if self._broker is None:
+            return
+        now = time.monotonic()
+        if now - self._synced_at < self.SYNC_INTERVAL:
+            return
+        self._synced_at = now
+        rows = self._broker.blocks_since(self._synced_wall)
+        if not rows:
+            return
+        with self._lock:
+            for key, until, created in rows:
+                self._synced_wall = max(self._synced_wall, created)
+                until = wall_to_monotonic(until)
+                stats = self._stats(key, now)
+                if stats.quarantined_until >= until - 1:
+                    # 本进程自己登记的或已同步过的（两个时钟换算有微小误差）
+                    continue
+                stats.last_block = wall_to_monotonic(created)
+                stats.quarantined_until = until
+                self.shared_blocks += 1
+
+    def is_quarantined(self, key) -> bool:
+        self._sync_blocks()
+        stats = self._egresses.get(key)
+        return stats is not None and stats.quarantined_until > time.monotonic()
+
+    def _score(self, stats: Optional[_EgressStats], now) -> float:
+        """评分越高越好：成功率 × 验证码通过率 × 延迟因子 × 拦截恢复因子"""
+        if stats is None:
+            return 1.0
+        score = stats.success * max(stats.captcha, 0.05)
+        if stats.latency is not None:
+            score /= 1.0 + stats.latency
+        if stats.last_block:
+            score *= min(1.0, 0.1 + (now - stats.last_block) / self.block_recovery)
+        return score
+
+    def score(self, key) -> float:
+        return self._score(self._egresses.get(key), time.monotonic())
+
+    def choose(self, keys: Iterable[str], limiter=None) -> Optional[str]:
+        """
+        选择出口：排除隔离中的出口（全部隔离时不排除），有限速器时只在有令牌的出口中选择，
+        都没有令牌时选择令牌最多的；候选中随机取两个，返回评分较高者
+        """
+        keys = list(keys)
+        if not keys:
+            return None
+        if not self.enabled:
+            return limiter.choose(keys) if limiter is not None else random.choice(keys)
+
+        self._sync_blocks()
+        now = time.monotonic()
+        with self._lock:
+            healthy = [k for k in keys if k not in self._egresses or self._egresses[k].quarantined_until <= now]
+        candidates = healthy or keys
+
+        if limiter is not None and limiter.enabled:
+            tokens = limiter.tokens_many(candidates)
+            ready = [key for key in candidates if tokens[key] >= 1]
+            if not ready:
+                return max(candidates, key=tokens.get)
+            candidates = ready
+
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        with self._lock:
+            first_score = self._score(self._egresses.get(first), now)
+            second_score = self._score(self._egresses.get(second), now)
+        return first if first_score >= second_score else second
+
+    def pick(self, sample: Callable[[], Optional[str]], limiter=None, exclude=None, tries: int = 8) -> Optional[str]:
+        """
+        与 choose 相同的选择规则，但通过 sample（O(1) 随机抽取）最多抽 tries 次，不遍历全部出口，适合大地址池；
+        exclude 判定为不可用的出口直接跳过。抽样全部落空时返回 None，由调用方改为遍历选择
+        """
+        if self.enabled:
+            self._sync_blocks()
+        now = time.monotonic()
+        sampled = []
+        for _ in range(tries):
+            key = sample()
+            if key is None:
+                return None
+            if key in sampled or (exclude is not None and exclude(key)):
+                continue
+            if self.enabled:
+                stats = self._egresses.get(key)
+                if stats is not None and stats.quarantined_until > now:
+                    continue
+            sampled.append(key)
+        if not sampled:
+            return None
+
+        found = sampled
+        if limiter is not None and limiter.enabled and self.enabled:
+            # 抽中的出口一次取完令牌数（启用共享时只查询一次共享库）
+            tokens = limiter.tokens_many(sampled)
+            found = [key for key in sampled if tokens[key] >= 1]
+            if not found:
+                return max(sampled, key=tokens.get)
+        if len(found) == 1 or not self.enabled:
+            return found[0]
+        first, second = found[0], found[1]
+        with self._lock:
+            first_score = self._score(self._egresses.get(first), now)
+            second_score = self._score(self._egresses.get(second), now)
+        return first if first_score >= second_score else second
+
+    def stats(self) -> dict:
+        """健康统计，列出隔离中的出口"""
+        self._sync_blocks()
+        now = time.monotonic()
+        with self._lock:
+            quarantined = {k: round(s.quarantined_until - now, 1)
+                           for k, s in self._egresses.items() if s.quarantined_until > now}
+        return {
+            "enabled": self.enabled,
+            "egresses": len(self._egresses),
+            "blocks": self.blocks,
+            "quarantines": self.quarantines,
+            "shared_blocks": self.shared_blocks,
+            "quarantined": quarantined,
+        }
+
+
+# 全局出口健康实例
+_egress_health = None
+_egress_health_lock = threading.Lock()
+
+
+def get_egress_health() -> EgressHealth:
+    """获取全局出口健康评分（进程内共享，代理池、IPv6 地址池与各查询处理器共用）"""
+    global _egress_health
+    if _egress_health is None:
+        with _egress_health_lock:
+            if _egress_health is None:
+                _egress_health = EgressHealth()
+    return _egress_health
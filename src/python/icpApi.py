@@ -20,15 +20,21 @@ if sys.stderr.encoding != 'utf-8':
 from mlog import logger
 from load_config import config
 from database import Database
+from result_cache import ResultCache, init_result_cache, cleanup_result_cache
+from detail_cache import init_detail_cache, cleanup_detail_cache
 from ymicp import beian
 from utils import get_resource_path, is_valid_url
 from task_manager import TaskManager, setup_signal_handlers
 from log_collector import LogCollector, CollectorHandler, log_collector
 from proxy_pool import init_proxy_pool_task, cleanup_proxy_pool_task
 from ipv6_pool import init_ipv6_pool, cleanup_ipv6_pool
+from captcha_solver import init_captcha_solver, cleanup_captcha_solver
 from middlewares import options_middleware, auth_middleware
 from routes import setup_routes
+from routes.batch_routes import resume_batch_tasks
+from sse import close_streams
 from auth import auth_enabled
+import workers
 
 
 VERSION="0.7.1"
@@ -62,13 +68,22 @@ def setup_logging():
     logging.getLogger().addHandler(collector_handler)
 
 
-def create_app():
-    """创建并配置应用"""
+def create_app(worker=None):
+    """创建并配置应用；worker 为多 worker 模式下的编号，0 号（或单进程）负责批量任务等只能有一份的工作"""
     # 创建应用实例
     app = web.Application()
+    primary = worker is None or worker == 0
+    app["primary_worker"] = primary
     
     # 初始化查询处理器
     myicp = beian()
+    app['icp'] = myicp
+    app.on_cleanup.append(_cleanup_icp)
+
+    # 验证码识别执行器
+    if config.captcha.enable:
+        app.on_startup.append(init_captcha_solver)
+        app.on_cleanup.append(cleanup_captcha_solver)
     app['appth'] = {
         "web": myicp.ymWeb,      # 网站
         "app": myicp.ymApp,      # APP
@@ -90,6 +105,14 @@ def create_app():
     
     # 初始化数据库
     app["db"] = Database()
+
+    # 查询结果缓存（内存 + 数据库持久层）
+    app['result_cache'] = ResultCache(db=app["db"])
+    app.on_startup.append(init_result_cache)
+    app.on_cleanup.append(cleanup_result_cache)
+    # 详情缓存持久层的过期清理（与查询结果缓存是否持久化无关）
+    app.on_startup.append(init_detail_cache)
+    app.on_cleanup.append(cleanup_detail_cache)
     
     # 设置模板
     aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader(get_resource_path("templates")))
@@ -115,6 +138,13 @@ def create_app():
             else:
                 logger.warning("当前启用了API提取代理，但该地址似乎无效，将不使用该代理")
     
+    # 恢复上次未完成的批量任务（在代理池启动之后）
+    if primary:
+        app.on_startup.append(resume_batch_tasks)
+
+    # 服务关闭时结束 SSE 推送连接
+    app.on_shutdown.append(close_streams)
+
     # 设置路由
     setup_routes(app)
 
@@ -124,12 +154,28 @@ def create_app():
 
     # 可选：启动 MCP Streamable HTTP（独立端口）
     mcp_cfg = getattr(config, "mcp", None)
-    if mcp_cfg and getattr(mcp_cfg, "enable", False):
+    if primary and mcp_cfg and getattr(mcp_cfg, "enable", False):
         app.on_startup.append(_start_mcp_http)
+
+    # 多 worker：非主 worker 把批量任务请求转发给主 worker
+    if worker is not None:
+        workers.setup_worker(app, worker, config.system.port)
     
     return app
 
 
+def _create_worker_app(index):
+    """worker 进程内创建应用"""
+    app = create_app(worker=index)
+    setup_logging()
+    return app
+
+
+async def _cleanup_icp(app):
+    """关闭查询处理器持有的上游会话池"""
+    await app['icp'].cleanup()
+
+
 async def _start_mcp_http(app):
     """后台线程启动 MCP HTTP 服务"""
     import threading
@@ -155,6 +201,8 @@ def _parse_args(argv=None):
     parser.add_argument("--mcp-http", action="store_true", help="仅启动 MCP Streamable HTTP")
     parser.add_argument("--host", default=None, help="MCP HTTP 监听地址（默认 0.0.0.0）")
     parser.add_argument("--port", type=int, default=None, help="MCP HTTP 端口（默认读 config mcp.port）")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Web/API 工作进程数（默认读 config system.workers，需要 Linux 等支持 SO_REUSEPORT 的系统）")
     return parser.parse_args(argv)
 
 
@@ -179,6 +227,14 @@ def main(argv=None):
     # 打印横幅
     print_banner()
 
+    worker_count = max(1, int(args.workers or config.system.workers or 1))
+    if worker_count > 1 and not workers.supported():
+        logger.warning("当前系统不支持 SO_REUSEPORT，忽略 workers 配置，以单进程运行")
+        worker_count = 1
+    if worker_count > 1:
+        _serve_workers(worker_count)
+        return
+
     # 创建应用
     app = create_app()
 
@@ -206,5 +262,19 @@ def main(argv=None):
     web.run_app(app, host=config.system.host, port=config.system.port)
 
 
+def _serve_workers(count):
+    """多 worker 模式：主进程只负责启动与守护 worker，应用在各 worker 进程内创建"""
+    if config.system.web_ui:
+        print(f"\nweb ui: http://{'127.0.0.1' if config.system.host == '0.0.0.0' else config.system.host}:{config.system.port}\n\n"
+              "按 Ctrl + C 退出程序\n")
+    logger.info(f"服务启动 - 监听地址: {config.system.host}:{config.system.port}，worker 数: {count}")
+    if not getattr(getattr(config, "broker", None), "enable", False):
+        logger.warning("多 worker 时建议启用 broker，否则各 worker 分别提取代理、分别计算出口限速")
+    workers.serve(count, _create_worker_app, config.system.host, config.system.port)
+
+
 if __name__ == "__main__":
+    # 进程池模式的验证码执行器在打包环境下需要
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
@@ -4,34 +4,67 @@ IPv6地址池管理模块
 负责IPv6地址的获取、验证、维护和轮询
 """
 import asyncio
-import random
+import ipaddress
 import time
 import socket
 import aiohttp
 from typing import List, Optional
 from mlog import logger
 from load_config import config
-from utils import get_local_ipv6_addresses, configure_ipv6_addresses, is_public_ipv6, check_has_permanent_ipv6
+from utils import (get_local_ipv6_addresses, configure_ipv6_addresses, is_public_ipv6, check_has_permanent_ipv6,
+                   ipv6_backend, AddressSet)
+from rate_limiter import get_rate_limiter
+import netlink
+from egress_health import get_egress_health
+
+
+# 使用 netlink 变更订阅时，仍每隔该秒数全量核对一次系统地址
+FULL_REFRESH_INTERVAL = 300
+
+
+def select_address(addresses: AddressSet, exclude=None) -> Optional[str]:
+    """
+    从地址集合中选择出口：随机抽样，跳过 exclude 判定为不可用的地址，按健康评分与限速令牌取较优者；
+    抽样全部落空时才遍历整个集合
+    """
+    health = get_egress_health()
+    limiter = get_rate_limiter()
+    address = health.pick(addresses.sample, limiter, exclude)
+    if address is None and addresses:
+        candidates = [a for a in addresses if exclude is None or not exclude(a)]
+        address = health.choose(candidates, limiter)
+    return address
 
 
 class IPv6AddressPool:
     """IPv6地址池管理类"""
     
-    def __init__(self):
-        """初始化IPv6地址池"""
+    def __init__(self, manage: bool = True):
+        """初始化IPv6地址池；manage 为 False 时只跟随系统地址，不增删网卡地址（多 worker 时由主 worker 负责）"""
         self.active_addresses = {}  # {address: last_verified_time}
+        self.addresses = AddressSet()  # 与 active_addresses 同步，供查询时 O(1) 选择
         self.system_addresses = []  # 系统中实际存在的地址列表
         self.lock = asyncio.Lock()
         self.pool_size = config.proxy.local_ipv6_pool.pool_num
         self.check_interval = config.proxy.local_ipv6_pool.check_interval
         self.network_card = config.proxy.local_ipv6_pool.ipv6_network_card
+        self.manage = manage
         self._maintenance_task = None
         self._last_prefix = None  # 记录上次的IPv6前缀
+        self._monitor = None  # netlink 地址变更订阅，可用时按增量同步系统地址
+        self._last_full_refresh = 0.0
         
     async def initialize(self):
         """初始化地址池"""
         logger.info("初始化IPv6地址池...")
         
+        # 先订阅地址变更再读取现有地址，避免遗漏两者之间的变化
+        if ipv6_backend() == "netlink":
+            try:
+                self._monitor = netlink.AddressMonitor()
+            except OSError as e:
+                logger.warning(f"订阅IPv6地址变更失败，维护时将全量读取系统地址: {e}")
+
         # 获取系统中现有的IPv6地址
         await self._refresh_system_addresses()
         
@@ -40,7 +73,8 @@ class IPv6AddressPool:
             return False
         
         # 检测是否存在永久有效的IPv6地址（云服务器特征）
-        has_permanent, sample_addr = check_has_permanent_ipv6()
+        loop = asyncio.get_running_loop()
+        has_permanent, sample_addr = await loop.run_in_executor(None, check_has_permanent_ipv6)
         if has_permanent:
             logger.warning("=" * 80)
             logger.warning("⚠️  检测到系统中存在永久有效的IPv6地址（valid_lft forever）")
@@ -69,7 +103,7 @@ class IPv6AddressPool:
                 if not is_public_ipv6(addr):
                     logger.warning(f"IPv6地址不是公网地址（网段检测）: {addr}")
                     return False
-                self.active_addresses[addr] = time.time()
+                self._activate(addr)
                 verified_count += 1
                 logger.info(f"✓ IPv6地址可用: {addr}")
                 return True
@@ -94,7 +128,9 @@ class IPv6AddressPool:
             return False
         
         # 如果地址数量不足，自动补充
-        if len(self.active_addresses) < self.pool_size:
+        if not self.manage:
+            logger.info(f"已加载 {len(self.active_addresses)} 个IPv6地址，地址增删由主 worker 负责")
+        elif len(self.active_addresses) < self.pool_size:
             needed = self.pool_size - len(self.active_addresses)
             logger.info(f"当前有 {len(self.active_addresses)} 个可用IPv6地址，需要补充 {needed} 个")
             await self._add_addresses(needed)
@@ -105,15 +141,56 @@ class IPv6AddressPool:
         await self.start_maintenance()
         return True
     
+    def _activate(self, address: str):
+        """地址加入活跃池"""
+        self.active_addresses[address] = time.time()
+        self.addresses.add(address)
+
+    def _deactivate(self, address: str):
+        """地址移出活跃池"""
+        self.active_addresses.pop(address, None)
+        self.addresses.discard(address)
+
+    def select(self, exclude=None) -> Optional[str]:
+        """为一次查询选择地址，见 select_address"""
+        return select_address(self.addresses, exclude)
+
     async def _refresh_system_addresses(self):
-        """刷新系统中实际存在的IPv6地址"""
-        all_addresses = get_local_ipv6_addresses()
+        """全量读取系统中实际存在的IPv6地址（在执行器中执行，不阻塞事件循环）"""
+        loop = asyncio.get_running_loop()
+        all_addresses = await loop.run_in_executor(None, get_local_ipv6_addresses)
         self.system_addresses = [addr for addr in all_addresses if is_public_ipv6(addr)]
+        self._last_full_refresh = time.monotonic()
         logger.debug(f"系统中有 {len(self.system_addresses)} 个公网IPv6地址")
+
+    async def _sync_system_addresses(self) -> bool:
+        """
+        同步系统地址，返回是否有变化：有 netlink 变更订阅时只应用积压的增量；
+        没有订阅、通知丢失或距上次全量读取超过 FULL_REFRESH_INTERVAL 时全量读取
+        """
+        changes = self._monitor.read_changes() if self._monitor is not None else None
+        if changes is None or time.monotonic() - self._last_full_refresh > FULL_REFRESH_INTERVAL:
+            before = set(self.system_addresses)
+            await self._refresh_system_addresses()
+            return before != set(self.system_addresses)
+        if not changes:
+            return False
+
+        current = dict.fromkeys(self.system_addresses)
+        for added, address in changes:
+            if not is_public_ipv6(address):
+                continue
+            if added:
+                current[address] = None
+            else:
+                current.pop(address, None)
+        changed = list(current) != self.system_addresses
+        self.system_addresses = list(current)
+        return changed
     
     def _extract_prefix(self, address: str) -> str:
-        """提取IPv6地址的前64位前缀"""
-        parts = address.split(":")
+        """提取IPv6地址的前64位前缀（先展开，兼容压缩写法）"""
+        parts = ipaddress.IPv6Address(address).exploded.split(":")
         return ":".join(parts[0:4])
     
     async def _verify_ipv6_address(self, address: str) -> bool:
@@ -156,58 +233,54 @@ class IPv6AddressPool:
             return False
     
     async def _add_addresses(self, count: int):
-        """添加指定数量的IPv6地址（不再校验新地址，只要本地存在且为公网地址就加入池）"""
+        """批量添加指定数量的IPv6地址（不再校验新地址，只要本地存在且为公网地址就加入池）"""
         if not self._last_prefix:
             logger.error("无法添加IPv6地址：未知前缀")
             return 0
 
-        logger.info(f"尝试添加 {count} 个IPv6地址...")
+        backend = ipv6_backend()
+        logger.info(f"尝试添加 {count} 个IPv6地址（{backend}）...")
         added = 0
-        max_attempts = count * 3  # 最多尝试次数（考虑到可能有失败的）
-        attempts = 0
+        max_rounds = 3  # 每轮一次性添加仍缺少的数量，最多尝试轮数
 
-        while added < count and attempts < max_attempts:
-            attempts += 1
+        for attempt in range(1, max_rounds + 1):
+            needed = count - added
+            if needed <= 0:
+                break
             try:
-                # 生成新地址
-                configure_ipv6_addresses(self._last_prefix, 1, self.network_card)
-                await asyncio.sleep(0.5)  # 等待系统应用配置
-
-                # 重新获取系统地址
-                old_system_addresses = set(self.system_addresses)
-                await self._refresh_system_addresses()
-
-                # 找出新增的地址
-                new_addresses = set(self.system_addresses) - old_system_addresses - set(self.active_addresses.keys())
-
-                if new_addresses:
-                    for new_addr in new_addresses:
-                        # 只要本地存在且为公网地址就直接加入池
-                        if is_public_ipv6(new_addr):
-                            self.active_addresses[new_addr] = time.time()
-                            logger.info(f"✓ 成功添加IPv6地址: {new_addr}")
-                            added += 1
-                            break
-                        else:
-                            logger.warning(f"新添加的IPv6地址不是公网地址: {new_addr}")
+                loop = asyncio.get_running_loop()
+                configured = await loop.run_in_executor(
+                    None, configure_ipv6_addresses, self._last_prefix, needed, self.network_card
+                )
+                if backend == "subprocess":
+                    await asyncio.sleep(0.5)  # 等待系统应用配置
+                    await self._refresh_system_addresses()
                 else:
-                    logger.warning(f"添加IPv6地址可能失败，未检测到新地址（尝试 {attempts}/{max_attempts}）")
+                    # netlink 已逐条确认添加成功，只需应用变更通知
+                    await self._sync_system_addresses()
 
+                # 以系统实际存在的地址为准
+                system_addr_set = set(self.system_addresses)
+                for new_addr in configured:
+                    if new_addr in system_addr_set and new_addr not in self.active_addresses and is_public_ipv6(new_addr):
+                        self._activate(new_addr)
+                        added += 1
+                        logger.debug(f"✓ 成功添加IPv6地址: {new_addr}")
+
+                if added < count:
+                    logger.warning(f"本轮添加IPv6地址不足，已添加 {added}/{count}（第 {attempt}/{max_rounds} 轮）")
             except Exception as e:
                 logger.error(f"添加IPv6地址时出错: {e}")
 
-            # 如果还需要继续添加，短暂等待
-            if added < count:
-                await asyncio.sleep(0.5)
-
-        logger.info(f"添加完成：成功 {added}/{count} 个，共尝试 {attempts} 次")
+        logger.info(f"添加完成：成功 {added}/{count} 个")
         return added
-    
+
     async def _cleanup_invalid_addresses(self):
-        """清理失效的IPv6地址"""
+        """清理失效的IPv6地址（系统地址无变化时直接返回）"""
         async with self.lock:
-            # 刷新系统地址列表
-            await self._refresh_system_addresses()
+            # 同步系统地址列表
+            if not await self._sync_system_addresses():
+                return 0
             system_addr_set = set(self.system_addresses)
             
             # 检查活跃池中的地址
@@ -219,7 +292,7 @@ class IPv6AddressPool:
             # 移除失效地址
             if invalid_addresses:
                 for addr in invalid_addresses:
-                    del self.active_addresses[addr]
+                    self._deactivate(addr)
                     logger.warning(f"IPv6地址已失效，已移除: {addr}")
                 logger.info(f"清理了 {len(invalid_addresses)} 个失效的IPv6地址")
             
@@ -238,19 +311,36 @@ class IPv6AddressPool:
             # 清空活跃池，因为旧地址都失效了
             old_count = len(self.active_addresses)
             self.active_addresses.clear()
+            self.addresses.clear()
             
             # 重新添加系统中的地址
             for addr in self.system_addresses:
                 if self._extract_prefix(addr) == current_prefix:
-                    self.active_addresses[addr] = time.time()
+                    self._activate(addr)
             
             logger.info(f"前缀变化导致清理了 {old_count} 个旧地址，重新加载了 {len(self.active_addresses)} 个地址")
             return True
         
         return False
     
+    async def _follow_system_addresses(self):
+        """只跟随系统地址：其他进程新增的公网地址加入活跃池，已消失的移出"""
+        async with self.lock:
+            if not await self._sync_system_addresses():
+                return
+            system_addr_set = set(self.system_addresses)
+            for addr in list(self.active_addresses):
+                if addr not in system_addr_set:
+                    self._deactivate(addr)
+            for addr in self.system_addresses:
+                if addr not in self.active_addresses:
+                    self._activate(addr)
+
     async def maintain_pool(self):
         """维护地址池：清理失效地址并补充新地址"""
+        if not self.manage:
+            await self._follow_system_addresses()
+            return
         try:
             # 1. 清理失效地址
             removed = await self._cleanup_invalid_addresses()
@@ -305,15 +395,18 @@ class IPv6AddressPool:
             except asyncio.CancelledError:
                 pass
             logger.info("IPv6地址池维护任务已停止")
+        if self._monitor is not None:
+            self._monitor.close()
+            self._monitor = None
     
     async def get_random_address(self) -> Optional[str]:
-        """获取一个随机的IPv6地址"""
+        """获取一个IPv6地址：跳过隔离中的地址，按健康评分与限速令牌加权选择"""
         async with self.lock:
             if not self.active_addresses:
                 logger.error("IPv6地址池为空，无法获取地址")
                 return None
             
-            address = random.choice(list(self.active_addresses.keys()))
+            address = self.select()
             logger.debug(f"使用IPv6地址: {address}")
             return address
     
@@ -335,7 +428,7 @@ async def init_ipv6_pool(app):
     global _ipv6_pool
     
     logger.info("启用本地IPv6地址池管理")
-    _ipv6_pool = IPv6AddressPool()
+    _ipv6_pool = IPv6AddressPool(manage=app.get("primary_worker", True))
     success = await _ipv6_pool.initialize()
     
     if success:
@@ -344,6 +437,9 @@ async def init_ipv6_pool(app):
     else:
         logger.error("IPv6地址池初始化失败")
         app['ipv6_pool'] = None
+        # 查询改用本机现有地址
+        await _ipv6_pool.stop_maintenance()
+        _ipv6_pool = None
 
 
 async def cleanup_ipv6_pool(app):
@@ -3,7 +3,9 @@
 日志收集器模块
 用于收集和管理系统运行时日志
 """
+import asyncio
 from collections import deque
+from itertools import islice
 import threading
 from datetime import datetime
 import logging
@@ -14,21 +16,59 @@ class LogCollector:
     def __init__(self, maxlen=1000):
         self.logs = deque(maxlen=maxlen)
         self.lock = threading.Lock()
+        self._last_id = 0  # 日志序号单调递增，清空后也不重置
+        self._subscribers = {}  # {asyncio.Event: loop}
     
     def add_log(self, message, level='INFO'):
-        """添加日志"""
+        """添加日志（可在任意线程调用），并通知推送订阅者"""
         with self.lock:
+            self._last_id += 1
             self.logs.append({
+                'id': self._last_id,
                 'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                 'message': message,
                 'level': level
             })
+            subscribers = list(self._subscribers.items())
+        for event, loop in subscribers:
+            if not event.is_set():
+                try:
+                    loop.call_soon_threadsafe(event.set)
+                except RuntimeError:
+                    # 事件循环已关闭
+                    pass
     
     def get_logs(self, limit=500):
         """获取日志列表"""
         with self.lock:
-            logs_list = list(self.logs)
-            return logs_list[-limit:] if len(logs_list) > limit else logs_list
+            start = max(0, len(self.logs) - limit)
+            return list(islice(self.logs, start, None))
+
+    def get_logs_since(self, last_id, limit=500):
+        """获取序号大于 last_id 的日志，返回 (日志列表, 因缓冲区溢出而丢失的条数)"""
+        with self.lock:
+            if not self.logs:
+                return [], 0
+            first_id = self.logs[0]['id']
+            start = max(0, last_id + 1 - first_id)
+            dropped = max(0, first_id - last_id - 1)
+            return list(islice(self.logs, start, start + limit)), dropped
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def subscribe(self):
+        """订阅新日志通知（须在事件循环中调用），返回有新日志时被置位的 asyncio.Event"""
+        event = asyncio.Event()
+        with self.lock:
+            self._subscribers[event] = asyncio.get_running_loop()
+        return event
+
+    def unsubscribe(self, event):
+        """取消订阅"""
+        with self.lock:
+            self._subscribers.pop(event, None)
     
     def clear(self):
         """清空日志"""
@@ -35,6 +35,19 @@ QUERY_HANDLERS = {
 }
 
 
+_result_cache = None
+
+
+def _get_result_cache():
+    """MCP 进程内的查询结果缓存，与 Web 服务共用 icp_history.db 持久层"""
+    global _result_cache
+    if _result_cache is None:
+        from database import Database
+        from result_cache import ResultCache
+        _result_cache = ResultCache(db=Database())
+    return _result_cache
+
+
 def _allowed_types() -> list:
     try:
         from load_config import config
@@ -55,6 +68,7 @@ async def icp_query(
     search: str,
     page_num: Optional[int] = 1,
     page_size: Optional[int] = 10,
+    max_age: Optional[int] = None,
 ) -> str:
     """查询中国工信部 ICP 备案信息。
 
@@ -64,6 +78,7 @@ async def icp_query(
         search: 域名 / 单位名称 / 备案号 / 应用名等关键词
         page_num: 页码，从 1 开始（黑名单类型忽略）
         page_size: 每页条数，最大建议 26（黑名单类型忽略）
+        max_age: 可接受的缓存结果最大年龄（秒），0 表示强制重新查询；默认使用配置 cache.max_age
     """
     qtype = (type or "").strip().lower()
     keyword = (search or "").strip()
@@ -83,21 +98,26 @@ async def icp_query(
 
     from ymicp import beian
 
-    client = beian()
+    async def fetch():
+        client = beian()
+        try:
+            method = getattr(client, QUERY_HANDLERS[qtype])
+            if qtype.startswith("b"):
+                return await method(keyword)
+            return await method(keyword, page_num or 1, page_size or 10)
+        finally:
+            try:
+                await client.cleanup()
+            except Exception:
+                pass
+
     try:
-        method = getattr(client, QUERY_HANDLERS[qtype])
-        if qtype.startswith("b"):
-            result = await method(keyword)
-        else:
-            result = await method(keyword, page_num or 1, page_size or 10)
+        cache = _get_result_cache()
+        key = cache.make_key(qtype, keyword, page_num, page_size)
+        result, _ = await cache.get_or_fetch(key, qtype, fetch, bypass=max_age == 0, max_age=max_age)
         return json.dumps(result, ensure_ascii=False, default=str)
     except Exception as e:
         return json.dumps({"code": 500, "message": str(e)}, ensure_ascii=False)
-    finally:
-        try:
-            await client.cleanup()
-        except Exception:
-            pass
 
 
 def run_stdio() -> None:
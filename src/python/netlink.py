@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+rtnetlink IPv6 地址管理模块（仅 Linux）
+直接通过 NETLINK_ROUTE 套接字列出、批量添加 IPv6 地址并监听地址变更，不再为每个地址启动 ip 子进程；
+不可用时（非 Linux、无权限等）由 utils 回退到 ip / netsh 命令
+"""
+import errno
+import os
+import socket
+import struct
+from typing import Dict, Iterable, List
+
+
+# netlink 消息类型与标志
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+# IPv6 地址变更多播组
+RTMGRP_IPV6_IFADDR = 0x100
+
+# ifaddrmsg 属性
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_CACHEINFO = 6
+IFA_FLAGS = 8
+
+# 地址标志
+IFA_F_NODAD = 0x02
+IFA_F_DADFAILED = 0x08
+IFA_F_TENTATIVE = 0x40
+IFA_F_PERMANENT = 0x80
+
+RT_SCOPE_UNIVERSE = 0
+# ifa_cacheinfo 中表示永久有效的生存期
+INFINITY_LIFE_TIME = 0xFFFFFFFF
+
+_NLMSGHDR = struct.Struct("=LHHLL")
+_IFADDRMSG = struct.Struct("=BBBBI")
+_RTATTR = struct.Struct("=HH")
+_CACHEINFO = struct.Struct("=LLLL")
+
+# 单次 send 合并的请求数，避免超过套接字缓冲区
+BATCH_SIZE = 64
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _attr(attr_type, payload: bytes) -> bytes:
+    length = _RTATTR.size + len(payload)
+    return _RTATTR.pack(length, attr_type) + payload + b"\0" * (_align(length) - length)
+
+
+def _parse_attrs(data: bytes) -> Dict[int, bytes]:
+    attrs = {}
+    offset = 0
+    while offset + _RTATTR.size <= len(data):
+        length, attr_type = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + _RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _iter_messages(data: bytes):
+    """逐条解析 netlink 消息，返回 (类型, 标志, 序号, 载荷)"""
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            break
+        yield msg_type, flags, seq, data[offset + _NLMSGHDR.size:offset + length]
+        offset += _align(length)
+
+
+def _parse_address(body: bytes):
+    """解析 RTM_NEWADDR / RTM_DELADDR 载荷，非 IPv6 地址返回 None"""
+    family, prefixlen, flags, scope, ifindex = _IFADDRMSG.unpack_from(body)
+    attrs = _parse_attrs(body[_IFADDRMSG.size:])
+    raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+    if family != socket.AF_INET6 or not raw:
+        return None
+    if IFA_FLAGS in attrs:
+        flags = struct.unpack("=L", attrs[IFA_FLAGS][:4])[0]
+    preferred = valid = INFINITY_LIFE_TIME
+    if IFA_CACHEINFO in attrs:
+        preferred, valid, _, _ = _CACHEINFO.unpack_from(attrs[IFA_CACHEINFO])
+    return {
+        "address": socket.inet_ntop(socket.AF_INET6, raw),
+        "prefixlen": prefixlen,
+        "ifindex": ifindex,
+        "scope": scope,
+        "flags": flags,
+        "valid_lft": valid,
+        "preferred_lft": preferred,
+    }
+
+
+def available() -> bool:
+    """当前系统能否使用 rtnetlink"""
+    if not hasattr(socket, "AF_NETLINK"):
+        return False
+    try:
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE):
+            return True
+    except OSError:
+        return False
+
+
+class RtNetlink:
+    """NETLINK_ROUTE 套接字的简单封装（同步，调用方自行放入执行器）"""
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self._sock.bind((0, 0))
+        self._seq = 0
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def _message(self, msg_type, flags, payload: bytes, seq) -> bytes:
+        return _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), msg_type, flags, seq, 0) + payload
+
+    def _messages(self):
+        """读取一批回复，逐条返回 (类型, 标志, 序号, 载荷)"""
+        return _iter_messages(self._sock.recv(65536))
+
+    def list_ipv6_addresses(self) -> List[dict]:
+        """列出全部 IPv6 地址：[{address, prefixlen, ifindex, scope, flags, valid_lft, preferred_lft}]"""
+        seq = self._next_seq()
+        payload = _IFADDRMSG.pack(socket.AF_INET6, 0, 0, 0, 0)
+        self._sock.send(self._message(RTM_GETADDR, NLM_F_REQUEST | NLM_F_DUMP, payload, seq))
+
+        addresses = []
+        while True:
+            for msg_type, _, msg_seq, body in self._messages():
+                if msg_seq != seq:
+                    continue
+                if msg_type == NLMSG_DONE:
+                    return addresses
+                if msg_type == NLMSG_ERROR:
+                    error = struct.unpack_from("=i", body)[0]
+                    raise OSError(-error, os.strerror(-error))
+                if msg_type != RTM_NEWADDR:
+                    continue
+                address = _parse_address(body)
+                if address is not None:
+                    addresses.append(address)
+
+    def _batch(self, msg_type, extra_flags, addresses: Iterable[str], ifname: str, prefixlen: int,
+               ifa_flags: int = 0) -> List[str]:
+        """批量发送地址添加请求并等待逐条确认，返回成功的地址"""
+        ifindex = socket.if_nametoindex(ifname)
+        succeeded = []
+        addresses = list(addresses)
+        for start in range(0, len(addresses), BATCH_SIZE):
+            pending = {}
+            chunk = []
+            for address in addresses[start:start + BATCH_SIZE]:
+                raw = socket.inet_pton(socket.AF_INET6, address)
+                payload = (_IFADDRMSG.pack(socket.AF_INET6, prefixlen, ifa_flags & 0xFF, RT_SCOPE_UNIVERSE, ifindex)
+                           + _attr(IFA_LOCAL, raw) + _attr(IFA_ADDRESS, raw))
+                if ifa_flags > 0xFF:
+                    payload += _attr(IFA_FLAGS, struct.pack("=L", ifa_flags))
+                seq = self._next_seq()
+                pending[seq] = address
+                chunk.append(self._message(msg_type, NLM_F_REQUEST | NLM_F_ACK | extra_flags, payload, seq))
+            self._sock.send(b"".join(chunk))
+
+            while pending:
+                for msg_type_reply, _, seq, body in self._messages():
+                    if msg_type_reply != NLMSG_ERROR or seq not in pending:
+                        continue
+                    address = pending.pop(seq)
+                    error = struct.unpack_from("=i", body)[0]
+                    if error == 0:
+                        succeeded.append(address)
+                    elif -error in (errno.EPERM, errno.EACCES):
+                        # 无权限时整体失败，交给回退路径
+                        raise PermissionError(-error, os.strerror(-error))
+        return succeeded
+
+    def add_ipv6_addresses(self, addresses: Iterable[str], ifname: str, prefixlen: int = 64) -> List[str]:
+        """批量添加地址（跳过重复地址检测，添加后立即可用），返回添加成功的地址"""
+        return self._batch(RTM_NEWADDR, NLM_F_CREATE | NLM_F_EXCL, addresses, ifname, prefixlen, IFA_F_NODAD)
+
+
+def list_global_ipv6() -> List[dict]:
+    """列出全局作用域的 IPv6 地址（排除重复地址检测失败的）"""
+    with RtNetlink() as nl:
+        return [a for a in nl.list_ipv6_addresses()
+                if a["scope"] == RT_SCOPE_UNIVERSE and not a["flags"] & IFA_F_DADFAILED]
+
+
+class AddressMonitor:
+    """订阅 IPv6 地址变更通知（非阻塞），用于增量同步系统地址，无需定期全量列出"""
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self._sock.bind((0, RTMGRP_IPV6_IFADDR))
+        self._sock.setblocking(False)
+
+    def close(self):
+        self._sock.close()
+
+    def read_changes(self):
+        """
+        读取积压的全局地址变更 [(是否新增, 地址)]，重复地址检测失败按删除处理；
+        接收缓冲区溢出导致通知丢失时返回 None，调用方需全量同步
+        """
+        changes = []
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except BlockingIOError:
+                return changes
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    return None
+                raise
+            for msg_type, _, _, body in _iter_messages(data):
+                if msg_type not in (RTM_NEWADDR, RTM_DELADDR):
+                    continue
+                address = _parse_address(body)
+                if address is None or address["scope"] != RT_SCOPE_UNIVERSE:
+                    continue
+                added = msg_type == RTM_NEWADDR and not address["flags"] & IFA_F_DADFAILED
+                changes.append((added, address["address"]))
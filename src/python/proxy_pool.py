@@ -1,26 +1,135 @@
 # -*- coding: utf-8 -*-
 """
 代理池管理模块
-负责代理的获取、验证和维护
+负责代理的获取、验证和维护；
+启用跨进程共享（broker）时只有一个进程（租约选举产生）从提取接口获取并检测代理，写入共享库，
+所有进程定期从共享库同步代理池，剔除的代理同样同步到其他进程
 """
 import asyncio
-import random
-from datetime import datetime
+import heapq
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 import aiohttp
-from cachetools import TTLCache
 from mlog import logger
 from load_config import config
+from rate_limiter import get_rate_limiter
+from egress_health import get_egress_health
+from utils import AddressSet
+from concurrency import OUTCOME_BLOCKED, OUTCOME_TIMEOUT, OUTCOME_ERROR
+from egress_broker import get_broker, wall_to_monotonic, monotonic_to_wall
 
 # Bug 2 修复：确保 TTL 不为负数
 _proxy_ttl = max(1, config.proxy.extra_api.timeout - config.proxy.extra_api.timeout_drop)
 
+# 跨进程共享时代理提取主进程的租约名
+LEADER_NAME = "proxy_extract"
+
+# 代理检测的默认目标：轻量的公网地址，不向查询目标站点发送未限速的检测流量
+DEFAULT_CHECK_URL = "http://ifconfig.me/ip"
+# 代理检测的默认总超时（秒）
+DEFAULT_CHECK_TIMEOUT = 5
+
+
+async def _wait_event(event: asyncio.Event, timeout: float) -> bool:
+    """
+    等待事件被置位，超时返回 False；
+    不用 asyncio.wait_for：事件恰好与取消同时发生时它会吞掉取消（Python 3.11 及更早），导致维护任务无法停止
+    """
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        await asyncio.wait((waiter,), timeout=timeout)
+    finally:
+        waiter.cancel()
+    return event.is_set()
+
+
+class ProxyStore:
+    """
+    代理索引存储：{地址: 过期时间} + 过期时间最小堆 + 可用集合，
+    过期代理从堆顶惰性清理（O(log n)），随机抽取可用代理为 O(1)，取代理时无需遍历全池
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._expires = {}  # {地址: 过期时间（monotonic）}
+        self._heap = []  # [(过期时间, 地址)]，删除或续期后的旧条目出堆时跳过
+        self._ready = AddressSet()
+
+    def add(self, address: str, expire: Optional[float] = None):
+        """加入代理，过期时间默认为当前时间 + ttl"""
+        expire = time.monotonic() + self.ttl if expire is None else expire
+        self._expires[address] = expire
+        heapq.heappush(self._heap, (expire, address))
+        self._ready.add(address)
+
+    def discard(self, address: str):
+        if self._expires.pop(address, None) is not None:
+            self._ready.discard(address)
+
+    def purge(self, now: Optional[float] = None):
+        """清理已过期的代理"""
+        now = time.monotonic() if now is None else now
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expire, address = heapq.heappop(heap)
+            if self._expires.get(address) == expire:
+                del self._expires[address]
+                self._ready.discard(address)
+        # 旧条目过多时重建堆，避免反复删除后堆无限增长
+        if len(heap) > 2 * len(self._expires) + 64:
+            self._heap = [(e, a) for a, e in self._expires.items()]
+            heapq.heapify(self._heap)
+
+    def sample(self) -> Optional[str]:
+        """随机取一个未过期的代理地址，池为空时返回 None"""
+        self.purge()
+        return self._ready.sample()
+
+    def full(self) -> bool:
+        return len(self) >= self.maxsize
+
+    def __setitem__(self, address, expire):
+        self.add(address, expire)
+
+    def __delitem__(self, address):
+        self.discard(address)
+
+    def __contains__(self, address):
+        expire = self._expires.get(address)
+        return expire is not None and expire > time.monotonic()
+
+    def __len__(self):
+        self.purge()
+        return len(self._expires)
+
+    def __iter__(self):
+        self.purge()
+        return iter(self._ready)
+
+
 # 代理池缓存
-pool_cache = TTLCache(
+pool_cache = ProxyStore(
     maxsize=config.proxy.extra_api.pool_num,
     ttl=_proxy_ttl
 )
 
 
+class ProxyLease:
+    """代理租约：持有期间计入该代理的在途请求数，用完后通过 report 报告结果"""
+
+    __slots__ = ("proxy", "outcome")
+
+    def __init__(self, proxy: str):
+        self.proxy = proxy
+        self.outcome = None
+
+    def report(self, outcome: str):
+        """记录本次使用的结果（concurrency 中的 OUTCOME_*），归还时据此处理代理"""
+        self.outcome = outcome
+
+
 class ProxyPool:
     """代理池管理类"""
 
@@ -43,6 +152,33 @@ class ProxyPool:
         self._pool_lock = asyncio.Lock()
         # 启动定时任务，维护地址池
         self._update_task = None
+        # 按出口限速与健康评分选择代理
+        self._rate_limiter = get_rate_limiter()
+        self._health = get_egress_health()
+        # 有新代理入库时唤醒等待取代理的请求
+        self._available = asyncio.Event()
+        # 代理池耗尽时提前唤醒定时更新任务
+        self._refill = asyncio.Event()
+        self.waits = 0
+        # 代理检测流水线：提取到的代理排队，由 check_proxy_num 个检测协程共用一个 session 逐个检测
+        self.check_url = config.proxy.extra_api.check_url or DEFAULT_CHECK_URL
+        self._check_queue = asyncio.Queue()
+        self._checking = set()
+        self._check_workers = []
+        self._check_session = None
+        self.checked = 0
+        self.check_passed = 0
+        # 每个代理同时在途的请求数上限（0 为不限），避免少数代理过载被拦截而其余闲置
+        self.max_inflight = max(0, int(config.proxy.extra_api.max_inflight or 0))
+        self._inflight = {}  # {代理: 在途租约数}
+        self.leases = 0
+        self.outcomes = {}
+        # 跨进程共享状态，未启用时为 None
+        self._broker = get_broker()
+        # 是否负责提取代理：未启用共享时总是；启用时由租约选举决定，首次选举前为 None
+        self.leader = True if self._broker is None else None
+        # 写入共享库失败的本进程代理 {地址: 过期时间}，同步时重试写入且不因共享库中没有而移除
+        self._unshared = {}
 
     async def start(self):
         """启动代理池维护任务"""
@@ -58,6 +194,15 @@ class ProxyPool:
             except asyncio.CancelledError:
                 pass
             await self._close_session()
+        if self._broker is not None and self.leader:
+            await self._broker.run(self._broker.resign, LEADER_NAME)
+        for worker in self._check_workers:
+            worker.cancel()
+        await asyncio.gather(*self._check_workers, return_exceptions=True)
+        self._check_workers = []
+        if self._check_session is not None:
+            await self._check_session.close()
+            self._check_session = None
 
     async def cron_create(self):
         """向后兼容的启动方法"""
@@ -80,7 +225,7 @@ class ProxyPool:
         async with self._update_lock:
             # Bug 3 修复：使用锁保护代理池操作
             async with self._pool_lock:
-                if len(pool_cache) >= self.number:
+                if pool_cache.full():
                     logger.info(f"代理池饱满，无需更新代理，当前池内数量：{len(pool_cache)}")
                     return
 
@@ -94,92 +239,250 @@ class ProxyPool:
                     logger.error("提取到的 IP 为 0")
                     return
 
-                endtime = datetime.now().timestamp()
+                # 代理有效期从提取时开始计算
+                expire = time.monotonic() + _proxy_ttl
 
                 if config.proxy.extra_api.check_proxy:
-                    await self._check_and_add_proxies(proxy_list, endtime)
+                    queued = await self._check_and_add_proxies(proxy_list, expire)
+                    logger.info(f"提交 {queued} 个代理检测，当前代理数量：{len(pool_cache)}")
+                    return
                 else:
                     # Bug 3 修复：使用锁保护批量添加操作
                     async with self._pool_lock:
-                        for address in proxy_list:
-                            if len(pool_cache) >= self.number:
-                                break
-                            pool_cache[address] = endtime
+                        await self._add(proxy_list, expire)
+                    self._notify()
 
                 logger.info(f"更新代理池成功，当前代理数量：{len(pool_cache)}")
 
             except Exception as e:
                 logger.error(f"更新代理池失败：{e}")
 
-    async def _check_and_add_proxies(self, proxy_list, endtime):
-        """并发检查代理可用性并添加到池中"""
-        semaphore = asyncio.Semaphore(config.proxy.extra_api.check_proxy_num)
-
-        async def check_proxy(address):
-            async with semaphore:
-                # Bug 3 修复：使用锁保护代理池检查和添加操作
-                async with self._pool_lock:
-                    if len(pool_cache) >= self.number:
-                        return
-
-                timeout = aiohttp.ClientTimeout(total=config.proxy.extra_api.proxy_timeout)
-                try:
-                    from aiohttp import TCPConnector
-                    async with aiohttp.ClientSession(
-                        timeout=timeout, connector=TCPConnector(ssl=False)
-                    ) as session:
-                        async with session.get(
-                            "http://ifconfig.me/ip", proxy=f"http://{address}"
-                        ) as req:
-                            await req.text()
-
-                        # Bug 3 修复：再次检查并添加，确保原子性
-                        async with self._pool_lock:
-                            if len(pool_cache) < self.number:
-                                pool_cache[address] = endtime
-                                logger.info(f"入库代理成功：{address}")
-                except Exception:
-                    logger.info(f"入库检测代理不可用：{address}")
-
-        # 使用 asyncio.gather 处理并发任务，添加异常处理
-        tasks = [check_proxy(address) for address in proxy_list]
-        await asyncio.gather(*tasks, return_exceptions=True)
+    async def _add(self, addresses, expire):
+        """代理入库（池满为止），并在一个事务中写入共享库供其他进程使用；调用方持有 _pool_lock"""
+        added = []
+        for address in addresses:
+            if pool_cache.full():
+                break
+            pool_cache.add(address, expire)
+            added.append(address)
+        if self._broker is not None and added:
+            items = [(address, monotonic_to_wall(expire)) for address in added]
+            if not await self._broker.run(self._broker.put_proxies, items):
+                self._unshared.update(dict.fromkeys(added, expire))
+        return added
+
+    async def _sync_from_broker(self):
+        """以共享库为准同步本进程的代理池：加入其他进程提取的代理，移除已被剔除或过期的代理"""
+        # 持有 _pool_lock，避免新入库但尚未写入共享库的代理被当作已剔除移除
+        async with self._pool_lock:
+            for address in [a for a in self._unshared if a not in pool_cache]:
+                del self._unshared[address]
+            if self._unshared:
+                items = [(address, monotonic_to_wall(expire)) for address, expire in self._unshared.items()]
+                if await self._broker.run(self._broker.put_proxies, items):
+                    self._unshared.clear()
+            shared = await self._broker.run(self._broker.list_proxies)
+            if shared is None:
+                return
+            shared = dict(shared)
+            for address in list(pool_cache):
+                if address not in shared and address not in self._unshared:
+                    pool_cache.discard(address)
+            added = False
+            for address, expire in shared.items():
+                if address not in pool_cache:
+                    pool_cache.add(address, wall_to_monotonic(expire))
+                    added = True
+        if added:
+            self._notify()
+
+    def _notify(self):
+        """唤醒等待代理的请求"""
+        if len(pool_cache):
+            self._available.set()
+
+    async def _check_and_add_proxies(self, proxy_list, expire):
+        """将代理提交到检测流水线后立即返回，每个代理通过检测即入库，返回提交的数量"""
+        self._start_checkers()
+        queued = 0
+        for address in proxy_list:
+            if address in self._checking or address in pool_cache:
+                continue
+            self._checking.add(address)
+            self._check_queue.put_nowait((address, expire))
+            queued += 1
+        return queued
+
+    def _start_checkers(self):
+        if self._check_workers:
+            return
+        workers = max(1, int(config.proxy.extra_api.check_proxy_num or 20))
+        self._check_session = aiohttp.ClientSession(
+            # proxy_timeout 限制连上代理的时间，check_timeout 限制整次检测（含经代理的 TLS 握手与响应）
+            timeout=aiohttp.ClientTimeout(
+                total=float(config.proxy.extra_api.check_timeout or DEFAULT_CHECK_TIMEOUT),
+                sock_connect=config.proxy.extra_api.proxy_timeout or None,
+            ),
+            # 每个代理只检测一次，不保留连接
+            connector=aiohttp.TCPConnector(ssl=False, limit=workers, force_close=True),
+        )
+        self._check_workers = [asyncio.create_task(self._check_worker()) for _ in range(workers)]
+
+    async def _check_worker(self):
+        """检测协程：逐个取出待检测代理，池已满或代理已过期时直接丢弃"""
+        while True:
+            address, expire = await self._check_queue.get()
+            try:
+                if not pool_cache.full() and expire > time.monotonic():
+                    await self._check_proxy(address, expire)
+            finally:
+                self._checking.discard(address)
+
+    async def _check_proxy(self, address, expire):
+        """通过代理请求检测目标，收到响应即视为可用；检测耗时计入该出口的健康评分"""
+        proxy = f"http://{address}"
+        started = time.monotonic()
+        self.checked += 1
+        try:
+            async with self._check_session.get(self.check_url, proxy=proxy) as req:
+                await req.read()
+        except Exception:
+            logger.info(f"入库检测代理不可用：{address}")
+            return
+
+        self.check_passed += 1
+        self._health.record(proxy, True, time.monotonic() - started)
+        # Bug 3 修复：再次检查并添加，确保原子性
+        async with self._pool_lock:
+            if await self._add([address], expire):
+                logger.info(f"入库代理成功：{address}")
+        # 每通过一个就唤醒等待者，不必等整批检测完成
+        self._notify()
 
     async def cron_update(self):
         """定时任务，更新地址池"""
         try:
             while True:
-                await self._update()
-                await asyncio.sleep(self.period)
+                if self._broker is not None:
+                    # 租约有效期覆盖数个更新周期，主进程退出后由其他进程接管提取
+                    leader = await self._broker.run(self._broker.try_lead, LEADER_NAME, max(self.period * 3, 10))
+                    if leader != self.leader:
+                        logger.info("本进程负责提取代理" if leader else "代理由其他进程提取，本进程从共享库同步")
+                        self.leader = leader
+                if self.leader:
+                    await self._update()
+                if self._broker is not None:
+                    await self._sync_from_broker()
+                # 按周期更新；代理池耗尽时取代理的请求会提前唤醒
+                await _wait_event(self._refill, self.period)
+                self._refill.clear()
         except asyncio.CancelledError:
             logger.info("代理池更新任务已取消")
             raise
 
-    # Bug 3 修复：获取代理时检查过期时间
-    async def getproxy(self, num=1):
-        """获取代理"""
-        # 等待代理池有可用代理
+    def _saturated(self, proxy) -> bool:
+        return self._inflight.get(proxy, 0) >= self.max_inflight
+
+    def _select(self, limit_inflight=False) -> Optional[str]:
+        """抽样选择代理（O(1)）；抽样全部落空时遍历全池选择。limit_inflight 时跳过在途请求已满的代理"""
+        def sample():
+            address = pool_cache.sample()
+            return f"http://{address}" if address is not None else None
+
+        exclude = self._saturated if limit_inflight and self.max_inflight else None
+        proxy = self._health.pick(sample, self._rate_limiter, exclude)
+        if proxy is None and len(pool_cache):
+            proxies = (f"http://{address}" for address in pool_cache)
+            if exclude is not None:
+                proxies = [p for p in proxies if not exclude(p)]
+            proxy = self._health.choose(proxies, self._rate_limiter)
+        return proxy
+
+    async def _acquire(self, limit_inflight=False) -> str:
+        """
+        选择代理：跳过隔离中的代理，在有限速令牌的代理中按健康评分加权选择；
+        没有可用代理时等待新代理入库或租约归还的通知，而不是轮询
+        """
         timeout = 30  # 30 秒超时
-        start_time = asyncio.get_event_loop().time()
+        deadline = time.monotonic() + timeout
 
         while True:
-            current_time = datetime.now().timestamp()
-            # Bug 3 修复：使用锁保护代理池读取操作
-            async with self._pool_lock:
-                # 过滤掉已过期的代理
-                valid_proxies = [
-                    key for key, expire_time in pool_cache.items()
-                    if expire_time > current_time
-                ]
-                if len(valid_proxies) != 0:
-                    random_key = f"http://{random.choice(valid_proxies)}"
-                    break
-
-            if asyncio.get_event_loop().time() - start_time > timeout:
+            # 选择过程不会让出事件循环，无需加锁
+            proxy = self._select(limit_inflight)
+            if proxy is not None:
+                return proxy
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("等待代理超时")
+            self._available.clear()
+            if not len(pool_cache):
+                self._refill.set()
+            self.waits += 1
+            if not await _wait_event(self._available, remaining):
                 raise TimeoutError("等待代理超时")
-            await asyncio.sleep(0.1)
 
-        return random_key
+    # Bug 3 修复：获取代理时检查过期时间
+    async def getproxy(self, num=1):
+        """获取代理（不计入在途请求数，需要按代理限制在途请求时使用 lease）"""
+        return await self._acquire()
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        租用代理：async with pool.lease() as lease，使用 lease.proxy 发起请求并 lease.report(结果)；
+        在途请求达到 max_inflight 的代理不会被选中，离开上下文时归还，被拦截或连接失败的代理移出代理池
+        """
+        proxy = await self._acquire(limit_inflight=True)
+        self._inflight[proxy] = self._inflight.get(proxy, 0) + 1
+        self.leases += 1
+        lease = ProxyLease(proxy)
+        try:
+            yield lease
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if lease.outcome is None:
+                lease.outcome = OUTCOME_ERROR
+            raise
+        finally:
+            self._release(lease)
+
+    def _release(self, lease: ProxyLease):
+        proxy = lease.proxy
+        count = self._inflight.get(proxy, 0) - 1
+        if count > 0:
+            self._inflight[proxy] = count
+        else:
+            self._inflight.pop(proxy, None)
+
+        outcome = lease.outcome
+        if outcome is not None:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        if outcome in (OUTCOME_BLOCKED, OUTCOME_TIMEOUT) and proxy[7:] in pool_cache:
+            pool_cache.discard(proxy[7:])
+            if self._broker is not None:
+                self._broker.post(self._broker.remove_proxy, proxy[7:])
+            logger.info(f"代理无效，已剔除代理：{proxy[7:]}")
+        elif self.max_inflight and count == self.max_inflight - 1:
+            # 代理从满载恢复可用，唤醒等待的租用请求
+            self._available.set()
+
+    def stats(self) -> dict:
+        """代理池统计"""
+        return {
+            "size": len(pool_cache),
+            "capacity": self.number,
+            "leader": self.leader,
+            "waits": self.waits,
+            "checking": len(self._checking),
+            "checked": self.checked,
+            "check_passed": self.check_passed,
+            "max_inflight": self.max_inflight,
+            "inflight": sum(self._inflight.values()),
+            "leases": self.leases,
+            "outcomes": dict(self.outcomes),
+        }
 
 
 # IPv6 地址池相关函数已迁移到 ipv6_pool.py
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+出口限速模块
+每个出口（本地 IPv6、代理、直连）一个令牌桶，按配置的速率补充、容量即突发上限；
+所有上游请求发出前先取令牌，选择出口时优先选择仍有令牌的出口，使单个 IP 的请求频率低于创宇盾的拦截阈值；
+启用跨进程共享（broker）时令牌桶保存在共享库中，同一主机上的所有进程共用每个出口的速率
+"""
+import asyncio
+import random
+import threading
+import time
+from typing import Iterable, Optional
+from load_config import config
+from egress_broker import get_broker
+
+
+class _Bucket:
+    """单个出口的令牌桶，tokens 可以为负，表示已被预约的令牌"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class EgressRateLimiter:
+    """按出口限速：取令牌时立即预约，不足时等待到预约的令牌补充完成，先到先得"""
+
+    # 桶数量超过该值时清理已补满的桶（代理地址不断更换，避免无限增长）
+    MAX_IDLE_BUCKETS = 4096
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None, enabled: Optional[bool] = None):
+        limit_config = getattr(config, 'rate_limit', None)
+        self.enabled = bool(getattr(limit_config, 'enable', False)) if enabled is None else enabled
+        self.rate = float(rate or getattr(limit_config, 'rate', None) or 2)
+        self.burst = max(1.0, float(burst or getattr(limit_config, 'burst', None) or 5))
+        self._buckets = {}  # {egress_key: _Bucket}
+        self._broker = get_broker()
+        # MCP HTTP 线程与主事件循环共用同一实例
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.delayed = 0
+        self.delay_seconds = 0.0
+        self.fallbacks = 0  # 启用共享但共享库不可用（或写锁繁忙）而改用进程内令牌桶的次数
+
+    def _refill(self, key, now) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_IDLE_BUCKETS:
+                self._prune(now)
+            bucket = self._buckets[key] = _Bucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        return bucket
+
+    def _prune(self, now):
+        for key in [k for k, b in self._buckets.items()
+                    if b.tokens + (now - b.updated) * self.rate >= self.burst]:
+            del self._buckets[key]
+
+    def _shared_tokens(self, keys) -> Optional[dict]:
+        """共享库中各出口的令牌数，未启用共享或共享库不可用时返回 None"""
+        if self._broker is None:
+            return None
+        return self._broker.tokens(keys, self.rate, self.burst)
+
+    def tokens(self, key) -> float:
+        """出口当前可用的令牌数（可能为负）"""
+        if not self.enabled:
+            return self.burst
+        shared = self._shared_tokens((key,))
+        if shared is not None:
+            return shared[key]
+        with self._lock:
+            return self._refill(key, time.monotonic()).tokens
+
+    def tokens_many(self, keys: Iterable[str]) -> dict:
+        """多个出口当前可用的令牌数 {出口: 令牌数}，启用共享时只查询一次共享库"""
+        keys = list(keys)
+        if not self.enabled:
+            return dict.fromkeys(keys, self.burst)
+        shared = self._shared_tokens(keys)
+        if shared is not None:
+            return shared
+        now = time.monotonic()
+        with self._lock:
+            return {key: self._refill(key, now).tokens for key in keys}
+
+    def reserve(self, key, shared_wait: Optional[float] = None) -> float:
+        """
+        预约一个令牌，返回需要等待的秒数
+        shared_wait 为在共享库中预约的结果，为 None（未启用共享或共享库不可用）时使用进程内令牌桶
+        """
+        if not self.enabled:
+            return 0.0
+        wait = shared_wait
+        with self._lock:
+            if wait is None:
+                if self._broker is not None:
+                    self.fallbacks += 1
+                bucket = self._refill(key, time.monotonic())
+                bucket.tokens -= 1
+                wait = 0.0 if bucket.tokens >= 0 else -bucket.tokens / self.rate
+            self.acquired += 1
+            if wait > 0:
+                self.delayed += 1
+                self.delay_seconds += wait
+            prune = self._broker is not None and self.acquired % self.MAX_IDLE_BUCKETS == 0
+        if prune:
+            self._broker.post(self._broker.prune_buckets, self.rate, self.burst)
+        return wait
+
+    async def acquire(self, key):
+        """取一个令牌，不足时等待；启用共享时在共享库线程中预约，不阻塞事件循环"""
+        if not self.enabled:
+            return
+        shared_wait = None
+        if self._broker is not None:
+            shared_wait = await self._broker.run(self._broker.reserve, key, self.rate, self.burst)
+        wait = self.reserve(key, shared_wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def choose(self, keys: Iterable[str]) -> Optional[str]:
+        """从候选出口中随机选择一个有令牌的；都没有时选择令牌最多（最快恢复）的"""
+        keys = list(keys)
+        if not keys:
+            return None
+        if not self.enabled:
+            return random.choice(keys)
+        tokens = self.tokens_many(keys)
+        ready = [key for key in keys if tokens[key] >= 1]
+        if ready:
+            return random.choice(ready)
+        return max(keys, key=tokens.get)
+
+    def stats(self) -> dict:
+        """限速统计"""
+        return {
+            "enabled": self.enabled,
+            "rate": self.rate,
+            "burst": self.burst,
+            "egresses": len(self._buckets),
+            "shared": self._broker is not None,
+            "acquired": self.acquired,
+            "delayed": self.delayed,
+            "delay_seconds": round(self.delay_seconds, 3),
+            "fallbacks": self.fallbacks,
+        }
+
+
+# 全局出口限速实例
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> EgressRateLimiter:
+    """获取全局出口限速器（进程内共享，代理池与各查询处理器共用）"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = EgressRateLimiter()
+    return _rate_limiter
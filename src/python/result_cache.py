@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+查询结果缓存模块
+进程内 LRU + TTL 缓存，按序列化后的字节数限制容量，
+并合并相同查询的并发请求，使其只触发一次上游查询；
+可选以 SQLite（Database.query_cache）作为持久层，重启后与 MCP 进程共享
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+import ujson
+from mlog import logger
+from load_config import config
+
+
+# 缓存状态，写入响应头 X-Cache
+CACHE_HIT = "HIT"
+CACHE_MISS = "MISS"
+CACHE_COALESCED = "COALESCED"
+CACHE_DISK = "DISK"
+CACHE_BYPASS = "BYPASS"
+
+
+def result_count(path, data):
+    """统计查询结果条数（违法违规类型 params 为列表，其余为分页结构）"""
+    params = data.get("params")
+    if path.startswith("b"):
+        return len(params or [])
+    return len((params or {}).get("list", []))
+
+
+class ResultCache:
+    """查询结果缓存：正常结果、空结果、违法违规结果分别设置 TTL"""
+
+    def __init__(self, db=None):
+        cache_config = getattr(config, 'cache', None)
+        self.enabled = bool(getattr(cache_config, 'enable', False))
+        # 持久层：正常结果保留 persist_ttl 秒（空结果与违法违规结果按各自的 TTL），默认只返回 max_age 秒内获取的结果
+        self.db = db if getattr(cache_config, 'persist', False) else None
+        self.persist_ttl = float(getattr(cache_config, 'persist_ttl', None) or 86400)
+        self.max_age = float(getattr(cache_config, 'max_age', None) or 3600)
+        self.sweep_interval = float(getattr(cache_config, 'sweep_interval', None) or 300)
+        self._sweep_task = None
+        self.max_bytes = int(getattr(cache_config, 'max_mb', None) or 64) * 1024 * 1024
+        self.ttl = float(getattr(cache_config, 'ttl', None) or 600)
+        self.empty_ttl = float(getattr(cache_config, 'empty_ttl', None) or 60)
+        self.black_ttl = float(getattr(cache_config, 'black_ttl', None) or 300)
+        self._entries = OrderedDict()  # {key: (expire, data, size, fetched_at)}，按最近使用排序
+        self._inflight = {}  # {key: Future}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(path, search, page_num=None, page_size=None):
+        """归一化查询参数作为缓存键"""
+        search = (search or "").strip()
+        if path.startswith("b"):
+            return (path, search)
+        return (path, search, str(page_num or 1), str(page_size or 10))
+
+    @staticmethod
+    def persist_key(key) -> str:
+        return "|".join(key)
+
+    def ttl_for(self, path, data, persist: bool = False) -> float:
+        """
+        根据结果类型选择 TTL，非 200 结果不缓存；
+        persist 为真时返回持久层的保留时间：正常结果至少保留 persist_ttl，空结果与违法违规结果仍按各自的 TTL
+        """
+        if data.get("code") != 200:
+            return 0
+        if path.startswith("b"):
+            return self.black_ttl
+        if result_count(path, data) == 0:
+            return self.empty_ttl
+        return max(self.ttl, self.persist_ttl) if persist else self.ttl
+
+    def get(self, key, max_age: Optional[float] = None):
+        """读取未过期的缓存结果，max_age（秒）限制结果的最大年龄"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expire, data, size, fetched_at = entry
+        now = time.time()
+        if expire <= now:
+            self._remove(key)
+            return None
+        if max_age is not None and now - fetched_at > max_age:
+            return None
+        self._entries.move_to_end(key)
+        return data
+
+    def put(self, key, data, ttl: float, fetched_at: Optional[float] = None):
+        """写入缓存，超出字节上限时淘汰最久未用的条目"""
+        if ttl <= 0:
+            return
+        size = len(ujson.dumps(data, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        fetched_at = fetched_at or time.time()
+        self._entries[key] = (fetched_at + ttl, data, size, fetched_at)
+        self.bytes += size
+        while self.bytes > self.max_bytes and self._entries:
+            old_key = next(iter(self._entries))
+            self._remove(old_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    async def _load_persisted(self, key, max_age):
+        """从持久层读取结果，命中后回填内存缓存"""
+        loop = asyncio.get_running_loop()
+        row = await loop.run_in_executor(None, self.db.get_cached_result, self.persist_key(key), max_age)
+        if row is None:
+            return None
+        data, fetched_at = row
+        now = time.time()
+        # 持久层的保留时间按结果类型计算，早于该时间写入的记录（如旧版本写入的空结果）不再返回
+        persist_expire = fetched_at + self.ttl_for(key[0], data, persist=True)
+        if persist_expire <= now:
+            return None
+        # 回填内存时从现在起计算 TTL（不超过持久层的保留时间），避免按获取时间计算后立即过期、反复读库
+        expire = min(persist_expire, now + self.ttl_for(key[0], data))
+        self.put(key, data, expire - fetched_at, fetched_at)
+        return data
+
+    async def _store(self, key, path, data):
+        """写入内存缓存与持久层"""
+        ttl = self.ttl_for(path, data)
+        if ttl <= 0:
+            return
+        self.put(key, data, ttl)
+        if self.db is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.db.put_cached_result, self.persist_key(key), path, data,
+                                       self.ttl_for(path, data, persist=True))
+
+    async def get_or_fetch(self, key, path, fetch: Callable[[], Awaitable[dict]],
+                           bypass: bool = False, max_age: Optional[float] = None) -> Tuple[dict, str]:
+        """
+        依次查找内存缓存、持久缓存，未命中时执行 fetch；相同键的并发请求共享同一次结果
+        max_age 为空时使用配置的 cache.max_age，返回 (结果, 缓存状态)
+        """
+        if not self.enabled or bypass:
+            data = await fetch()
+            if self.enabled:
+                await self._store(key, path, data)
+            return data, CACHE_BYPASS
+
+        if max_age is None:
+            max_age = self.max_age
+        data = self.get(key, max_age)
+        if data is not None:
+            self.hits += 1
+            return data, CACHE_HIT
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            data = await self._load_persisted(key, max_age) if self.db is not None else None
+            if data is not None:
+                self.disk_hits += 1
+                status = CACHE_DISK
+            else:
+                self.misses += 1
+                data = await fetch()
+                await self._store(key, path, data)
+                status = CACHE_MISS
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("查询已取消"))
+            # 避免无人等待时出现 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        future.set_result((data, CACHE_COALESCED))
+        return data, status
+
+    async def sweep_loop(self):
+        """定期清理持久层中已过期的结果"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.sleep(self.sweep_interval)
+                removed = await loop.run_in_executor(None, self.db.sweep_cached_results)
+                if removed:
+                    logger.info(f"清理过期持久缓存 {removed} 条")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"清理持久缓存出错: {e}")
+
+    def stats(self) -> dict:
+        """缓存统计"""
+        lookups = self.hits + self.misses + self.coalesced + self.disk_hits
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "disk_hits": self.disk_hits,
+            "persist": self.db is not None,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+async def init_result_cache(app):
+    """启动持久缓存清理任务（用于app启动时）"""
+    result_cache = app.get('result_cache')
+    if result_cache is not None and result_cache.enabled and result_cache.db is not None:
+        result_cache._sweep_task = asyncio.create_task(result_cache.sweep_loop())
+
+
+async def cleanup_result_cache(app):
+    """停止持久缓存清理任务（用于app关闭时）"""
+    result_cache = app.get('result_cache')
+    if result_cache is not None and result_cache._sweep_task is not None:
+        result_cache._sweep_task.cancel()
+        try:
+            await result_cache._sweep_task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+批量任务结果写入模块
+每完成一个关键词即向 JSONL 文件追加一行 {"idx": 序号, "keyword": 关键词, "result": 结果}，并定时 fsync；
+同名 .idx 索引文件按顺序保存每行的起始偏移（8 字节小端无符号整数），分页读取时直接定位，无需加载整个文件。
+打开、fsync 与读取都可能阻塞，在事件循环中使用时放入执行器
+"""
+import asyncio
+import os
+import struct
+import ujson
+from mlog import logger
+from load_config import config
+
+
+INDEX_SUFFIX = ".idx"
+_OFFSET = struct.Struct("<Q")
+
+
+class ResultWriter:
+    """批量任务结果追加写入器（仅在事件循环线程中使用，fsync 在执行器中完成）"""
+
+    def __init__(self, path, fsync_interval=None):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.fsync_interval = float(
+            fsync_interval if fsync_interval is not None
+            else (getattr(config.system, "batch_fsync_interval", None) or 5)
+        )
+        self.count = 0
+        self._size = 0
+        self._file = None
+        self._index = None
+        self._dirty = False
+        self._sync_task = None
+        self._syncing = None  # 执行器中进行中的 fsync
+        self.syncs = 0
+
+    def open(self):
+        """
+        打开（或续写）结果文件：截掉崩溃时写了一半的末行并重建索引，
+        返回文件中已有记录的关键词序号集合（会读取整个文件，放入执行器调用）
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        offsets = []
+        done = set()
+        valid_end = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = ujson.loads(line)
+                    except ValueError:
+                        break
+                    offsets.append(valid_end)
+                    done.add(record.get("idx"))
+                    valid_end += len(line)
+            if valid_end != os.path.getsize(self.path):
+                logger.warning(f"结果文件末尾存在不完整记录，已截断：{self.path}")
+                with open(self.path, "r+b") as f:
+                    f.truncate(valid_end)
+
+        with open(self.index_path, "wb") as f:
+            f.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+
+        self._file = open(self.path, "ab")
+        self._index = open(self.index_path, "ab")
+        self._size = valid_end
+        self.count = len(offsets)
+        return done
+
+    def append(self, idx, keyword, result):
+        """追加一条记录；先写数据再写索引，读取方只会看到已完整写入的记录"""
+        line = ujson.dumps({"idx": idx, "keyword": keyword, "result": result}, ensure_ascii=False).encode("utf-8") + b"\n"
+        self._file.write(line)
+        self._file.flush()
+        self._index.write(_OFFSET.pack(self._size))
+        self._index.flush()
+        self._size += len(line)
+        self.count += 1
+        self._dirty = True
+
+    @staticmethod
+    def _fsync(*fds):
+        for fd in fds:
+            os.fsync(fd)
+
+    async def sync(self):
+        """将已写入的数据刷到磁盘（fsync 在执行器中进行，不阻塞事件循环）"""
+        if self._file is None or not self._dirty:
+            return
+        if self._syncing is not None and not self._syncing.done():
+            await asyncio.shield(self._syncing)
+        self._dirty = False
+        self._syncing = asyncio.get_running_loop().run_in_executor(
+            None, self._fsync, self._file.fileno(), self._index.fileno())
+        # 调用方被取消时 fsync 仍继续，由 close 等待其结束后再关闭文件
+        await asyncio.shield(self._syncing)
+        self.syncs += 1
+
+    async def _sync_loop(self):
+        """每隔 fsync_interval 秒刷盘一次，最后一次追加之后的数据同样会按时落盘"""
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            try:
+                await self.sync()
+            except OSError as e:
+                self._dirty = True
+                logger.error(f"结果文件刷盘失败：{self.path}，{e}")
+
+    def start(self):
+        """启动定时刷盘"""
+        if self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def close(self):
+        """停止定时刷盘，最后刷盘一次并关闭文件"""
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            await asyncio.gather(self._sync_task, return_exceptions=True)
+            self._sync_task = None
+        if self._file is None:
+            return
+        try:
+            if self._syncing is not None:
+                await asyncio.gather(self._syncing, return_exceptions=True)
+            await self.sync()
+        finally:
+            self._file.close()
+            self._index.close()
+            self._file = None
+            self._index = None
+
+
+def count_results(path):
+    """结果文件中的记录数（没有索引时读取整个文件，放入执行器调用）"""
+    index_path = path + INDEX_SUFFIX
+    if os.path.exists(index_path):
+        return os.path.getsize(index_path) // _OFFSET.size
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.endswith(b"\n"))
+
+
+def read_results(path, offset=0, limit=None):
+    """按序号分页读取记录，返回 [{"idx", "keyword", "result"}]；有索引时直接定位到起始记录（放入执行器调用）"""
+    if not os.path.exists(path):
+        return []
+    offset = max(0, int(offset))
+    index_path = path + INDEX_SUFFIX
+    records = []
+
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as f:
+            f.seek(offset * _OFFSET.size)
+            raw = f.read(limit * _OFFSET.size if limit is not None else -1)
+        count = len(raw) // _OFFSET.size
+        if count == 0:
+            return []
+        start = _OFFSET.unpack_from(raw, 0)[0]
+        with open(path, "rb") as f:
+            f.seek(start)
+            for _ in range(count):
+                records.append(ujson.loads(f.readline()))
+        return records
+
+    with open(path, "rb") as f:
+        for i, line in enumerate(f):
+            if i < offset or not line.endswith(b"\n"):
+                continue
+            if limit is not None and len(records) >= limit:
+                break
+            records.append(ujson.loads(line))
+    return records
@@ -15,6 +15,7 @@ def setup_routes(app):
     from .log_routes import setup_log_routes
     from .ui_routes import setup_ui_routes
     from .auth_routes import setup_auth_routes
+    from .stats_routes import setup_stats_routes
 
     setup_auth_routes(app)
     setup_query_routes(app)
@@ -23,4 +24,5 @@ def setup_routes(app):
     setup_config_routes(app)
     setup_log_routes(app)
     setup_ui_routes(app)
+    setup_stats_routes(app)
 
@@ -7,6 +7,7 @@ import asyncio
 import os
 import json
 import random
+from contextlib import AsyncExitStack
 from datetime import datetime
 import aiohttp
 from aiohttp import web
@@ -14,46 +15,143 @@ from middlewares import jsondump, wj
 from load_config import config
 from mlog import logger
 from log_collector import log_collector
-from proxy_pool import pool_cache
 from utils import is_valid_url
+from result_writer import ResultWriter, read_results, count_results
+from sse import open_stream, send_event, send_heartbeat, last_event_id, wait_event
+from concurrency import AdaptiveConcurrency, OUTCOME_ERROR, query_outcome
 
 
 routes = web.RouteTableDef()
 
 
-async def create_task(taskname, data, request, searnum, apptype="web"):
-    """创建批量查询任务"""
+async def create_task(taskname, total, app, searnum, apptype="web"):
+    """
+    执行批量查询任务
+    关键词队列保存在数据库中，工作协程按批领取并逐个记录状态，服务重启后只处理尚未完成的关键词；
+    同时发出的上游请求数（含各关键词的翻页请求）从 searnum 开始，按上游的成功率、延迟与拦截情况自适应调整
+    """
     # 从app中获取查询处理器
-    appth = request.app.get('appth', {})
-    bappth = request.app.get('bappth', {})
-    
+    appth = app.get('appth', {})
+    bappth = app.get('bappth', {})
+    db = app["db"]
+    loop = asyncio.get_running_loop()
+
+    # 结果逐条追加到 JSONL 文件，续跑时沿用原文件
+    detail = await loop.run_in_executor(None, db.get_batch_task_detail, taskname) or {}
+    result_file = detail.get("result_file")
+    if not result_file or not result_file.endswith(".jsonl"):
+        result_file = os.path.join("batch_results", f"{taskname}_{int(datetime.now().timestamp())}.jsonl")
+        await loop.run_in_executor(None, lambda: db.update_batch_task(taskname, result_file=result_file))
+    writer = ResultWriter(result_file)
+    limiter = AdaptiveConcurrency(searnum)
+
     task = type('Task', (), {
         'curpro': 0,
-        'numpro': len(data),
-        'domains': [],
-        'query_keywords': [],  # 记录每个查询的关键词
+        'numpro': total,
+        'failed': 0,
+        'result_file': result_file,
         'appname': apptype,
-        'cancelled': False
+        'cancelled': False,
+        'completed': False,
+        'limiter': limiter,
+        'updated': asyncio.Event()  # 进度变化时置位，供推送接口等待
     })()
-    
-    request.app["tasks"][taskname] = task
 
-    async def process_app(appname, semaphore):
-        async with semaphore:
+    app["tasks"][taskname] = task
+
+    # 以结果文件为准恢复进度：已写入结果但未来得及标记完成的关键词不再重复查询
+    done = await loop.run_in_executor(None, writer.open)
+    writer.start()
+    task.curpro = writer.count
+    if done:
+        await loop.run_in_executor(None, db.mark_batch_items_done, taskname, list(done))
+    counts = await loop.run_in_executor(None, db.get_batch_item_counts, taskname)
+    task.failed = counts.get("failed", 0)
+
+    page_size = 26  # 官方单页最大支持26条
+    max_page_retry = config.captcha.retry_times  # 单页最大重试次数，统一用配置
+    page_concurrency = max(1, int(config.system.batch_page_concurrency or 4))
+
+    async def query_upstream(call):
+        """占用一个并发名额发出一次上游请求，按这一次请求的结果与耗时（不含排队与租用代理的等待）调整并发"""
+        async with limiter.slot() as started:
+            try:
+                data = await call()
+            except Exception:
+                limiter.record(OUTCOME_ERROR, started)
+                raise
+        limiter.record(query_outcome(data), started)
+        return data
+
+    async def fetch_page(appname, page_num, proxy):
+        """获取单页数据，失败时重试，返回最后一次的查询结果"""
+        data = {"code": 499, "message": "任务已取消"}
+        for page_retry_count in range(1, max_page_retry + 1):
             if task.cancelled:
-                return
-                
-            error_retry_times = 0
-            all_results = []  # 将 all_results 移到外层，避免重试时被重置
+                return data
+            # 每次上游请求各占一个并发名额，翻页请求同样计入任务的并发上限
+            data = await query_upstream(
+                lambda: appth.get(apptype)(appname, pageNum=page_num, pageSize=page_size, proxy=proxy))
+            if data["code"] == 200:
+                return data
+            logger.info(f"批量任务 {taskname} - {appname}: 第{page_num}页查询失败，重试 {page_retry_count}/{max_page_retry}")
+        logger.warning(f"批量任务 {taskname} - {appname}: 第{page_num}页重试{max_page_retry}次后仍失败，跳过")
+        return data
+
+    async def fetch_all_pages(appname, proxy):
+        """
+        先取第1页拿到 total，再按单关键词页并发上限并发获取剩余页，按页码顺序合并
+        返回 (第1页结果, 各页列表)；第1页失败时各页列表为空
+        """
+        first = await fetch_page(appname, 1, proxy)
+        if first["code"] != 200:
+            return first, []
+
+        first_list = first.get("params", {}).get("list", [])
+        total = first.get("params", {}).get("total", 0)
+        if len(first_list) < page_size or total <= len(first_list):
+            return first, [first_list]
+
+        page_count = -(-total // page_size)
+        logger.info(f"批量任务 {taskname} - {appname}: 共 {total} 条记录，并发获取剩余 {page_count - 1} 页")
+        page_semaphore = asyncio.Semaphore(page_concurrency)
+
+        async def fetch_rest(page_num):
+            async with page_semaphore:
+                return await fetch_page(appname, page_num, proxy)
+
+        fetches = [asyncio.ensure_future(fetch_rest(n)) for n in range(2, page_count + 1)]
+        try:
+            rest = await asyncio.gather(*fetches)
+        except BaseException:
+            # 某页出错（或任务被中断）时取消其余页，不留下无人等待的请求
+            for fetch in fetches:
+                fetch.cancel()
+            await asyncio.gather(*fetches, return_exceptions=True)
+            raise
+        pages = [first_list]
+        for page_num, data in enumerate(rest, 2):
+            if data["code"] == 200:
+                pages.append(data.get("params", {}).get("list", []))
+        return first, pages
+
+    async def process_app(appname):
+        """查询单个关键词（含翻页与重试），成功时返回结果列表，失败或取消时返回 None"""
+        if task.cancelled:
+            return None
+
+        error_retry_times = 0
+
+        while error_retry_times < config.captcha.retry_times:
+            if task.cancelled:
+                return None
+
+            error_retry_times += 1
+            proxy = None
             
-            while error_retry_times < config.captcha.retry_times:
-                if task.cancelled:
-                    return
-                    
-                error_retry_times += 1
-                proxy = None
-                
-                try:
+            try:
+                async with AsyncExitStack() as stack:
+                    lease = None
                     # 获取代理逻辑
                     if config.proxy.local_ipv6_pool.enable:
                         proxy = ""
@@ -62,7 +160,9 @@ async def create_task(taskname, data, request, searnum, apptype="web"):
                         logger.info(f"使用隧道代理：{proxy}")
                     elif config.proxy.extra_api.url and is_valid_url(config.proxy.extra_api.url):
                         if config.proxy.extra_api.auto_maintenace:
-                            proxy = await request.app.proxypool.getproxy()
+                            # 从本地地址池租用代理，本次尝试结束后归还并报告结果
+                            lease = await stack.enter_async_context(app.proxypool.lease())
+                            proxy = lease.proxy
                             logger.info(f"从本地地址池获得代理：{proxy}")
                         else:
                             timeout = aiohttp.ClientTimeout(total=config.system.http_client_timeout)
@@ -73,182 +173,252 @@ async def create_task(taskname, data, request, searnum, apptype="web"):
                             logger.info(f"从代理提取接口获得代理：{proxy}")
 
                     # 执行查询 - 支持分页获取所有数据
-                    page_num = 1
-                    page_size = 26  # 官方单页最大支持26条
-                    
                     # 对于违法违规类型，不支持分页
                     if apptype in ["bapp", "bweb", 'bkapp', 'bmapp']:
-                        data = await bappth.get(apptype)(appname, proxy=proxy)
+                        data = await query_upstream(lambda: bappth.get(apptype)(appname, proxy=proxy))
                     else:
-                        # 循环获取所有页
-                        page_retry_count = 0
-                        max_page_retry = config.captcha.retry_times  # 单页最大重试次数，统一用配置
-                        
-                        while True:
-                            if task.cancelled:
-                                return
-                            
-                            data = await appth.get(apptype)(appname, pageNum=page_num, pageSize=page_size, proxy=proxy)
-                            
-                            # 如果请求失败，重试当前页
-                            if data["code"] != 200:
-                                page_retry_count += 1
-                                if page_retry_count >= max_page_retry:
-                                    logger.warning(f"批量任务 {taskname} - {appname}: 第{page_num}页重试{max_page_retry}次后仍失败，跳过")
-                                    break
-                                logger.info(f"批量任务 {taskname} - {appname}: 第{page_num}页查询失败，重试 {page_retry_count}/{max_page_retry}")
-                                continue
-                            
-                            # 重置重试计数
-                            page_retry_count = 0
-                            
-                            current_list = data.get("params", {}).get("list", [])
-                            if not current_list:
-                                break
-                            
-                            all_results.extend(current_list)
-                            
-                            # 检查是否还有更多数据
-                            total = data.get("params", {}).get("total", 0)
-                            if len(all_results) >= total or len(current_list) < page_size:
-                                logger.info(f"批量任务 {taskname} - {appname}: 共获取 {len(all_results)} 条记录（完成）")
-                                break
-                            
-                            page_num += 1
-                            logger.info(f"批量任务 {taskname} - {appname}: 已获取 {len(all_results)}/{total} 条记录")
-                        
-                        # 更新data中的list为所有结果
-                        if all_results:
-                            if data.get("params"):
-                                data["params"]["list"] = all_results
-                            else:
-                                data = {"code": 200, "params": {"list": all_results, "total": len(all_results)}}
-
-                    # 处理响应
-                    if data.get("code") == 500:
-                        if "请求验证码时失败" in data.get("message", ''):
-                            if proxy and proxy[7:] in pool_cache:
-                                del pool_cache[proxy[7:]]
-                                logger.info(f"代理无效，已剔除代理：{proxy[7:]}")
-
-                        if data.get("message", "") == "当前访问已被创宇盾拦截":
-                            logger.warning(f"当前访问已被创宇盾拦截，批量任务：{taskname}，使用代理：{proxy}")
-                        
-                        # 如果是验证码失败且已经获取了一些数据，不重试整个查询
-                        if all_results:
-                            logger.warning(f"批量任务 {taskname} - {appname}: 验证码失败但已获取 {len(all_results)} 条记录，停止继续查询")
-                            data = {"code": 200, "params": {"list": all_results, "total": len(all_results)}}
-                        else:
-                            # 没有获取到任何数据才继续重试
-                            continue
-
-                    if data.get("code") == 200:
-                        task.curpro += 1
-                        # 记录查询关键词
-                        task.query_keywords.append(appname)
-                        
-                        # 处理返回数据
-                        result_list = data.get("params", {}).get("list", [])
-                        
-                        if len(result_list) == 0:
-                            if apptype == "web":
-                                result_data = [{"contentTypeName": None, "domain": appname, "domainId": None, "leaderName": None,
-                                         "limitAccess": None, "mainId": None, "mainLicence": None, "natureName": None,
-                                         "serviceId": None, "serviceLicence": None, "unitName": None, "updateRecordTime": None}]
-                            elif apptype in ["app", "mapp", "kapp"]:
-                                result_data = [{"cityId": None, "countyId": None, "dataId": None, "leaderName": None,
-                                         "mainId": None, "mainLicence": None, "mainUnitAddress": None, "mainUnitCertNo": None,
-                                         "mainUnitCertType": None, "natureId": None, "natureName": None, "provinceId": None,
-                                         "serviceId": None, "serviceLicence": None, "serviceName": appname, "serviceType": None,
-                                         "unitName": None, "updateRecordTime": None, "version": None}]
-                            else:
-                                result_data = [{'blacklistLevel': None, 'serviceName': appname}]
-                            task.domains.append(result_data)
-                        else:
-                            if apptype in ["bapp", "bweb", 'bkapp', 'bmapp']:
-                                task.domains.append(data["params"])
-                            else:
-                                task.domains.append(data["params"]["list"])
-                        break
-                        
-                except Exception as e:
-                    logger.error(f"处理任务 {appname} 时发生异常: {e}")
+                        data, pages = await fetch_all_pages(appname, proxy)
+                        if task.cancelled:
+                            return None
+                        if data["code"] == 200:
+                            # 重试后仍失败的翻页已被跳过，其余页的记录照常返回
+                            data["params"]["list"] = [item for page in pages for item in page]
+                            logger.info(f"批量任务 {taskname} - {appname}: 共获取 {len(data['params']['list'])} 条记录（完成）")
+
+                    if lease is not None:
+                        lease.report(query_outcome(data))
+
+                # 处理响应
+                if data.get("code") == 500:
+                    if data.get("message", "") == "当前访问已被创宇盾拦截":
+                        logger.warning(f"当前访问已被创宇盾拦截，批量任务：{taskname}，使用代理：{proxy}")
+                    # 第1页（或违法违规查询）失败时没有任何数据，重试整个查询
+                    continue
+
+                if data.get("code") == 200:
+                    # 处理返回数据
+                    result_list = data.get("params", {}).get("list", [])
                     
-            if error_retry_times >= config.captcha.retry_times:
-                logger.warning(f"任务 {appname} 达到最大尝试次数 {config.captcha.retry_times}，仍未成功完成")
+                    if len(result_list) == 0:
+                        if apptype == "web":
+                            result_data = [{"contentTypeName": None, "domain": appname, "domainId": None, "leaderName": None,
+                                     "limitAccess": None, "mainId": None, "mainLicence": None, "natureName": None,
+                                     "serviceId": None, "serviceLicence": None, "unitName": None, "updateRecordTime": None}]
+                        elif apptype in ["app", "mapp", "kapp"]:
+                            result_data = [{"cityId": None, "countyId": None, "dataId": None, "leaderName": None,
+                                     "mainId": None, "mainLicence": None, "mainUnitAddress": None, "mainUnitCertNo": None,
+                                     "mainUnitCertType": None, "natureId": None, "natureName": None, "provinceId": None,
+                                     "serviceId": None, "serviceLicence": None, "serviceName": appname, "serviceType": None,
+                                     "unitName": None, "updateRecordTime": None, "version": None}]
+                        else:
+                            result_data = [{'blacklistLevel': None, 'serviceName': appname}]
+                        return result_data
+                    if apptype in ["bapp", "bweb", 'bkapp', 'bmapp']:
+                        return data["params"]
+                    return data["params"]["list"]
+
+            except Exception as e:
+                logger.error(f"处理任务 {appname} 时发生异常: {e}")
+
+        logger.warning(f"任务 {appname} 达到最大尝试次数 {config.captcha.retry_times}，仍未成功完成")
+        return None
+
+    # 按并发上限启动工作协程，实际同时发出的上游请求数由 limiter 控制
+    worker_count = limiter.max_limit
+    queue = asyncio.Queue(maxsize=worker_count * 2)
+
+    async def feeder():
+        """按批从数据库领取待处理关键词，领取完毕后通知工作协程退出"""
+        while not task.cancelled:
+            items = await loop.run_in_executor(None, db.claim_batch_items, taskname, limiter.limit * 2)
+            if not items:
+                break
+            for item in items:
+                await queue.put(item)
+        for _ in range(worker_count):
+            await queue.put(None)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if task.cancelled:
+                # 继续取空队列，避免领取协程阻塞
+                continue
+            idx, appname = item
+            result = await process_app(appname)
+            if task.cancelled:
+                continue
+            if result is not None:
+                writer.append(idx, appname, result)
+                task.curpro += 1
+            else:
+                task.failed += 1
+            _notify_task(task)
+            await loop.run_in_executor(
+                None, db.finish_batch_item, taskname, idx, "done" if result is not None else "failed"
+            )
 
-    # 使用信号量限制并发数
-    semaphore = asyncio.Semaphore(searnum)
-    tasks = [process_app(appname, semaphore) for appname in data]
-    
     try:
-        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(feeder(), *[worker() for _ in range(worker_count)])
+    except asyncio.CancelledError:
+        logger.info(f"批量任务 {taskname} 已中断，未完成的关键词将在服务重启后继续")
+        raise
     except Exception as e:
         logger.error(f"批量任务 {taskname} 执行失败: {e}")
     finally:
-        # 任务完成后保存结果到文件
-        if taskname in request.app["tasks"]:
-            task = request.app["tasks"][taskname]
+        try:
+            await writer.close()
+        except Exception as e:
+            logger.error(f"关闭结果文件失败: {e}")
+
+        counts = await loop.run_in_executor(None, db.get_batch_item_counts, taskname)
+        unfinished = counts.get("pending", 0) + counts.get("in_flight", 0)
+        # 全部关键词处理完毕后标记完成；被删除或中断的任务不做收尾
+        if taskname in app["tasks"] and not task.cancelled and not unfinished:
             task.completed = True
-            
-            # 创建results目录
-            results_dir = "batch_results"
-            os.makedirs(results_dir, exist_ok=True)
-            
-            # 保存结果到JSON文件
-            result_file = os.path.join(results_dir, f"{taskname}_{int(datetime.now().timestamp())}.json")
-            
-            try:
-                with open(result_file, 'w', encoding='utf-8') as f:
-                    result_data = {
-                        'task_name': taskname,
-                        'task_type': apptype,
-                        'total_count': len(data),
-                        'completed_count': task.curpro,
-                        'query_keywords': task.query_keywords,  # 保存查询关键词列表
-                        'result': task.domains
-                    }
-                    json.dump(result_data, f, ensure_ascii=False, indent=2)
-                
-                # 更新数据库
-                db = request.app.get("db")
-                if db:
-                    success_count = sum(1 for item in task.domains if item and len(item) > 0)
-                    db.update_batch_task(
-                        taskname, 
-                        completed_count=task.curpro,
-                        success_count=success_count,
-                        status='completed',
-                        result_file=result_file,
-                        finish_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    )
-                    logger.info(f"批量任务 {taskname} 已完成，结果已保存到 {result_file}")
-            except Exception as e:
-                logger.error(f"保存任务结果失败: {e}")
+            await loop.run_in_executor(None, lambda: db.update_batch_task(
+                taskname,
+                completed_count=task.curpro,
+                success_count=task.curpro,
+                status='completed',
+                finish_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            ))
+            logger.info(f"批量任务 {taskname} 已完成，结果已保存到 {result_file}")
+        _notify_task(task)
+
+
+def _notify_task(task):
+    """唤醒等待该任务进度的推送连接"""
+    event, task.updated = task.updated, asyncio.Event()
+    event.set()
+
+
+def start_batch_task(app, taskname, total, searnum, apptype):
+    """启动批量任务协程并交给任务管理器"""
+    async_task = asyncio.create_task(create_task(taskname, total, app, searnum, apptype))
+    task_manager = app.get('task_manager')
+    if task_manager:
+        task_manager.add_task(taskname, async_task)
+    return async_task
+
+
+async def resume_batch_tasks(app):
+    """服务启动时恢复上次未完成的批量任务（用于app启动时）"""
+    db = app.get("db")
+    if not db:
+        return
+    loop = asyncio.get_running_loop()
+    reset = await loop.run_in_executor(None, db.reset_inflight_batch_items)
+    if reset:
+        logger.info(f"重置上次中断时处理中的关键词 {reset} 个")
+
+    for row in await loop.run_in_executor(None, db.get_unfinished_batch_tasks):
+        taskname = row["task_name"]
+        counts = await loop.run_in_executor(None, db.get_batch_item_counts, taskname)
+        if not counts:
+            # 旧版本创建的任务没有关键词队列，无法恢复
+            db.update_batch_task(taskname, status='interrupted')
+            logger.warning(f"批量任务 {taskname} 没有关键词队列，无法恢复，已标记为中断")
+            continue
+        start_batch_task(app, taskname, row["total_count"], int(row["query_num"] or 20), row["task_type"])
+        logger.info(f"恢复批量任务：{taskname}，剩余 {counts.get('pending', 0)} 个关键词")
+        log_collector.add_log(f"恢复批量任务：{taskname}，剩余 {counts.get('pending', 0)} 个关键词")
+
+
+def _task_progress(task):
+    """任务进度计数"""
+    return {
+        "code": 200,
+        "curpro": task.curpro,
+        "numpro": task.numpro,
+        "failed": task.failed,
+        "completed": task.completed,
+        "tasktype": task.appname,
+        "progress": int(task.curpro / task.numpro * 100),
+        "concurrency": task.limiter.limit,
+        "inflight": task.limiter.inflight,
+    }
+
+
+@routes.get(r"/query/task/stream")
+async def stream_task(request):
+    """
+    以 SSE 推送批量任务进度（事件 progress，id 为已推送的结果数），
+    每个事件携带该 id 之后新增的结果；从 Last-Event-ID / since 续传，任务结束时发送 done 事件
+    """
+    taskname = request.query.get("taskname")
+    task = request.app["tasks"].get(taskname)
+    if task is None:
+        return wj({"code": 404, "message": "任务不存在"})
+
+    cursor = last_event_id(request) or 0
+    loop = asyncio.get_running_loop()
+    resp = await open_stream(request)
+    try:
+        while True:
+            updated = task.updated
+            records = await loop.run_in_executor(None, read_results, task.result_file, cursor, 500)
+            if records:
+                cursor += len(records)
+                data = _task_progress(task)
+                data.update({
+                    "cursor": cursor,
+                    "query_keywords": [r["keyword"] for r in records],
+                    "data": [r["result"] for r in records]
+                })
+                await send_event(resp, data, event="progress", event_id=cursor)
+                continue
+            if task.completed or task.cancelled:
+                data = _task_progress(task)
+                data.update({"cursor": cursor, "cancelled": task.cancelled})
+                await send_event(resp, data, event="done", event_id=cursor)
+                break
+            if not await wait_event(updated):
+                await send_heartbeat(resp)
+    except (ConnectionResetError, asyncio.TimeoutError):
+        pass
+    return resp
 
 
 @jsondump
 @routes.view(r"/query/task")
 async def querytask(request):
-    """查询任务进度"""
+    """
+    查询任务进度
+    mode=progress 时只返回计数；since=N 时只返回序号 N 之后新增的结果（可配合 limit），
+    响应中的 cursor 即下一次请求的 since；两者都不传时返回全部结果
+    """
     taskname = request.query.get("taskname")
     task = request.app["tasks"].get(taskname)
-    if task is not None:
-        return wj({
-                "code": 200,
-                "curpro": task.curpro,
-                "numpro": task.numpro,
-                "tasktype": task.appname,
-                "progress": int(task.curpro / task.numpro * 100),
-                "query_keywords": task.query_keywords,  # 返回查询关键词列表
-                "data":task.domains
-            })
-    else:
+    if task is None:
         return wj({
             "code":404,
             "message":"任务不存在"
         })
 
+    result = _task_progress(task)
+    if request.query.get("mode") == "progress":
+        return wj(result)
+
+    since = request.query.get("since")
+    limit = request.query.get("limit")
+    try:
+        since = max(0, int(since)) if since is not None else 0
+        limit = max(0, int(limit)) if limit is not None else None
+    except ValueError:
+        return wj({"code": 400, "message": "since/limit 参数错误"})
+
+    records = await asyncio.get_running_loop().run_in_executor(None, read_results, task.result_file, since, limit)
+    result.update({
+        "since": since,
+        "cursor": since + len(records),
+        "query_keywords": [r["keyword"] for r in records],  # 返回查询关键词列表
+        "data": [r["result"] for r in records]
+    })
+    return wj(result)
+
 
 @jsondump
 @routes.view(r"/create/task")
@@ -277,20 +447,22 @@ async def create_task_catch(request):
         if taskname in request.app["tasks"]:
             return wj({"code": 409, "message": "任务已存在"})
         
-        # 保存任务到数据库
+        # 保存任务及关键词队列到数据库
         db = request.app.get("db")
-        if db:
-            db.add_batch_task(taskname, seartype, len(domains))
-        
-        # 创建异步任务
-        task_coroutine = create_task(taskname, domains, request, searnum, seartype)
-        async_task = asyncio.create_task(task_coroutine)
-        
-        # 添加任务到管理器
-        task_manager = request.app.get('task_manager')
-        if task_manager:
-            task_manager.add_task(taskname, async_task)
-        
+        if not db:
+            return wj({"code": 500, "message": "数据库未初始化"})
+        loop = asyncio.get_running_loop()
+        # 任务名在历史记录中唯一，不覆盖已有记录
+        if await loop.run_in_executor(None, db.get_batch_task_detail, taskname):
+            return wj({"code": 409, "message": "历史记录中已存在同名任务，请更换任务名或先删除该记录"})
+        task_id = await loop.run_in_executor(
+            None, lambda: db.add_batch_task(taskname, seartype, len(domains), keywords=domains, query_num=searnum)
+        )
+        if task_id is None:
+            return wj({"code": 500, "message": "保存任务失败"})
+
+        start_batch_task(request.app, taskname, len(domains), searnum, seartype)
+
         logger.info(f"创建批量查询任务：{taskname}")
         log_collector.add_log(f"创建批量查询任务：{taskname}，类型：{seartype}，数量：{len(domains)}")
         return wj({"code": 200,"message":"创建任务成功"})
@@ -314,8 +486,13 @@ async def del_task(request):
             if task_manager:
                 task_manager.remove_task(taskname)
             
-            # 从应用任务字典中删除
+            # 从应用任务字典中删除，并标记数据库记录，重启后不再恢复
             del request.app["tasks"][taskname]
+            _notify_task(task)
+            db = request.app.get("db")
+            if db:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: db.update_batch_task(taskname, status='cancelled'))
             
             logger.warning(f"删除批量查询任务：{taskname}")
             log_collector.add_log(f"删除批量查询任务：{taskname}")
@@ -358,12 +535,29 @@ async def get_batch_task_detail(request):
         task = db.get_batch_task_detail(task_name)
         
         if task:
-            # 如果任务已完成且有结果文件，读取结果
-            if task.get('result_file') and os.path.exists(task['result_file']):
+            # 如果有结果文件，读取结果；JSONL 结果支持 offset/limit 分页
+            result_file = task.get('result_file')
+            if result_file and os.path.exists(result_file):
                 try:
-                    with open(task['result_file'], 'r', encoding='utf-8') as f:
-                        result_data = json.load(f)
-                        task['result_data'] = result_data
+                    if result_file.endswith(".jsonl"):
+                        offset = int(request.query.get("offset", 0))
+                        limit = request.query.get("limit")
+                        loop = asyncio.get_running_loop()
+                        records = await loop.run_in_executor(
+                            None, read_results, result_file, offset, int(limit) if limit else None)
+                        task['result_data'] = {
+                            'task_name': task_name,
+                            'task_type': task['task_type'],
+                            'total_count': task['total_count'],
+                            'completed_count': task['completed_count'],
+                            'result_total': await loop.run_in_executor(None, count_results, result_file),
+                            'offset': offset,
+                            'query_keywords': [r["keyword"] for r in records],
+                            'result': [r["result"] for r in records]
+                        }
+                    else:
+                        with open(result_file, 'r', encoding='utf-8') as f:
+                            task['result_data'] = json.load(f)
                 except Exception as e:
                     logger.error(f"读取结果文件失败: {e}")
             
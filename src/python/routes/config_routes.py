@@ -49,6 +49,70 @@ def _mcp_config_public():
     }
 
 
+def _cache_config_public():
+    c = getattr(config, "cache", None)
+    return {
+        "enable": bool(getattr(c, "enable", False)),
+        "max_mb": int(getattr(c, "max_mb", None) or 64),
+        "ttl": int(getattr(c, "ttl", None) or 600),
+        "empty_ttl": int(getattr(c, "empty_ttl", None) or 60),
+        "black_ttl": int(getattr(c, "black_ttl", None) or 300),
+        "persist": bool(getattr(c, "persist", False)),
+        "persist_ttl": int(getattr(c, "persist_ttl", None) or 86400),
+        "max_age": int(getattr(c, "max_age", None) or 3600),
+        "sweep_interval": int(getattr(c, "sweep_interval", None) or 300),
+    }
+
+
+def _detail_cache_config_public():
+    c = getattr(config, "detail_cache", None)
+    return {
+        "enable": bool(getattr(c, "enable", False)),
+        "ttl": int(getattr(c, "ttl", None) or 86400),
+        "max_entries": int(getattr(c, "max_entries", None) or 10000),
+        "persist": bool(getattr(c, "persist", False)),
+    }
+
+
+def _rate_limit_config_public():
+    c = getattr(config, "rate_limit", None)
+    return {
+        "enable": bool(getattr(c, "enable", False)),
+        "rate": float(getattr(c, "rate", None) or 2),
+        "burst": float(getattr(c, "burst", None) or 5),
+    }
+
+
+def _broker_config_public():
+    c = getattr(config, "broker", None)
+    return {
+        "enable": bool(getattr(c, "enable", False)),
+        "path": getattr(c, "path", None) or "egress_broker.db",
+    }
+
+
+def _egress_health_config_public():
+    c = getattr(config, "egress_health", None)
+    enable = getattr(c, "enable", None)
+    return {
+        "enable": True if enable is None else bool(enable),
+        "block_quarantine": int(getattr(c, "block_quarantine", None) or 300),
+        "block_recovery": int(getattr(c, "block_recovery", None) or 600),
+        "min_success": float(getattr(c, "min_success", None) or 0.5),
+        "min_samples": int(getattr(c, "min_samples", None) or 5),
+        "quarantine": int(getattr(c, "quarantine", None) or 60),
+    }
+
+
+def _merge_cache_config(cache_in, public=_cache_config_public):
+    """前端未提交的缓存配置项保持原值"""
+    result = public()
+    for key, value in (cache_in or {}).items():
+        if key in result:
+            result[key] = type(result[key])(value)
+    return result
+
+
 def _merge_auth_users(users_in):
     """前端空密码表示保持原密码"""
     old_map = {}
@@ -85,13 +149,29 @@ async def get_config(request):
                 "port": config.system.port,
                 "http_client_timeout": config.system.http_client_timeout,
                 "web_ui": config.system.web_ui,
-                "detail_concurrency": config.system.detail_concurrency
+                "detail_concurrency": config.system.detail_concurrency,
+                "detail_timeout": config.system.detail_timeout or 10,
+                "batch_page_concurrency": config.system.batch_page_concurrency or 4,
+                "batch_fsync_interval": config.system.batch_fsync_interval or 5,
+                "batch_adaptive": config.system.batch_adaptive if config.system.batch_adaptive is not None else True,
+                "batch_min_concurrency": config.system.batch_min_concurrency or 1,
+                "batch_max_concurrency": config.system.batch_max_concurrency or 0,
+                "batch_latency_tolerance": config.system.batch_latency_tolerance or 2,
+                "session_pool_size": config.system.session_pool_size or 64,
+                "session_idle_timeout": config.system.session_idle_timeout or 60,
+                "token_refresh_ahead": config.system.token_refresh_ahead or 30,
+                "workers": config.system.workers or 1
             },
             "captcha": {
                 "enable": config.captcha.enable,
                 "save_failed_img": config.captcha.save_failed_img,
                 "save_failed_img_path": config.captcha.save_failed_img_path,
-                "retry_times": config.captcha.retry_times
+                "retry_times": config.captcha.retry_times,
+                "solver_workers": config.captcha.solver_workers or 0,
+                "solver_mode": config.captcha.solver_mode or "thread",
+                "solver_queue": config.captcha.solver_queue or 64,
+                "sign_reservoir": config.captcha.sign_reservoir or 0,
+                "sign_ttl": config.captcha.sign_ttl or 60
             },
             "proxy": {
                 "local_ipv6_pool": {
@@ -110,7 +190,10 @@ async def get_config(request):
                     "timeout_drop": config.proxy.extra_api.timeout_drop,
                     "check_proxy": config.proxy.extra_api.check_proxy,
                     "proxy_timeout": config.proxy.extra_api.proxy_timeout,
+                    "check_timeout": config.proxy.extra_api.check_timeout or 5,
                     "check_proxy_num": config.proxy.extra_api.check_proxy_num,
+                    "check_url": config.proxy.extra_api.check_url or "",
+                    "max_inflight": config.proxy.extra_api.max_inflight or 0,
                     "auto_maintenace": config.proxy.extra_api.auto_maintenace,
                     "pool_num": config.proxy.extra_api.pool_num
                 }
@@ -126,6 +209,11 @@ async def get_config(request):
                 "save_log": config.log.save_log,
                 "output_console": config.log.output_console
             },
+            "cache": _cache_config_public(),
+            "detail_cache": _detail_cache_config_public(),
+            "rate_limit": _rate_limit_config_public(),
+            "egress_health": _egress_health_config_public(),
+            "broker": _broker_config_public(),
             "history": {
                 "save_query_history": getattr(config, 'history', None) and getattr(config.history, 'save_query_history', True)
             },
@@ -154,13 +242,29 @@ async def save_config(request):
                     "port": int(data.get("system", {}).get("port", 16181)),
                     "http_client_timeout": int(data.get("system", {}).get("http_client_timeout", 5)),
                     "web_ui": bool(data.get("system", {}).get("web_ui", True)),
-                    "detail_concurrency": int(data.get("system", {}).get("detail_concurrency", 5))
+                    "detail_concurrency": int(data.get("system", {}).get("detail_concurrency", 5)),
+                    "detail_timeout": int(data.get("system", {}).get("detail_timeout", config.system.detail_timeout or 10)),
+                    "batch_page_concurrency": int(data.get("system", {}).get("batch_page_concurrency", config.system.batch_page_concurrency or 4)),
+                    "batch_fsync_interval": int(data.get("system", {}).get("batch_fsync_interval", config.system.batch_fsync_interval or 5)),
+                    "batch_adaptive": bool(data.get("system", {}).get("batch_adaptive", True)),
+                    "batch_min_concurrency": int(data.get("system", {}).get("batch_min_concurrency", config.system.batch_min_concurrency or 1)),
+                    "batch_max_concurrency": int(data.get("system", {}).get("batch_max_concurrency", config.system.batch_max_concurrency or 0)),
+                    "batch_latency_tolerance": float(data.get("system", {}).get("batch_latency_tolerance", config.system.batch_latency_tolerance or 2)),
+                    "session_pool_size": int(data.get("system", {}).get("session_pool_size", config.system.session_pool_size or 64)),
+                    "session_idle_timeout": int(data.get("system", {}).get("session_idle_timeout", config.system.session_idle_timeout or 60)),
+                    "token_refresh_ahead": int(data.get("system", {}).get("token_refresh_ahead", config.system.token_refresh_ahead or 30)),
+                    "workers": int(data.get("system", {}).get("workers", config.system.workers or 1))
                 },
                 "captcha": {
                     "enable": bool(data.get("captcha", {}).get("enable", True)),
                     "save_failed_img": bool(data.get("captcha", {}).get("save_failed_img", False)),
                     "save_failed_img_path": data.get("captcha", {}).get("save_failed_img_path", "faile_captcha"),
-                    "retry_times": int(data.get("captcha", {}).get("retry_times", 2))
+                    "retry_times": int(data.get("captcha", {}).get("retry_times", 2)),
+                    "solver_workers": int(data.get("captcha", {}).get("solver_workers", config.captcha.solver_workers or 0)),
+                    "solver_mode": data.get("captcha", {}).get("solver_mode", config.captcha.solver_mode or "thread"),
+                    "solver_queue": int(data.get("captcha", {}).get("solver_queue", config.captcha.solver_queue or 64)),
+                    "sign_reservoir": int(data.get("captcha", {}).get("sign_reservoir", config.captcha.sign_reservoir or 0)),
+                    "sign_ttl": int(data.get("captcha", {}).get("sign_ttl", config.captcha.sign_ttl or 60))
                 },
                 "proxy": {
                     "local_ipv6_pool": {
@@ -179,7 +283,10 @@ async def save_config(request):
                         "timeout_drop": int(data.get("proxy", {}).get("extra_api", {}).get("timeout_drop", 8)),
                         "check_proxy": bool(data.get("proxy", {}).get("extra_api", {}).get("check_proxy", True)),
                         "proxy_timeout": float(data.get("proxy", {}).get("extra_api", {}).get("proxy_timeout", 0.5)),
+                        "check_timeout": float(data.get("proxy", {}).get("extra_api", {}).get("check_timeout", config.proxy.extra_api.check_timeout or 5)),
                         "check_proxy_num": int(data.get("proxy", {}).get("extra_api", {}).get("check_proxy_num", 20)),
+                        "check_url": data.get("proxy", {}).get("extra_api", {}).get("check_url", config.proxy.extra_api.check_url) or None,
+                        "max_inflight": int(data.get("proxy", {}).get("extra_api", {}).get("max_inflight", config.proxy.extra_api.max_inflight or 0)),
                         "auto_maintenace": bool(data.get("proxy", {}).get("extra_api", {}).get("auto_maintenace", True)),
                         "pool_num": int(data.get("proxy", {}).get("extra_api", {}).get("pool_num", 100))
                     }
@@ -195,6 +302,11 @@ async def save_config(request):
                     "save_log": bool(data.get("log", {}).get("save_log", False)),
                     "output_console": bool(data.get("log", {}).get("output_console", True))
                 },
+                "cache": _merge_cache_config(data.get("cache")),
+                "detail_cache": _merge_cache_config(data.get("detail_cache"), _detail_cache_config_public),
+                "rate_limit": _merge_cache_config(data.get("rate_limit"), _rate_limit_config_public),
+                "egress_health": _merge_cache_config(data.get("egress_health"), _egress_health_config_public),
+                "broker": _merge_cache_config(data.get("broker"), _broker_config_public),
                 "history": {
                     "save_query_history": bool(data.get("history", {}).get("save_query_history", True))
                 },
@@ -3,10 +3,12 @@
 日志管理路由模块
 处理系统日志相关的API
 """
+import asyncio
 from aiohttp import web
 from middlewares import jsondump, wj
 from mlog import logger
 from log_collector import log_collector
+from sse import open_stream, send_event, send_heartbeat, last_event_id, wait_event
 
 
 routes = web.RouteTableDef()
@@ -15,17 +17,49 @@ routes = web.RouteTableDef()
 @jsondump
 @routes.view(r"/logs/realtime")
 async def get_realtime_logs(request):
-    """获取实时日志"""
+    """获取实时日志，传入 since 时只返回序号更大的日志"""
     limit = int(request.query.get('limit', 500))
+    since = request.query.get('since')
     
     try:
-        logs = log_collector.get_logs(limit)
-        return wj({"code": 200, "data": logs, "total": len(logs)})
+        if since is not None:
+            logs, _ = log_collector.get_logs_since(int(since), limit)
+        else:
+            logs = log_collector.get_logs(limit)
+        return wj({"code": 200, "data": logs, "total": len(logs), "last_id": log_collector.last_id})
     except Exception as e:
         logger.error(f"获取实时日志失败: {e}")
         return wj({"code": 500, "message": f"获取实时日志失败: {str(e)}"})
 
 
+@routes.get(r"/logs/stream")
+async def stream_logs(request):
+    """
+    以 SSE 推送新日志（事件 log，id 为最后一条日志的序号）
+    从 Last-Event-ID / since 之后续传，未指定时只推送连接之后的新日志
+    """
+    since = last_event_id(request)
+    if since is None:
+        since = log_collector.last_id
+    event = log_collector.subscribe()
+    resp = await open_stream(request)
+    try:
+        while True:
+            event.clear()
+            logs, dropped = log_collector.get_logs_since(since, 500)
+            if logs:
+                since = logs[-1]["id"]
+                await send_event(resp, {"logs": logs, "dropped": dropped}, event="log", event_id=since)
+                continue
+            if not await wait_event(event):
+                await send_heartbeat(resp)
+    except (ConnectionResetError, asyncio.TimeoutError):
+        pass
+    finally:
+        log_collector.unsubscribe(event)
+    return resp
+
+
 @jsondump
 @routes.view(r"/logs/clear")
 async def clear_logs(request):
@@ -10,8 +10,9 @@ from aiohttp import web
 from middlewares import jsondump, wj
 from load_config import config
 from mlog import logger
-from proxy_pool import pool_cache
+from concurrency import query_outcome
 from utils import is_valid_url
+from result_cache import result_count, CACHE_BYPASS
 
 
 routes = web.RouteTableDef()
@@ -38,6 +39,7 @@ async def geturl(request):
         pageNum = request.query.get("pageNum")
         pageSize = request.query.get("pageSize")
         proxy = request.query.get("proxy")
+        max_age = request.query.get("maxAge")
         
     if request.method == "POST":
         data = await request.json()
@@ -45,6 +47,7 @@ async def geturl(request):
         pageNum = data.get("pageNum")
         pageSize = data.get("pageSize")
         proxy = data.get("proxy")
+        max_age = data.get("maxAge")
 
     if not not any(appname.endswith(suffix) for suffix in config.risk_avoidance.prohibit_suffix):
         return wj({"code": 405,"message":"不允许的查询内容"})
@@ -53,18 +56,73 @@ async def geturl(request):
         return wj({"code":101,"msg":"参数错误,请指定search参数"})
     
     if proxy is not None:
-        logger.info(f"使用指定代理：{proxy}")
-        for i in range(config.captcha.retry_times):
+        fetch = lambda: _query_with_proxy(appth, bappth, path, appname, pageNum, pageSize, proxy)
+    else:
+        fetch = lambda: _query_upstream(request, appth, bappth, path, appname, pageNum, pageSize)
+
+    # 相同查询命中缓存或合并到正在进行的上游请求；Cache-Control: no-cache 时跳过缓存
+    result_cache = request.app.get("result_cache")
+    if result_cache is not None:
+        cache_control = request.headers.get("Cache-Control", "")
+        bypass = "no-cache" in cache_control
+        key = result_cache.make_key(path, appname, pageNum, pageSize)
+        data, cache_status = await result_cache.get_or_fetch(
+            key, path, fetch, bypass=bypass, max_age=_parse_max_age(max_age, cache_control))
+    else:
+        data, cache_status = await fetch(), CACHE_BYPASS
+
+    if data.get("code", 500) == 200:
+        # 保存历史记录（根据配置决定是否保存）；命中缓存或合并的查询同样记录
+        save_history = getattr(config, 'history', None) and getattr(config.history, 'save_query_history', True)
+        if save_history:
+            db = request.app.get("db")
+            if db:
+                db.add_history(path, appname, result_count(path, data), data.get("params"))
+    return wj(data, headers={"X-Cache": cache_status})
+
+
+def _parse_max_age(max_age, cache_control):
+    """解析可接受的缓存结果最大年龄（秒）：maxAge 参数优先，其次 Cache-Control: max-age=N"""
+    if max_age is None:
+        for directive in cache_control.split(","):
+            name, _, value = directive.strip().partition("=")
+            if name.lower() == "max-age":
+                max_age = value
+                break
+    try:
+        return max(0.0, float(max_age)) if max_age is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+async def _query_with_proxy(appth, bappth, path, appname, pageNum, pageSize, proxy):
+    """使用请求指定的代理查询"""
+    logger.info(f"使用指定代理：{proxy}")
+    for i in range(config.captcha.retry_times):
+        if path in appth:
             data = await appth.get(path)(appname, pageNum, pageSize, proxy=f"http://{proxy}")
-            if data.get("code", 500) == 200:
-                return wj(data)
-            if data.get("message", "") == "当前访问已被创宇盾拦截":
-                logger.warning("当前访问已被创宇盾拦截")
-                return wj(data)
-        return wj(data)
+        else:
+            data = await bappth.get(path)(appname, proxy=f"http://{proxy}")
+        if data.get("code", 500) == 200:
+            return data
+        if data.get("message", "") == "当前访问已被创宇盾拦截":
+            logger.warning("当前访问已被创宇盾拦截")
+            return data
+    return data
+
 
+async def _call_upstream(appth, bappth, path, appname, pageNum, pageSize, proxy):
+    """调用对应类型的查询处理器"""
+    if path in appth:
+        return await appth.get(path)(appname, pageNum, pageSize, proxy=proxy)
+    return await bappth.get(path)(appname, proxy=proxy)
+
+
+async def _query_upstream(request, appth, bappth, path, appname, pageNum, pageSize):
+    """按配置的代理方式查询，失败时重试"""
     for i in range(config.captcha.retry_times):
         proxy = None
+        data = None
         if config.proxy.local_ipv6_pool.enable:
             proxy = ""
 
@@ -74,13 +132,16 @@ async def geturl(request):
                 logger.info(f"使用隧道代理：{proxy}")
             else:
                 logger.error(f"当前启用隧道代理，但代理地址无效：{config.proxy.tunnel.url}")
-                return wj({"code":500,"message":"当前启用隧道代理，但代理地址无效"})
+                return {"code":500,"message":"当前启用隧道代理，但代理地址无效"}
 
         elif not proxy and config.proxy.extra_api.url:
             if is_valid_url(config.proxy.extra_api.url):
                 if config.proxy.extra_api.auto_maintenace:
-                    proxy = await request.app.proxypool.getproxy()
-                    logger.info(f"从本地地址池获得代理：{proxy}")
+                    # 从本地地址池租用代理，用完归还并报告结果
+                    async with request.app.proxypool.lease() as lease:
+                        logger.info(f"从本地地址池获得代理：{lease.proxy}")
+                        data = await _call_upstream(appth, bappth, path, appname, pageNum, pageSize, lease.proxy)
+                        lease.report(query_outcome(data))
                 else:
                     timeout = aiohttp.ClientTimeout(total=config.system.http_client_timeout)
                     async with aiohttp.ClientSession(timeout=timeout) as session:
@@ -90,25 +151,16 @@ async def geturl(request):
                     logger.info(f"从代理提取接口获得代理：{proxy}")
             else:
                 logger.error(f"当前启用API提取代理，但API地址无效：{config.proxy.extra_api.url}")
-                return wj({"code":500,"message":"当前启用API提取代理，但API地址无效"})
-        if path in appth:
-            data = await appth.get(path)(appname, pageNum, pageSize, proxy=proxy)
-        else:
-            data = await bappth.get(path)(appname, proxy=proxy)
+                return {"code":500,"message":"当前启用API提取代理，但API地址无效"}
+        if data is None:
+            data = await _call_upstream(appth, bappth, path, appname, pageNum, pageSize, proxy)
 
         if data.get("code", 500) == 200:
-            # 保存历史记录（根据配置决定是否保存）
-            save_history = getattr(config, 'history', None) and getattr(config.history, 'save_query_history', True)
-            if save_history:
-                db = request.app.get("db")
-                if db:
-                    result_count = len(data.get("params", {}).get("list", [])) if path in appth else len(data.get("params", []))
-                    db.add_history(path, appname, result_count, data.get("params"))
-            return wj(data)
+            return data
         if data.get("message", "") == "当前访问已被创宇盾拦截":
             logger.warning("当前访问已被创宇盾拦截")
-            return wj(data)
-    return wj(data)
+            return data
+    return data
 
 
 def setup_query_routes(app):
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+运行统计路由模块
+提供上游会话池、token 缓存、查询结果缓存、跨进程共享状态等内部组件的统计
+"""
+import asyncio
+from aiohttp import web
+from middlewares import jsondump, wj
+from egress_broker import get_broker
+
+
+routes = web.RouteTableDef()
+
+
+@jsondump
+@routes.view(r"/stats")
+async def get_stats(request):
+    """获取运行统计"""
+    icp = request.app.get("icp")
+    if icp is None:
+        return wj({"code": 500, "message": "查询处理器未初始化"})
+    data = icp.stats()
+    result_cache = request.app.get("result_cache")
+    if result_cache is not None:
+        data["result_cache"] = result_cache.stats()
+        if result_cache.db is not None:
+            loop = asyncio.get_running_loop()
+            data["result_cache"]["persisted"] = await loop.run_in_executor(
+                None, result_cache.db.get_cached_results_count)
+    proxypool = getattr(request.app, "proxypool", None)
+    if proxypool is not None:
+        data["proxy_pool"] = proxypool.stats()
+    broker = get_broker()
+    if broker is not None:
+        data["broker"] = await asyncio.get_running_loop().run_in_executor(None, broker.stats)
+    return wj({"code": 200, "data": data})
+
+
+def setup_stats_routes(app):
+    """注册运行统计路由"""
+    app.add_routes(routes)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+上游会话池模块
+按出口（直连 / 本地 IPv6 / 代理）复用长连接的 ClientSession，
+支持空闲回收与数量上限，避免每次请求都重新建立 TLS 连接
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+import aiohttp
+from aiohttp import TCPConnector
+from mlog import logger
+from load_config import config
+
+
+DIRECT_EGRESS = "direct"
+
+
+def egress_key(proxy: Optional[str] = "", local_ipv6: Optional[str] = None) -> str:
+    """计算出口标识：代理优先，其次本地 IPv6，否则为直连"""
+    if proxy:
+        return proxy
+    if local_ipv6:
+        return local_ipv6
+    return DIRECT_EGRESS
+
+
+class _PooledSession:
+    """会话池条目"""
+
+    __slots__ = ("session", "local_addr", "last_used", "inflight")
+
+    def __init__(self, session, local_addr):
+        self.session = session
+        self.local_addr = local_addr
+        self.last_used = time.monotonic()
+        self.inflight = 0
+
+
+class SessionPool:
+    """按出口复用的 ClientSession 池"""
+
+    def __init__(self, connector_config: dict, timeout: aiohttp.ClientTimeout,
+                 max_size: Optional[int] = None, idle_timeout: Optional[float] = None):
+        self.connector_config = connector_config
+        self.timeout = timeout
+        self.max_size = int(max_size or getattr(config.system, "session_pool_size", None) or 64)
+        self.idle_timeout = float(idle_timeout or getattr(config.system, "session_idle_timeout", None) or 60)
+        self._entries = OrderedDict()  # {egress_key: _PooledSession}，按最近使用排序
+        self._lock = asyncio.Lock()
+        self._last_sweep = time.monotonic()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def _create_session(self, local_addr=None):
+        """为出口创建独立连接器与会话"""
+        if local_addr:
+            connector = TCPConnector(local_addr=(local_addr, 0), **self.connector_config)
+        else:
+            connector = TCPConnector(**self.connector_config)
+        return aiohttp.ClientSession(
+            timeout=self.timeout,
+            connector=connector,
+            headers={'Connection': 'keep-alive'}
+        )
+
+    def _pop_evictable(self, now, reserve=0, keep=None):
+        """挑出需要关闭的条目：空闲超时的，以及超出上限时最久未用的空闲条目"""
+        stale = []
+        for key, entry in list(self._entries.items()):
+            if key == keep or entry.inflight > 0:
+                continue
+            if entry.session.closed or now - entry.last_used > self.idle_timeout:
+                stale.append(self._entries.pop(key))
+        overflow = len(self._entries) + reserve - self.max_size
+        if overflow > 0:
+            for key, entry in list(self._entries.items()):
+                if overflow <= 0:
+                    break
+                if key != keep and entry.inflight == 0:
+                    stale.append(self._entries.pop(key))
+                    overflow -= 1
+        return stale
+
+    async def _close_entries(self, entries):
+        for entry in entries:
+            try:
+                await entry.session.close()
+            except Exception:
+                pass
+        if entries:
+            self.evicted += len(entries)
+            logger.debug(f"会话池回收 {len(entries)} 个空闲会话，当前 {len(self._entries)} 个")
+
+    @asynccontextmanager
+    async def session(self, key: str, local_addr: Optional[str] = None):
+        """获取指定出口的共享会话，离开上下文时仅归还，不关闭"""
+        stale = []
+        async with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry is not None and entry.session.closed:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                stale = self._pop_evictable(now, reserve=1)
+                self._last_sweep = now
+                entry = _PooledSession(self._create_session(local_addr), local_addr)
+                self._entries[key] = entry
+                self.created += 1
+            else:
+                self._entries.move_to_end(key)
+                self.reused += 1
+                # 复用路径上限频清理空闲会话
+                if now - self._last_sweep > 1:
+                    stale = self._pop_evictable(now, keep=key)
+                    self._last_sweep = now
+            entry.inflight += 1
+        await self._close_entries(stale)
+
+        try:
+            yield entry.session
+        finally:
+            entry.inflight -= 1
+            entry.last_used = time.monotonic()
+
+    async def discard(self, key: str):
+        """丢弃指定出口的会话（如代理失效、IP 被拦截）"""
+        async with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.inflight > 0:
+                return
+            del self._entries[key]
+        await self._close_entries([entry])
+
+    async def close(self):
+        """关闭所有会话"""
+        async with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        await self._close_entries(entries)
+
+    def stats(self) -> dict:
+        """会话池统计"""
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "created": self.created,
+            "reused": self.reused,
+            "evicted": self.evicted,
+        }
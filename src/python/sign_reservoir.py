@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+验证码签名储备池模块
+后台按出口预先完成 getCheckImagePoint -> 识别 -> checkImage，
+查询时直接取用现成的 (uuid, token, sign)，把打码移出查询关键路径；
+IPv6 轮换与代理池使多数出口只用一次，因此只为被重复使用的出口补充，且同时补充的出口数有上限
+"""
+import asyncio
+import base64
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+import ujson
+from mlog import logger
+from load_config import config
+
+
+# solve 协程返回 check_img 的结果：(是否成功, uuid 或错误信息, token, sign, base_header)
+SignSolver = Callable[[str, Optional[str]], Awaitable[tuple]]
+
+
+def _sign_expire(sign, default_expire):
+    """解析 sign 载荷中的过期时间（字段 e，毫秒时间戳），转换为 time.time() 秒；解析失败时使用默认值"""
+    try:
+        payload = sign.split(".")[0]
+        payload += "=" * (-len(payload) % 4)
+        expire_ms = ujson.loads(base64.urlsafe_b64decode(payload)).get("e")
+        if expire_ms:
+            return min(default_expire, expire_ms / 1000)
+    except Exception:
+        pass
+    return default_expire
+
+
+class _Reservoir:
+    """单个出口的签名储备"""
+
+    __slots__ = ("proxy", "local_ipv6", "signs", "demands", "last_demand", "refill_task", "wakeup")
+
+    def __init__(self, proxy, local_ipv6):
+        self.proxy = proxy
+        self.local_ipv6 = local_ipv6
+        self.signs = deque()  # [(expire, p_uuid, token, sign, base_header)]
+        self.demands = 0
+        self.last_demand = time.monotonic()
+        self.refill_task: Optional[asyncio.Task] = None
+        self.wakeup = asyncio.Event()
+
+
+class SignReservoir:
+    """按出口维护已完成打码的签名，按需后台补充"""
+
+    # 出口被查询达到该次数后才开始补充，只用一次的出口不预先打码
+    REUSE_THRESHOLD = 2
+    # 同时补充的出口数上限
+    MAX_REFILLS = 16
+    # 跟踪的出口数超过该值时清理长期无查询的出口
+    MAX_EGRESSES = 4096
+
+    def __init__(self, solve: SignSolver, size: Optional[int] = None, ttl: Optional[float] = None):
+        captcha_config = getattr(config, 'captcha', object())
+        self.solve = solve
+        self.size = int(size if size is not None else (getattr(captcha_config, 'sign_reservoir', None) or 0))
+        self.ttl = float(ttl or getattr(captcha_config, 'sign_ttl', None) or 60)
+        # 签名剩余有效期少于该秒数即视为过期，留出发送查询的时间
+        self.margin = min(10.0, self.ttl / 4)
+        # 出口多久没有查询就停止为其补充
+        self.idle_timeout = self.ttl * 2
+        self._reservoirs = {}  # {egress_key: _Reservoir}
+        self._refilling = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.solved = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def _fresh(self, reservoir: _Reservoir):
+        """丢弃过期签名，返回剩余数量"""
+        deadline = time.time() + self.margin
+        while reservoir.signs and reservoir.signs[0][0] <= deadline:
+            reservoir.signs.popleft()
+            self.expired += 1
+        return len(reservoir.signs)
+
+    def take(self, key: str, proxy: str = "", local_ipv6: Optional[str] = None):
+        """取出一个可用签名；没有时返回 None。出口被重复使用后，无论命中与否都会触发该出口的后台补充"""
+        if not self.enabled:
+            return None
+        reservoir = self._reservoirs.get(key)
+        if reservoir is None:
+            if len(self._reservoirs) >= self.MAX_EGRESSES:
+                self._prune()
+            reservoir = self._reservoirs[key] = _Reservoir(proxy, local_ipv6)
+        reservoir.demands += 1
+        reservoir.last_demand = time.monotonic()
+
+        item = None
+        if self._fresh(reservoir):
+            _, p_uuid, token, sign, base_header = reservoir.signs.popleft()
+            item = (p_uuid, token, sign, dict(base_header))
+            self.hits += 1
+        else:
+            self.misses += 1
+        self._schedule_refill(key, reservoir)
+        return item
+
+    def _prune(self):
+        """清理长期无查询且没有在补充的出口"""
+        now = time.monotonic()
+        for key in [k for k, r in self._reservoirs.items()
+                    if r.refill_task is None and now - r.last_demand > self.idle_timeout]:
+            del self._reservoirs[key]
+
+    def _schedule_refill(self, key: str, reservoir: _Reservoir):
+        if reservoir.refill_task is not None and not reservoir.refill_task.done():
+            reservoir.wakeup.set()
+            return
+        if reservoir.demands < self.REUSE_THRESHOLD or self._refilling >= self.MAX_REFILLS:
+            return
+        self._refilling += 1
+        reservoir.refill_task = asyncio.create_task(self._refill(key, reservoir))
+        # 用完成回调计数：任务在开始执行前被取消时协程内的 finally 不会执行
+        reservoir.refill_task.add_done_callback(self._refill_done)
+
+    def _refill_done(self, task):
+        self._refilling -= 1
+
+    async def _refill(self, key: str, reservoir: _Reservoir):
+        """补充到目标数量；连续失败或出口长期无查询时停止"""
+        failures = 0
+        try:
+            while self._reservoirs.get(key) is reservoir:
+                if time.monotonic() - reservoir.last_demand > self.idle_timeout:
+                    break
+                if self._fresh(reservoir) >= self.size:
+                    # 已满，等到有签名被取走或最早的签名接近过期再补
+                    wait = reservoir.signs[0][0] - self.margin - time.time()
+                    reservoir.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(reservoir.wakeup.wait(), timeout=max(1.0, wait))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                success, p_uuid, token, sign, base_header = await self.solve(reservoir.proxy, reservoir.local_ipv6)
+                if not success:
+                    self.failures += 1
+                    failures += 1
+                    if failures >= 3:
+                        logger.info(f"签名储备补充连续失败，暂停补充：{key}，原因：{p_uuid}")
+                        break
+                    await asyncio.sleep(failures)
+                    continue
+
+                failures = 0
+                self.solved += 1
+                expire = _sign_expire(sign, time.time() + self.ttl)
+                reservoir.signs.append((expire, p_uuid, token, sign, base_header))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"签名储备补充异常：{key}，{e}")
+        finally:
+            reservoir.refill_task = None
+            if (self._reservoirs.get(key) is reservoir and not reservoir.signs
+                    and time.monotonic() - reservoir.last_demand > self.idle_timeout):
+                del self._reservoirs[key]
+
+    def discard(self, key: str):
+        """丢弃指定出口的全部签名（如出口被拦截）"""
+        reservoir = self._reservoirs.pop(key, None)
+        if reservoir is not None and reservoir.refill_task is not None:
+            reservoir.refill_task.cancel()
+
+    async def close(self):
+        """取消所有补充任务"""
+        tasks = [r.refill_task for r in self._reservoirs.values() if r.refill_task is not None]
+        self._reservoirs.clear()
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """储备统计"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "egresses": len(self._reservoirs),
+            "refilling": self._refilling,
+            "ready": sum(len(r.signs) for r in self._reservoirs.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "solved": self.solved,
+            "failures": self.failures,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Server-Sent Events 推送模块
+推送接口均按客户端各自的游标从共享数据（日志环形缓冲、结果文件）中拉取，
+不为每个客户端排队缓存；写入时等待发送缓冲区排空，长时间写不出去的慢客户端会被断开
+"""
+import asyncio
+import json
+import weakref
+from aiohttp import web
+from middlewares import CORS_HEADERS
+
+
+# 无新事件时发送心跳注释的间隔（秒），用于保持连接与及时发现断开
+HEARTBEAT_INTERVAL = 15
+# 单次写入等待客户端接收的最长时间（秒）
+WRITE_TIMEOUT = 30
+
+_streams = weakref.WeakSet()
+
+
+async def open_stream(request):
+    """开始 SSE 响应，并登记当前处理协程以便服务关闭时结束推送"""
+    resp = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream; charset=utf-8",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        **CORS_HEADERS,
+    })
+    await resp.prepare(request)
+    register_stream()
+    return resp
+
+
+def register_stream():
+    """登记当前处理协程为长连接推送，服务关闭时由 close_streams 结束"""
+    task = asyncio.current_task()
+    if task is not None:
+        _streams.add(task)
+
+
+async def send_event(resp, data, event=None, event_id=None):
+    """发送一个事件；客户端超过 WRITE_TIMEOUT 秒未接收时抛出 asyncio.TimeoutError"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    await asyncio.wait_for(resp.write(("\n".join(lines) + "\n\n").encode("utf-8")), WRITE_TIMEOUT)
+
+
+async def send_heartbeat(resp):
+    """发送心跳注释"""
+    await asyncio.wait_for(resp.write(b": ping\n\n"), WRITE_TIMEOUT)
+
+
+def last_event_id(request):
+    """读取续传位置：断线重连时浏览器自动携带 Last-Event-ID，首次连接可用 since 参数指定"""
+    value = request.headers.get("Last-Event-ID") or request.query.get("since")
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+async def wait_event(event, timeout=HEARTBEAT_INTERVAL):
+    """等待事件被置位，超时返回 False（调用方发送心跳）"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def close_streams(app):
+    """结束所有推送连接（用于app关闭时），避免长连接拖延退出"""
+    for task in list(_streams):
+        task.cancel()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Token 管理模块
+按出口缓存 /api/auth 返回的 token，合并并发刷新请求，并在过期前后台续期；
+启用跨进程共享（broker）时申请到的 token 写入共享库，其他进程同一出口直接复用
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+from mlog import logger
+from load_config import config
+from egress_broker import get_broker
+
+
+# fetch 协程返回 (是否成功, token 或错误信息, 过期时间戳毫秒)
+TokenFetcher = Callable[[], Awaitable[Tuple[bool, str, int]]]
+
+
+class _TokenEntry:
+    """单个出口的 token 状态"""
+
+    __slots__ = ("token", "expire", "inflight")
+
+    def __init__(self):
+        self.token = ""
+        self.expire = 0  # 毫秒时间戳
+        self.inflight: Optional[asyncio.Future] = None
+
+
+class TokenManager:
+    """按出口隔离的 token 缓存，单飞刷新 + 提前续期"""
+
+    def __init__(self, refresh_ahead: Optional[float] = None, max_entries: int = 1024):
+        # 剩余有效期低于该秒数时触发后台续期
+        self.refresh_ahead = float(
+            refresh_ahead if refresh_ahead is not None
+            else (getattr(config.system, "token_refresh_ahead", None) or 30)
+        )
+        self.max_entries = max_entries
+        self._entries = {}  # {egress_key: _TokenEntry}
+        self._background = set()
+        self._broker = get_broker()
+        self.shared_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    @staticmethod
+    def _now_ms():
+        return int(time.time() * 1000)
+
+    def _prune(self, now):
+        """出口数量过多时清理已过期且空闲的条目"""
+        if len(self._entries) <= self.max_entries:
+            return
+        for key, entry in list(self._entries.items()):
+            if entry.inflight is None and entry.expire <= now:
+                del self._entries[key]
+
+    async def _refresh(self, entry: _TokenEntry, fetch: TokenFetcher, key: Optional[str] = None):
+        """执行一次刷新，结果通过 entry.inflight 共享给所有等待者"""
+        future = asyncio.get_running_loop().create_future()
+        entry.inflight = future
+        self.refreshes += 1
+        try:
+            success, token, expire = await fetch()
+        except asyncio.CancelledError:
+            future.set_result((False, "token 刷新已取消"))
+            raise
+        except Exception as e:
+            success, token, expire = False, str(e), 0
+        finally:
+            entry.inflight = None
+
+        if success:
+            entry.token = token
+            entry.expire = expire
+            if self._broker is not None and key is not None:
+                self._broker.post(self._broker.put_token, key, token, expire)
+        else:
+            self.failures += 1
+        future.set_result((success, token))
+        return success, token
+
+    def _schedule_refresh(self, key: str, entry: _TokenEntry, fetch: TokenFetcher):
+        """后台提前续期，同一出口同时只有一个续期任务"""
+        if entry.inflight is not None:
+            return
+        task = asyncio.create_task(self._refresh(entry, fetch, key))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        logger.debug(f"token 即将过期，后台续期：{key}")
+
+    async def get(self, key: str, fetch: TokenFetcher) -> Tuple[bool, str]:
+        """获取指定出口的 token，必要时刷新；返回 (是否成功, token 或错误信息)"""
+        now = self._now_ms()
+        entry = self._entries.get(key)
+        if entry is None:
+            self._prune(now)
+            entry = self._entries[key] = _TokenEntry()
+
+        if entry.expire <= now and entry.inflight is None and self._broker is not None:
+            # 本进程没有有效 token 时先复用其他进程为同一出口申请的
+            shared = await self._broker.run(self._broker.get_token, key)
+            if shared is not None and shared[1] > entry.expire:
+                entry.token, entry.expire = shared
+                self.shared_hits += 1
+
+        if entry.expire > now:
+            self.hits += 1
+            if entry.expire - now < self.refresh_ahead * 1000:
+                self._schedule_refresh(key, entry, fetch)
+            return True, entry.token
+
+        if entry.inflight is not None:
+            # 已有协程在刷新，直接等待其结果
+            self.coalesced += 1
+            return await asyncio.shield(entry.inflight)
+
+        self.misses += 1
+        return await self._refresh(entry, fetch, key)
+
+    def invalidate(self, key: str):
+        """作废指定出口的 token（如该出口被拦截）"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.token = ""
+            entry.expire = 0
+        if self._broker is not None:
+            self._broker.post(self._broker.invalidate_token, key)
+
+    async def close(self):
+        """取消后台续期任务"""
+        for task in list(self._background):
+            task.cancel()
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """命中统计"""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
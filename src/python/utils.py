@@ -5,11 +5,15 @@
 """
 import re
 import sys
+import ipaddress
 import os
 import subprocess
 import locale
+import random
 import uuid
+from typing import Iterable, Optional
 from mlog import logger
+import netlink
 
 
 def is_valid_url(url):
@@ -26,6 +30,50 @@ def is_valid_url(url):
     return re.match(regex, url) is not None
 
 
+class AddressSet:
+    """地址集合：列表 + 位置索引，增删与随机抽取均为 O(1)，用于 IPv6 地址池、代理池等按出口随机选择"""
+
+    __slots__ = ("_items", "_index")
+
+    def __init__(self, addresses: Iterable[str] = ()):
+        self._items = []
+        self._index = {}
+        for address in addresses:
+            self.add(address)
+
+    def add(self, address: str):
+        if address not in self._index:
+            self._index[address] = len(self._items)
+            self._items.append(address)
+
+    def discard(self, address: str):
+        """删除地址：用末尾元素填补空位"""
+        position = self._index.pop(address, None)
+        if position is None:
+            return
+        last = self._items.pop()
+        if position < len(self._items):
+            self._items[position] = last
+            self._index[last] = position
+
+    def clear(self):
+        self._items.clear()
+        self._index.clear()
+
+    def sample(self) -> Optional[str]:
+        """随机取一个地址，集合为空时返回 None"""
+        return random.choice(self._items) if self._items else None
+
+    def __contains__(self, address):
+        return address in self._index
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+
 def get_project_root():
     """获取项目根目录（开发时为仓库根；打包后为可执行文件目录）"""
     if getattr(sys, 'frozen', False):  # 打包后的程序
@@ -48,6 +96,28 @@ def is_public_ipv6(ipv6):
     return not (ipv6.startswith("fe80") or ipv6.startswith("fc00") or ipv6.startswith("fd00"))
 
 
+_netlink_available = None
+
+
+def _use_netlink():
+    """Linux 下优先通过 rtnetlink 管理 IPv6 地址，不可用时回退到 ip 命令"""
+    global _netlink_available
+    if _netlink_available is None:
+        _netlink_available = os.name != 'nt' and netlink.available()
+    return _netlink_available
+
+
+def ipv6_backend():
+    """当前使用的 IPv6 地址管理方式：netlink 或 subprocess"""
+    return "netlink" if _use_netlink() else "subprocess"
+
+
+def _generate_ipv6(prefix):
+    """在 /64 前缀下生成随机接口标识的地址（压缩格式，与系统列出的地址一致）"""
+    guid = uuid.uuid4().hex
+    return ipaddress.IPv6Address(f"{prefix}:{guid[:4]}:{guid[4:8]}:{guid[8:12]}:{guid[12:16]}").compressed
+
+
 def _run_cmd_capture(cmd):
     """执行系统命令并自动多编码尝试解码"""
     try:
@@ -79,6 +149,14 @@ def check_has_permanent_ipv6():
     检查系统中是否存在永久有效的IPv6地址（valid_lft forever）
     返回: (has_permanent, sample_address)
     """
+    if _use_netlink():
+        try:
+            for item in netlink.list_global_ipv6():
+                if item["valid_lft"] == netlink.INFINITY_LIFE_TIME and is_public_ipv6(item["address"]):
+                    return (True, item["address"])
+            return (False, None)
+        except OSError as e:
+            logger.debug(f"通过 netlink 检测永久IPv6地址失败，改用 ip 命令: {e}")
     try:
         if os.name == 'nt':
             # Windows下检查 SkipAsSource=False 的地址（永久地址通常是这样配置的）
@@ -161,6 +239,13 @@ def get_network_interfaces():
 
 def get_local_ipv6_addresses():
     """获取本地IPv6地址"""
+    if _use_netlink():
+        try:
+            return list(dict.fromkeys(
+                item["address"] for item in netlink.list_global_ipv6() if is_public_ipv6(item["address"])
+            ))
+        except OSError as e:
+            logger.debug(f"通过 netlink 获取IPv6地址失败，改用 ip 命令: {e}")
     addresses = []
     try:
         if os.name == 'nt':
@@ -193,20 +278,28 @@ def get_local_ipv6_addresses():
 
 
 def configure_ipv6_addresses(prefix, count, adapter_name):
-    """配置指定数量的IPv6地址"""
-    if os.name == 'nt':  # Windows
-        for _ in range(count):
-            guid = uuid.uuid4().hex
-            new_temp_ipv6 = f"{prefix}:{guid[:4]}:{guid[4:8]}:{guid[8:12]}:{guid[12:16]}"
-            subprocess.run([
+    """
+    配置指定数量的IPv6地址，返回添加成功的地址列表
+    Linux 下通过 rtnetlink 一次性批量添加（跳过重复地址检测，添加后立即可用），失败时回退到逐个执行命令
+    """
+    new_addresses = [_generate_ipv6(prefix) for _ in range(count)]
+    if _use_netlink():
+        try:
+            with netlink.RtNetlink() as nl:
+                return nl.add_ipv6_addresses(new_addresses, adapter_name)
+        except OSError as e:
+            logger.warning(f"通过 netlink 添加IPv6地址失败，改用 ip 命令: {e}")
+
+    added = []
+    for new_temp_ipv6 in new_addresses:
+        if os.name == 'nt':  # Windows
+            cmd = [
                 "netsh", "interface", "ipv6", "add", "address", adapter_name, new_temp_ipv6,
                 "store=active", "skipassource=true"
-            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    else:  # Linux
-        for _ in range(count):
-            guid = uuid.uuid4().hex
-            new_temp_ipv6 = f"{prefix}:{guid[:4]}:{guid[4:8]}:{guid[8:12]}:{guid[12:16]}"
-            subprocess.run([
-                "ip", "-6", "addr", "add", new_temp_ipv6, "dev", adapter_name
-            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
+            ]
+        else:  # Linux
+            cmd = ["ip", "-6", "addr", "add", new_temp_ipv6, "dev", adapter_name]
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode == 0:
+            added.append(new_temp_ipv6)
+    return added
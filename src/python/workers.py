@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+多进程服务模块
+--workers N 时主进程启动 N 个 worker 进程，各自创建应用并以 SO_REUSEPORT 监听同一端口，由内核分配连接；
+0 号为主 worker，独占批量任务、IPv6 地址增删与 MCP HTTP 等只能有一份的工作，
+其余 worker 收到的批量任务与实时日志请求经本机 Unix 套接字原样转发给主 worker；
+其余 worker 产生的日志同样经该套接字汇总到主 worker 的日志收集器
+"""
+import asyncio
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import aiohttp
+from aiohttp import web
+from mlog import logger
+from middlewares import wj
+from sse import register_stream
+from log_collector import log_collector
+
+
+# 由主 worker 处理的接口：批量任务（任务状态只存在于主 worker 内存中）与实时日志（各 worker 的日志汇总在主 worker）
+OWNER_PATHS = frozenset((
+    "/create/task", "/delete/task", "/query/task", "/query/task/stream",
+    "/logs/realtime", "/logs/stream", "/logs/clear",
+))
+# 其他 worker 向主 worker 提交日志的内部接口，只接受经内部 Unix 套接字的请求
+LOG_INGEST_PATH = "/internal/logs"
+# 单次提交的日志条数上限
+LOG_BATCH = 500
+
+# 转发时不透传的逐跳头部；响应体已由客户端解压，也不透传压缩与长度头部
+_HOP_HEADERS = frozenset((
+    "connection", "keep-alive", "transfer-encoding", "upgrade", "te", "trailer",
+    "proxy-authorization", "proxy-authenticate", "host", "content-length", "content-encoding",
+))
+
+# worker 退出后重新拉起的最短间隔（秒），避免启动即崩溃时空转
+RESPAWN_INTERVAL = 1.0
+# 停止时等待 worker 完成收尾的时间（秒），超时后强制结束
+SHUTDOWN_TIMEOUT = 30
+
+# 内部套接字所在的私有目录，由主进程在启动 worker 前创建，fork 出的 worker 继承
+_runtime_dir = None
+
+
+def supported() -> bool:
+    """当前平台能否以多 worker 运行（需要 fork 与 SO_REUSEPORT）"""
+    return hasattr(socket, "SO_REUSEPORT") and hasattr(os, "fork")
+
+
+def _make_runtime_dir() -> str:
+    """
+    创建仅当前用户可访问（0700）且名称随机的目录存放内部套接字，优先放在 $XDG_RUNTIME_DIR 下；
+    避免其他本地用户抢先占用固定路径或直接连接套接字调用批量任务接口
+    """
+    parent = os.environ.get("XDG_RUNTIME_DIR")
+    if not parent or not os.path.isdir(parent):
+        parent = None
+    return tempfile.mkdtemp(prefix="icp_query_", dir=parent)
+
+
+def owner_socket_path(port) -> str:
+    """主 worker 的内部 Unix 套接字路径"""
+    return os.path.join(_runtime_dir, f"owner_{port}.sock")
+
+
+@web.middleware
+async def owner_middleware(request, handler):
+    """非主 worker 把批量任务与实时日志请求转发给主 worker"""
+    if request.app.get("primary_worker", True) or request.path not in OWNER_PATHS:
+        return await handler(request)
+    return await _forward(request)
+
+
+async def _forward(request):
+    session = request.app["owner_session"]
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS}
+    body = await request.read()
+    resp = None
+    try:
+        async with session.request(request.method, f"http://owner{request.path_qs}",
+                                   headers=headers, data=body or None) as upstream:
+            resp = web.StreamResponse(status=upstream.status, headers={
+                k: v for k, v in upstream.headers.items() if k.lower() not in _HOP_HEADERS
+            })
+            await resp.prepare(request)
+            if upstream.headers.get("Content-Type", "").startswith("text/event-stream"):
+                # 转发中的推送连接同样在服务关闭时结束
+                register_stream()
+            async for chunk in upstream.content.iter_any():
+                await resp.write(chunk)
+            await resp.write_eof()
+            return resp
+    except (aiohttp.ClientConnectionError, FileNotFoundError) as e:
+        if resp is not None and resp.prepared:
+            # 响应已开始发送，无法再改为错误响应：断开连接，让客户端知道响应不完整
+            logger.warning(f"转发中的响应中断：{e}")
+            if request.transport is not None:
+                request.transport.close()
+            return resp
+        logger.error(f"转发请求到主 worker 失败：{e}")
+        return wj({"code": 503, "message": "主 worker 暂不可用，请稍后重试"})
+
+
+async def _open_owner_session(app):
+    app["owner_session"] = aiohttp.ClientSession(
+        connector=aiohttp.UnixConnector(path=app["owner_socket"]),
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=5),
+    )
+
+
+async def _close_owner_session(app):
+    await app["owner_session"].close()
+
+
+def _via_owner_socket(request) -> bool:
+    """请求是否经内部 Unix 套接字到达（只有本机的其他 worker 能连接）"""
+    sock = request.transport.get_extra_info("socket") if request.transport is not None else None
+    return sock is not None and sock.family == socket.AF_UNIX
+
+
+@web.middleware
+async def ingest_middleware(request, handler):
+    """
+    主 worker 在鉴权之前处理其他 worker 提交的日志；
+    内部接口不注册为路由，经 TCP 端口访问时与不存在的路径一样返回 404
+    """
+    if request.path == LOG_INGEST_PATH and request.method == "POST" and _via_owner_socket(request):
+        return await _ingest_logs(request)
+    return await handler(request)
+
+
+async def _ingest_logs(request):
+    """主 worker 接收其他 worker 提交的日志，写入本进程的日志收集器"""
+    data = await request.json()
+    prefix = f"[worker {data.get('worker')}] "
+    for entry in data.get("logs", []):
+        log_collector.add_log(prefix + str(entry.get("message", "")), entry.get("level", "INFO"))
+    return web.Response(status=204)
+
+
+async def _forward_logs(app):
+    """把本 worker 的新日志分批提交给主 worker；主 worker 暂不可用时稍后重试，不丢弃未提交的日志"""
+    session = app["owner_session"]
+    since = 0
+    event = log_collector.subscribe()
+    try:
+        while True:
+            event.clear()
+            logs, _ = log_collector.get_logs_since(since, LOG_BATCH)
+            if not logs:
+                await event.wait()
+                continue
+            try:
+                async with session.post(f"http://owner{LOG_INGEST_PATH}",
+                                        json={"worker": app["worker_index"], "logs": logs}) as resp:
+                    resp.raise_for_status()
+                since = logs[-1]["id"]
+            except (aiohttp.ClientError, OSError):
+                # 不写日志，避免提交失败的日志再次触发提交
+                await asyncio.sleep(1)
+    finally:
+        log_collector.unsubscribe(event)
+
+
+async def _start_log_forwarder(app):
+    app["log_forwarder"] = asyncio.create_task(_forward_logs(app))
+
+
+async def _stop_log_forwarder(app):
+    task = app.get("log_forwarder")
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def setup_worker(app, index: int, port):
+    """为 worker 进程的应用登记身份；非主 worker 启用转发"""
+    app["worker_index"] = index
+    app["primary_worker"] = index == 0
+    app["owner_socket"] = owner_socket_path(port)
+    if index == 0:
+        app.middlewares.insert(0, ingest_middleware)
+    else:
+        app.middlewares.insert(0, owner_middleware)
+        app.on_startup.append(_open_owner_session)
+        app.on_startup.append(_start_log_forwarder)
+        # 先停止日志提交，再关闭连接主 worker 的 session
+        app.on_shutdown.append(_stop_log_forwarder)
+        app.on_cleanup.append(_close_owner_session)
+
+
+def _worker_main(index, app_factory, host, port):
+    """worker 进程入口：恢复默认信号处理后创建应用，由 run_app 处理 SIGINT / SIGTERM 并完成收尾"""
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    app = app_factory(index)
+    logger.info(f"worker {index}（pid {os.getpid()}）启动{'，负责批量任务' if index == 0 else ''}")
+    web.run_app(
+        app, host=host, port=port, reuse_port=True,
+        # 主 worker 额外监听内部 Unix 套接字，接收其他 worker 转发的请求
+        path=app["owner_socket"] if index == 0 else None,
+        print=None,
+    )
+
+
+def serve(count: int, app_factory, host, port):
+    """
+    启动 count 个 worker 并守护：意外退出的 worker 会被重新拉起；
+    收到 SIGINT / SIGTERM 时通知所有 worker 退出，超过 SHUTDOWN_TIMEOUT 仍未退出的强制结束
+    """
+    global _runtime_dir
+    _runtime_dir = _make_runtime_dir()
+    ctx = multiprocessing.get_context("fork")
+    workers = {}
+    started = {}
+    stopping = False
+
+    def start(index):
+        process = ctx.Process(target=_worker_main, args=(index, app_factory, host, port),
+                              name=f"icp-worker-{index}")
+        process.start()
+        workers[index] = process
+        started[index] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for index in range(count):
+        start(index)
+    logger.info(f"已启动 {count} 个 worker，监听 {host}:{port}")
+
+    while not stopping:
+        time.sleep(0.5)
+        for index, process in list(workers.items()):
+            if process.is_alive() or stopping:
+                continue
+            logger.error(f"worker {index}（pid {process.pid}）意外退出，退出码 {process.exitcode}，重新启动")
+            if time.monotonic() - started[index] < RESPAWN_INTERVAL:
+                time.sleep(RESPAWN_INTERVAL)
+            start(index)
+
+    logger.warning("收到关闭信号，正在停止所有 worker")
+    for process in workers.values():
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    for index, process in workers.items():
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            logger.warning(f"worker {index} 未能按时退出，强制结束")
+            process.kill()
+            process.join()
+    shutil.rmtree(_runtime_dir, ignore_errors=True)
+    logger.info("所有 worker 已退出")
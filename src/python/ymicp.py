@@ -6,95 +6,29 @@ import hashlib
 import re
 import base64
 import os
-import io
-import numpy as np
-from PIL import Image
 import ujson
 import random
 import uuid
-from aiohttp import TCPConnector
 from mlog import logger
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
 import ssl
-import subprocess
-import locale
 from contextlib import asynccontextmanager
 from load_config import config
 from cachetools import TTLCache
+from session_pool import SessionPool, egress_key
+from rate_limiter import get_rate_limiter
+from egress_health import get_egress_health
+from ipv6_pool import AddressSet, get_ipv6_pool, select_address
+from utils import get_local_ipv6_addresses
+from token_cache import TokenManager
+from sign_reservoir import SignReservoir
+from captcha_solver import match_slider_offset, get_captcha_solver
+from detail_cache import get_detail_cache
 
 ssl._create_default_https_context = ssl._create_unverified_context()
 
 
-def is_public_ipv6(ipv6):
-    return not (ipv6.startswith("fe80") or ipv6.startswith("fc00") or ipv6.startswith("fd00"))
-
-
-# 获取本地 IPv6 地址
-def _run_cmd_capture(cmd):
-    """执行系统命令并自动多编码尝试解码，失败返回空字符串"""
-    try:
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate(timeout=5)
-    except Exception:
-        return ""
-    if not out:
-        return ""
-    enc_candidates = [
-        "utf-8",
-        locale.getpreferredencoding(False) or "",
-        "gbk",
-        "cp936",
-        "latin-1",
-    ]
-    for enc in enc_candidates:
-        if not enc:
-            continue
-        try:
-            return out.decode(enc)
-        except Exception:
-            continue
-    return out.decode("utf-8", errors="ignore")
-
-
-def get_local_ipv6_addresses():
-    """跨平台获取本机公网 IPv6 地址，自动处理编码/异常"""
-    addresses = []
-    try:
-        if os.name == 'nt':  # Windows
-            output = _run_cmd_capture(["netsh", "interface", "ipv6", "show", "addresses"])
-            if not output:
-                return []
-            for line in output.splitlines():
-                line_strip = line.strip()
-                # 兼容中文 (公用/手动) 及可能的英文 (Public/Manual)
-                if any(k in line_strip for k in ("公用", "手动", "Public", "Manual")) and ":" in line_strip:
-                    parts = line_strip.split()
-                    candidate = parts[-1]
-                    candidate = candidate.strip()
-                    # 去除可能的/前缀长度
-                    candidate = candidate.split("/")[0]
-                    if ":" in candidate and is_public_ipv6(candidate):
-                        addresses.append(candidate)
-        else:  # Linux / mac
-            output = _run_cmd_capture(["ip", "-6", "addr", "show"])
-            if not output:
-                return []
-            for line in output.splitlines():
-                line_strip = line.strip()
-                if ("inet6" in line_strip) and ("scope global" in line_strip):
-                    try:
-                        candidate = line_strip.split()[1].split("/")[0]
-                        if is_public_ipv6(candidate):
-                            addresses.append(candidate)
-                    except Exception:
-                        continue
-    except Exception:
-        return []
-    # 去重
-    return list(dict.fromkeys(addresses))
-
-
 class beian:
     def __init__(self):
         self.typj = {
@@ -136,11 +70,14 @@ class beian:
         # APP/小程序/快应用详情查询接口
         self.queryDetailByAppAndMiniId = "https://hlwicpfwc.miit.gov.cn/icpproject_query/api/icpAbbreviateInfo/queryDetailByAppAndMiniId"
         self.sign = "eyJ0eXBlIjozLCJleHREYXRhIjp7InZhZnljb2RlX2ltYWdlX2tleSI6IjUyZWI1ZTcyODViNzRmNWJhM2YwYzBkNTg0YTg3NmVmIn0sImUiOjE3NTY5NzAyNDg4MjN9.Ngpkwn4T7sQoQF9pCk_sQQpH61wQUEKnK2sQ8hDIq-Q"
-        self.token = ""
-        self.token_expire = 0
         self.timeout = aiohttp.ClientTimeout(total=getattr(getattr(config, 'system', object()), 'http_client_timeout', 30))
-        self.local_ipv6_addresses = get_local_ipv6_addresses() if getattr(getattr(getattr(config, 'proxy', object()), 'local_ipv6_pool', object()), 'enable', False) else []
-        self.ipv6_index = 0
+        # 未启动 IPv6 地址池（如 MCP 进程）时使用本机现有的公网 IPv6 地址
+        self.local_ipv6_addresses = AddressSet(get_local_ipv6_addresses() if getattr(getattr(getattr(config, 'proxy', object()), 'local_ipv6_pool', object()), 'enable', False) else [])
+
+        # 详情并发数（上限 20）与单条详情超时
+        system_config = getattr(config, 'system', object())
+        self.detail_concurrency = min(int(getattr(system_config, 'detail_concurrency', None) or 5), 20)
+        self.detail_timeout = float(getattr(system_config, 'detail_timeout', None) or 10)
 
         # Bug 1 & 9 修复：使用 asyncio.Lock 替代 threading.Lock
         self._ipv6_lock = asyncio.Lock()  # IPv6 轮询锁
@@ -157,13 +94,29 @@ class beian:
             'enable_cleanup_closed': True  # Bug 3 修复：启用关闭连接的清理
         }
 
+        # 按出口（直连 / 本地 IPv6 / 代理）复用的上游会话池
+        # 每个本地 IPv6 各占一个会话，启用地址池时会话池至少能容纳整个地址池，避免轮换时反复重建连接
+        ipv6_pool_config = getattr(getattr(config, 'proxy', object()), 'local_ipv6_pool', object())
+        session_pool_size = None
+        if getattr(ipv6_pool_config, 'enable', False):
+            session_pool_size = max(int(getattr(system_config, 'session_pool_size', None) or 64),
+                                    int(getattr(ipv6_pool_config, 'pool_num', None) or 0) + 1)
+        self._session_pool = SessionPool(self.connector_config, self.timeout, session_pool_size)
+        # 按出口隔离的 token 缓存
+        self._tokens = TokenManager()
+        # 按出口预先打码的签名储备
+        self._signs = SignReservoir(self.check_img)
+        # 按 (serviceType, dataId) 缓存的详情（进程内共享）
+        self._details = get_detail_cache()
+        # 按出口限速（进程内共享）
+        self._rate_limiter = get_rate_limiter()
+        # 出口健康评分（进程内共享），用于加权选择出口与自动隔离
+        self._health = get_egress_health()
+
         self._blocked_ip_cache = TTLCache(maxsize=1000, ttl=300)
         # Bug 1 & 5 修复：使用 asyncio.Lock 替代 threading.Lock
         self._blocked_ip_lock = asyncio.Lock()
 
-        # 用于跟踪当前正在使用的 IPv6 地址（用于被拦截时的索引计算）
-        self._last_used_ipv6_index = -1
-
     # Bug 5 修复：异步黑名单操作方法
     async def _add_blocked_ip(self, ip):
         """异步添加 IP 到黑名单缓存"""
@@ -180,82 +133,89 @@ class beian:
         async with self._blocked_ip_lock:
             return ip in self._blocked_ip_cache
 
-    # Bug 2 & 9 修复：异步 IPv6 轮询，修复索引越界和原子性问题
+    def _ipv6_addresses(self):
+        """本地 IPv6 出口集合：IPv6 地址池已启动时直接使用其活跃地址（增删实时生效），否则使用本机现有地址"""
+        pool = get_ipv6_pool()
+        if pool is not None:
+            return pool.addresses
+        return self.local_ipv6_addresses
+
     async def _get_next_ipv6(self):
-        """异步 IPv6 轮询，跳过被拦截的 IP"""
-        if not self.local_ipv6_addresses:
+        """选择本地 IPv6 出口：跳过被拦截的 IP，按健康评分与限速令牌加权选择"""
+        addresses = self._ipv6_addresses()
+        if not addresses:
             return None
 
         async with self._ipv6_lock:
-            # Bug 2 修复：检查地址列表长度变化
-            if not self.local_ipv6_addresses:
-                return None
-
-            # Bug 2 修复：确保索引在有效范围内
-            if self.ipv6_index >= len(self.local_ipv6_addresses):
-                self.ipv6_index = 0
-
-            attempts = 0
-            max_attempts = len(self.local_ipv6_addresses) * 2  # 最多尝试两轮
-
-            while attempts < max_attempts:
-                # Bug 2 修复：使用模运算防止越界
-                current_ipv6 = self.local_ipv6_addresses[self.ipv6_index]
-                self.ipv6_index = (self.ipv6_index + 1) % len(self.local_ipv6_addresses)
-                attempts += 1
-
-                # Bug 9 修复：在锁内检查黑名单，确保原子性
-                if not (current_ipv6 in self._blocked_ip_cache):
-                    self._last_used_ipv6_index = (self.ipv6_index - 1) % len(self.local_ipv6_addresses)
-                    return current_ipv6
-                else:
-                    logger.debug(f"跳过被拦截的 IPv6 地址：{current_ipv6}")
-
-            logger.warning("所有 IPv6 地址都被拦截，暂无可用地址")
+            # Bug 9 修复：在锁内检查黑名单，确保原子性
+            local_ipv6 = select_address(addresses, self._blocked_ip_cache.__contains__)
+            if local_ipv6 is None:
+                logger.warning("所有 IPv6 地址都被拦截，暂无可用地址")
+            return local_ipv6
+
+    async def _pick_local_ipv6(self, proxy=""):
+        """为一次查询选定本地 IPv6 出口，同一查询的所有请求固定使用该出口（使用代理时不绑定）"""
+        if proxy or not self._ipv6_addresses():
             return None
+        local_ipv6 = await self._get_next_ipv6()
+        if local_ipv6:
+            logger.info(f"使用本地 IPv6 地址：{local_ipv6}")
+        return local_ipv6
 
-    async def _get_connector(self, local_ipv6=None):
+    async def _on_blocked(self, proxy="", local_ipv6=None):
+        """出口被创宇盾拦截：拉黑本地 IPv6 并作废该出口的 token"""
         if local_ipv6:
-            connector = TCPConnector(
-                local_addr=(local_ipv6, 0),
-                **self.connector_config
-            )
+            await self._add_blocked_ip(local_ipv6)
+        key = egress_key(proxy, local_ipv6)
+        self._health.record_block(key)
+        self._tokens.invalidate(key)
+        self._signs.discard(key)
+
+    async def _throttle(self, proxy="", local_ipv6=None):
+        """按出口取限速令牌（隧道代理每次请求更换出口 IP，不限速）"""
+        if proxy and proxy == getattr(getattr(getattr(config, 'proxy', object()), 'tunnel', object()), 'url', None):
+            return
+        await self._rate_limiter.acquire(egress_key(proxy, local_ipv6))
+
+    @asynccontextmanager
+    async def get_session(self, proxy="", local_ipv6=None, throttle=True):
+        # 每次上游请求前按出口限速；按出口复用长连接会话，离开上下文时只归还不关闭
+        if throttle:
+            await self._throttle(proxy, local_ipv6)
+        key = egress_key(proxy, local_ipv6)
+        started = time.monotonic()
+        try:
+            async with self._session_pool.session(key, local_ipv6) as session:
+                yield session
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._health.record(key, False)
+            raise
         else:
-            connector = TCPConnector(**self.connector_config)
+            self._health.record(key, True, time.monotonic() - started)
 
-        return connector
+    async def _fetch_token(self, base_header, proxy="", local_ipv6=None):
+        """向 /api/auth 申请新 token，返回 (是否成功, token 或错误信息, 过期时间戳毫秒)"""
+        timeStamp = round(time.time() * 1000)
+        authSecret = "testtest" + str(timeStamp)
+        authKey = hashlib.md5(authSecret.encode(encoding="UTF-8")).hexdigest()
+        auth_data = {"authKey": authKey, "timeStamp": timeStamp}
 
-    @asynccontextmanager
-    async def get_session(self, proxy=""):
-        local_ipv6 = None
-        if not proxy and self.local_ipv6_addresses:
-            local_ipv6 = await self._get_next_ipv6()
-            if local_ipv6:
-                logger.info(f"使用本地 IPv6 地址：{local_ipv6}")
-
-        # 为每个 session 创建独立的连接器
-        connector = await self._get_connector(local_ipv6)
-
-        session = aiohttp.ClientSession(
-            timeout=self.timeout,
-            connector=connector,
-            headers={'Connection': 'keep-alive'}
-        )
+        async with self.get_session(proxy, local_ipv6) as session:
+            async with session.post(self.url, data=auth_data, headers=base_header, proxy=proxy if proxy else None) as req:
+                req_text = await req.text()
 
-        try:
-            yield session
-        finally:
-            # Bug 8 修复：完善异常处理，确保 session 和 connector 都被正确关闭
-            try:
-                await session.close()
-            except Exception:
-                pass
-            try:
-                await connector.close()
-            except Exception:
-                pass
+        if "当前访问疑似黑客攻击" in req_text:
+            await self._on_blocked(proxy, local_ipv6)
+            return False, "当前访问已被创宇盾拦截", 0
+
+        t = ujson.loads(req_text)
+        token = t["params"]["bussiness"]
+        expire = int(time.time() * 1000) + t["params"]["expire"]
+        return True, token, expire
 
-    async def get_token(self, proxy=""):
+    async def get_token(self, proxy="", local_ipv6=None):
         base_header = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/101.0.4951.41 Safari/537.36 Edg/101.0.1210.32",
             "Origin": "https://beian.miit.gov.cn",
@@ -264,43 +224,15 @@ class beian:
             "Accept": "application/json, text/plain, */*",
         }
 
-        if self.token_expire > int(time.time() * 1000):
-            return True, self.token, base_header
-
-        timeStamp = round(time.time() * 1000)
-        authSecret = "testtest" + str(timeStamp)
-        authKey = hashlib.md5(authSecret.encode(encoding="UTF-8")).hexdigest()
-        auth_data = {"authKey": authKey, "timeStamp": timeStamp}
-
-        try:
-            async with self.get_session(proxy) as session:
-                current_ip = None
-                if hasattr(session, '_connector') and hasattr(session._connector, '_local_addr'):
-                    current_ip = session._connector._local_addr[0] if session._connector._local_addr else None
-                async with session.post(self.url, data=auth_data, headers=base_header, proxy=proxy if proxy else None) as req:
-                    req_text = await req.text()
-
-                    if "当前访问疑似黑客攻击" in req_text:
-                        if current_ip:
-                            await self._add_blocked_ip(current_ip)
-                        elif not proxy and self.local_ipv6_addresses:
-                            # Bug 9 修复：使用异步方式获取被拦截的 IPv6 索引
-                            if self._last_used_ipv6_index >= 0:
-                                blocked_ip = self.local_ipv6_addresses[self._last_used_ipv6_index]
-                                await self._add_blocked_ip(blocked_ip)
-                        return False, "当前访问已被创宇盾拦截", ""
-
-                    t = ujson.loads(req_text)
-                    token = t["params"]["bussiness"]
-                    expire = int(time.time() * 1000) + t["params"]["expire"]
-
-                    self.token = token
-                    self.token_expire = expire
-
-                    return True, token, base_header
-        except Exception as e:
-            logger.warning(f"get_token Faile : {e}")
-            return False, str(e), ""
+        # token 按出口缓存，并发刷新合并为一次请求
+        success, token = await self._tokens.get(
+            egress_key(proxy, local_ipv6),
+            lambda: self._fetch_token(dict(base_header), proxy, local_ipv6)
+        )
+        if not success:
+            logger.warning(f"get_token Faile : {token}")
+            return False, token, ""
+        return True, token, base_header
 
     async def get_cookie(self, proxy=""):
         async with await self.get_session(proxy) as session:
@@ -324,73 +256,11 @@ class beian:
         return ujson.dumps({"clientUid": point_id})
 
     def match_slider_offset(self, small_image_b64, big_image_b64):
-        """在大图上找与滑块同尺寸的纯色正方形缺口区域，返回其 x 偏移量（亚毫秒优化版）"""
-        small_bytes = base64.b64decode(small_image_b64)
-        big_bytes = base64.b64decode(big_image_b64)
-
-        # 小图只取尺寸，避免完整解码像素
-        with Image.open(io.BytesIO(small_bytes)) as sm:
-            sw, sh = sm.size
-
-        big_img = np.asarray(Image.open(io.BytesIO(big_bytes)).convert("RGB"))
-        # 下采样 + 量化一步完成
-        resized = big_img[::2, ::2]
-        h, w = resized.shape[:2]
-        min_side = max(1, int(min(sw, sh) * 0.25))
-        skip_left = sw // 4
-        good_enough = (min_side * min_side * 3) // 2
-
-        q = (resized.astype(np.int32) & ~3)
-        color_id = q[:, :, 0] + q[:, :, 1] * 256 + q[:, :, 2] * 65536
-
-        flat = color_id.ravel()
-        unique, counts = np.unique(flat, return_counts=True)
-        # 只检查 Top-3 高频色
-        top_indices = np.argpartition(counts, max(-3, -len(counts)))[-3:]
-
-        best_area = 0
-        best_x = 0
-        col_run = np.empty((h, w), dtype=np.int32)
-
-        for idx in top_indices:
-            c = unique[idx]
-            mask = color_id == c
-            col_run[0] = mask[0]
-            for y in range(1, h):
-                col_run[y] = (col_run[y - 1] + 1) * mask[y]
-
-            for y in range(min_side, h):
-                row = col_run[y]
-                x = skip_left
-                while x < w:
-                    if row[x] < min_side:
-                        x += 1
-                        continue
-                    s = x
-                    while x < w and row[x] >= min_side:
-                        x += 1
-                    run_w = x - s
-                    run_h = int(row[s])
-                    if run_h > 0:
-                        ratio = run_w / run_h
-                        area = run_w * run_h
-                        if 0.7 < ratio < 1.4 and area > best_area:
-                            best_area = area
-                            best_x = s
-                            if best_area >= good_enough:
-                                offset_x = best_x * 2
-                                logger.info(f"缺口定位：x={offset_x}, 滑块={sw}x{sh}")
-                                return True, offset_x
-
-        if best_area == 0:
-            return False, "未找到缺口"
-
-        offset_x = best_x * 2
-        logger.info(f"缺口定位：x={offset_x}, 滑块={sw}x{sh}")
-        return True, offset_x
-
-    async def check_img(self, proxy=""):
-        success, token, base_header = await self.get_token(proxy)
+        """在大图上找与滑块同尺寸的纯色正方形缺口区域，返回其 x 偏移量"""
+        return match_slider_offset(small_image_b64, big_image_b64)
+
+    async def check_img(self, proxy="", local_ipv6=None):
+        success, token, base_header = await self.get_token(proxy, local_ipv6)
         if not success:
             logger.info(f"获取 token 失败：{token}")
             return False, token, '', '', ''
@@ -400,21 +270,23 @@ class beian:
             base_header.update({"Content-Length": length, "token": token})
             base_header["Content-Type"] = "application/json"
             try:
-                async with self.get_session(proxy) as session:
+                async with self.get_session(proxy, local_ipv6) as session:
                     async with session.post(self.getCheckImage, data=data, headers=base_header, proxy=proxy if proxy else None) as req:
                         res = await req.json()
             except Exception as e:
-                logger.info(f"请求验证码时失败：{e}")
-                return False, f"请求验证码时失败：{e}", '', '', ''
+                logger.info(f"请求验证码时失败：{e or type(e).__name__}")
+                return False, f"请求验证码时失败：{e or type(e).__name__}", '', '', ''
 
             p_uuid = res["params"]["uuid"]
             big_image = res["params"]["bigImage"]
             small_image = res["params"]["smallImage"]
 
             start = time.time()
-            match_success, offset_x = self.match_slider_offset(small_image, big_image)
+            # 缺口定位放到执行器中，避免阻塞事件循环
+            match_success, offset_x = await get_captcha_solver().solve(small_image, big_image)
             if not match_success:
                 logger.info(f"滑块匹配失败：{offset_x}")
+                self._health.record_captcha(egress_key(proxy, local_ipv6), False)
                 return False, "滑块匹配失败", '', '', ''
             logger.info(f"滑块匹配用时 {(time.time() - start) * 1000:.3f}ms")
 
@@ -422,12 +294,13 @@ class beian:
             logger.info(f"checkImage 请求体：{check_data}")
             length = str(len(check_data.encode("utf-8")))
             base_header.update({"Content-Length": length})
-            async with self.get_session(proxy) as session:
+            async with self.get_session(proxy, local_ipv6) as session:
                 async with session.post(self.checkImage, data=check_data, headers=base_header, proxy=proxy if proxy else None) as req:
                     res = await req.text()
 
             data = ujson.loads(res)
             logger.info(f"checkImage 响应：code={data.get('code')}, msg={data.get('msg')}, success={data.get('success')}")
+            self._health.record_captcha(egress_key(proxy, local_ipv6), data.get("success", False))
             if not data.get("success", False):
                 captcha_config = getattr(config, 'captcha', object())
                 if getattr(captcha_config, 'save_failed_img', False):
@@ -449,8 +322,17 @@ class beian:
             logger.warning(f"check_image Faile : {e}")
             return False, str(e), '', '', ''
 
-    async def getAppAndMiniDetail(self, dataId, serviceType, p_uuid, token, sign, base_header, proxy=""):
-        """优化的详情获取，移除会话复用"""
+    async def _get_sign(self, proxy="", local_ipv6=None):
+        """获取 (uuid, token, sign, base_header)：优先取签名储备，储备为空时现场打码"""
+        item = self._signs.take(egress_key(proxy, local_ipv6), proxy, local_ipv6)
+        if item is not None:
+            p_uuid, token, sign, base_header = item
+            return True, p_uuid, token, sign, base_header
+        return await self.check_img(proxy, local_ipv6)
+
+    async def getAppAndMiniDetail(self, dataId, serviceType, p_uuid, token, sign, base_header, proxy="", local_ipv6=None,
+                                  throttle=True):
+        """详情获取，使用出口会话池中的长连接"""
         info = {"dataId": dataId, "serviceType": serviceType}
         length = str(len(str(ujson.dumps(info, ensure_ascii=False)).encode("utf-8")))
 
@@ -461,8 +343,7 @@ class beian:
             detail_header.pop("uuid", None)
             detail_header.pop("Content-Length", None)
 
-        # Bug 7 修复：始终创建独立会话，避免会话复用与连接器冲突
-        async with self.get_session(proxy) as session:
+        async with self.get_session(proxy, local_ipv6, throttle) as session:
             if getattr(getattr(config, 'captcha', object()), 'enable', False):
                 async with session.post(self.queryDetailByAppAndMiniId,
                     data=ujson.dumps(info, ensure_ascii=False),
@@ -478,14 +359,59 @@ class beian:
 
         return True, ujson.loads(res)
 
+    async def _fetch_detail(self, item, serviceType, p_uuid, token, sign, base_header, proxy, local_ipv6):
+        """获取单条详情；失败时返回原始条目并附带 detailError 标记"""
+        try:
+            # 限速等待不计入单条详情的超时
+            await self._throttle(proxy, local_ipv6)
+            d_success, d_data = await asyncio.wait_for(
+                self.getAppAndMiniDetail(item["dataId"], serviceType, p_uuid, token, sign,
+                                         base_header, proxy, local_ipv6, throttle=False),
+                timeout=self.detail_timeout,
+            )
+            if d_success and d_data.get("success"):
+                await self._details.put(serviceType, item["dataId"], d_data["params"])
+                return d_data["params"]
+            error = d_data.get("msg") or d_data.get("message") or "详情获取失败"
+        except asyncio.TimeoutError:
+            error = f"详情获取超时（{self.detail_timeout}秒）"
+        except Exception as e:
+            error = f"详情获取异常：{e}"
+        logger.warning(f"{error} dataId={item.get('dataId')}")
+        return {**item, "detailError": error}
+
+    async def _fetch_details(self, items, serviceType, p_uuid, token, sign, base_header, proxy="", local_ipv6=None):
+        """
+        并发获取列表中每一条的详情，信号量限制同时进行的请求数，
+        某条较慢时空出的并发位会立即被后续条目使用；结果按原顺序返回
+        """
+        semaphore = asyncio.Semaphore(max(1, min(self.detail_concurrency, len(items))))
+
+        async def worker(item):
+            if "dataId" not in item:
+                return item
+            # 缓存命中时不占用并发位，也不请求上游
+            detail = await self._details.get(serviceType, item["dataId"])
+            if detail is not None:
+                return detail
+            async with semaphore:
+                return await self._fetch_detail(item, serviceType, p_uuid, token, sign,
+                                                base_header, proxy, local_ipv6)
+
+        detailed_list = await asyncio.gather(*[worker(item) for item in items])
+        failed = sum(1 for item in detailed_list if "detailError" in item)
+        logger.info(f"并发详情完成，总计 {len(detailed_list)} 条，失败 {failed} 条")
+        return detailed_list
+
     async def getbeian(self, name, sp, pageNum, pageSize, proxy=""):
         info = ujson.loads(self.typj.get(sp))
         info["pageNum"] = pageNum
         info["pageSize"] = pageSize
         info["unitName"] = name
+        local_ipv6 = await self._pick_local_ipv6(proxy)
 
         if getattr(getattr(config, 'captcha', object()), 'enable', False):
-            success, p_uuid, token, sign, base_header = await self.check_img(proxy)
+            success, p_uuid, token, sign, base_header = await self._get_sign(proxy, local_ipv6)
             if not success:
                 logger.info(f"打码失败：{p_uuid}")
                 return False, p_uuid
@@ -493,14 +419,14 @@ class beian:
             length = str(len(str(ujson.dumps(info, ensure_ascii=False)).encode("utf-8")))
             base_header.update({"Content-Length": length, "uuid": p_uuid, "token": token, "sign": sign})
 
-            async with self.get_session(proxy) as session:
+            async with self.get_session(proxy, local_ipv6) as session:
                 async with session.post(self.queryByCondition,
                     data=ujson.dumps(info, ensure_ascii=False),
                     headers=base_header,
                     proxy=proxy if proxy else None) as req:
                     res = await req.text()
         else:
-            success, token, base_header = await self.get_token(proxy)
+            success, token, base_header = await self.get_token(proxy, local_ipv6)
             sign = ""
             p_uuid = ""
             if not success:
@@ -508,10 +434,7 @@ class beian:
                 return False, None
             base_header.update({"token": token, "sign": self.sign})
 
-            async with self.get_session(proxy) as session:
-                current_ip = None
-                if hasattr(session, '_connector') and hasattr(session._connector, '_local_addr'):
-                    current_ip = session._connector._local_addr[0] if session._connector._local_addr else None
+            async with self.get_session(proxy, local_ipv6) as session:
                 async with session.post(f"{self.queryByCondition}/",
                     json=info,
                     headers=base_header,
@@ -519,13 +442,7 @@ class beian:
                     res = await req.text()
 
                 if "当前访问疑似黑客攻击" in res:
-                    if current_ip:
-                        await self._add_blocked_ip(current_ip)
-                    elif not proxy and self.local_ipv6_addresses:
-                        # Bug 9 修复：使用异步方式获取被拦截的 IPv6 索引
-                        if self._last_used_ipv6_index >= 0:
-                            blocked_ip = self.local_ipv6_addresses[self._last_used_ipv6_index]
-                            await self._add_blocked_ip(blocked_ip)
+                    await self._on_blocked(proxy, local_ipv6)
                     return False, "当前访问已被创宇盾拦截"
 
         result = ujson.loads(res)
@@ -540,58 +457,13 @@ class beian:
                 return True, result
 
             logger.info(f"需要并发获取详细信息数量：{len(items)}")
-
-            # Bug 4 修复：优化并发控制，使用更合理的批处理策略
-            max_concurrency = min(
-                getattr(getattr(config, "system", object()), "detail_concurrency", 5),
-                len(items),
-                20  # 最大并发限制
+            serviceType = 6 if sp == 1 else (7 if sp == 2 else 8)
+            if not getattr(getattr(config, 'captcha', object()), 'enable', False):
+                sign = self.sign
+            result["params"]["list"] = await self._fetch_details(
+                items, serviceType, p_uuid, token, sign, base_header, proxy, local_ipv6
             )
 
-            # Bug 4 修复：使用更小的批次，减少连接竞争
-            batch_size = max_concurrency
-
-            async def fetch_detail(item):
-                if "dataId" not in item:
-                    return item
-
-                serviceType = 6 if sp == 1 else (7 if sp == 2 else 8)
-                try:
-                    # 每个详情请求使用独立会话
-                    d_success, d_data = await self.getAppAndMiniDetail(
-                        item["dataId"], serviceType, p_uuid, token,
-                        sign if getattr(getattr(config, 'captcha', object()), 'enable', False) else self.sign,
-                        base_header, proxy
-                    )
-
-                    if d_success and d_data.get("success"):
-                        return d_data["params"]
-                    else:
-                        logger.warning(f"详情获取失败 dataId={item.get('dataId')}")
-                        return item
-                except Exception as e:
-                    logger.error(f"详情获取异常 dataId={item.get('dataId')} err={e}")
-                    return item
-
-            detailed_list = []
-
-            # Bug 4 修复：分批处理，每批任务完成后等待完成
-            for i in range(0, len(items), batch_size):
-                batch = items[i:i + batch_size]
-                tasks = [fetch_detail(item) for item in batch]
-                batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-
-                # 处理异常结果
-                for j, res in enumerate(batch_results):
-                    if isinstance(res, Exception):
-                        logger.error(f"批次任务异常：{res}")
-                        detailed_list.append(batch[j])  # 返回原始数据
-                    else:
-                        detailed_list.append(res)
-
-            result["params"]["list"] = detailed_list
-            logger.info(f"并发详情完成，总计 {len(detailed_list)} 条")
-
         return True, result
 
     async def getblackbeian(self, name, sp, proxy=""):
@@ -600,9 +472,10 @@ class beian:
             info["domainName"] = name
         else:
             info["serviceName"] = name
+        local_ipv6 = await self._pick_local_ipv6(proxy)
 
         if getattr(getattr(config, 'captcha', object()), 'enable', False):
-            success, p_uuid, token, sign, base_header = await self.check_img(proxy)
+            success, p_uuid, token, sign, base_header = await self._get_sign(proxy, local_ipv6)
             if not success:
                 return False, p_uuid
 
@@ -610,16 +483,13 @@ class beian:
             base_header.update(
                 {"Content-Length": length, "uuid": p_uuid, "token": token, "sign": sign}
             )
-            async with self.get_session(proxy) as session:
-                current_ip = None
-                if hasattr(session, '_connector') and hasattr(session._connector, '_local_addr'):
-                    current_ip = session._connector._local_addr[0] if session._connector._local_addr else None
+            async with self.get_session(proxy, local_ipv6) as session:
                 async with session.post((self.blackqueryByCondition if sp == 0 else self.blackappAndMiniByCondition),
                     data=ujson.dumps(info, ensure_ascii=False),
                     headers=base_header, proxy=proxy if proxy else None) as req:
                     res = await req.text()
         else:
-            success, token, base_header = await self.get_token(proxy)
+            success, token, base_header = await self.get_token(proxy, local_ipv6)
             sign = ""
             p_uuid = ""
             if not success:
@@ -627,23 +497,14 @@ class beian:
                 return False, None
             base_header.update({"token": token, "sign": self.sign})
 
-            async with self.get_session(proxy) as session:
-                current_ip = None
-                if hasattr(session, '_connector') and hasattr(session._connector, '_local_addr'):
-                    current_ip = session._connector._local_addr[0] if session._connector._local_addr else None
+            async with self.get_session(proxy, local_ipv6) as session:
                 async with session.post((f"{self.blackqueryByCondition}/" if sp == 0 else f"{self.blackappAndMiniByCondition}/"),
                     json=info,
                     headers=base_header, proxy=proxy if proxy else None) as req:
                     res = await req.text()
 
                 if "当前访问疑似黑客攻击" in res:
-                    if current_ip:
-                        await self._add_blocked_ip(current_ip)
-                    elif not proxy and self.local_ipv6_addresses:
-                        # Bug 9 修复：使用异步方式获取被拦截的 IPv6 索引
-                        if self._last_used_ipv6_index >= 0:
-                            blocked_ip = self.local_ipv6_addresses[self._last_used_ipv6_index]
-                            await self._add_blocked_ip(blocked_ip)
+                    await self._on_blocked(proxy, local_ipv6)
                     return False, "当前访问已被创宇盾拦截"
 
         return True, ujson.loads(res)
@@ -667,7 +528,7 @@ class beian:
             if data.get("code") == 500 or not success:
                 return {"code": 122, "message": "工信部服务器异常"}
         except Exception as e:
-            return {"code": 122, "message": "查询失败", "error": str(e)}
+            return {"code": 122, "message": "查询失败", "error": str(e) or type(e).__name__}
 
         return data
 
@@ -703,8 +564,26 @@ class beian:
     async def bymKuaiApp(self, name, proxy=""):
         return await self.autoget(name, 3, b=0, proxy=proxy)
 
+    def stats(self):
+        """会话池、token 缓存、签名储备、详情缓存、出口限速与出口健康统计"""
+        return {
+            "session_pool": self._session_pool.stats(),
+            "token": self._tokens.stats(),
+            "sign_reservoir": self._signs.stats(),
+            "detail_cache": self._details.stats(),
+            "rate_limit": self._rate_limiter.stats(),
+            "egress_health": self._health.stats(),
+            "local_ipv6": {
+                "source": "pool" if get_ipv6_pool() is not None else "static",
+                "addresses": len(self._ipv6_addresses()),
+            },
+        }
+
     async def cleanup(self):
         """清理资源"""
+        await self._signs.close()
+        await self._tokens.close()
+        await self._session_pool.close()
         logger.info("beian 资源清理完成")
 
     def __del__(self):
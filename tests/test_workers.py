@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+多 worker 转发测试：非主 worker 的实时日志请求转发给主 worker，非主 worker 的日志汇总到主 worker
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "python"))
+
+import workers  # noqa: E402
+from log_collector import log_collector  # noqa: E402
+
+
+PORT = 18931
+
+
+def _app(index):
+    """只带日志接口的最小应用，/logs/realtime 返回处理请求的 worker 编号"""
+    app = web.Application()
+
+    async def realtime(request):
+        return web.json_response({"worker": index, "messages": [log["message"] for log in log_collector.get_logs()]})
+
+    app.router.add_get("/logs/realtime", realtime)
+    workers.setup_worker(app, index, PORT)
+    return app
+
+
+async def _start(app, port, path=None):
+    """与 run_app 相同：监听 TCP 端口，主 worker 另外监听内部 Unix 套接字"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    if path is not None:
+        await web.UnixSite(runner, path).start()
+    return runner
+
+
+async def _run():
+    with tempfile.TemporaryDirectory() as runtime_dir:
+        workers._runtime_dir = runtime_dir
+        log_collector.clear()
+        # 测试中两个 worker 不共用端口，主 worker 监听 PORT + 1
+        primary = await _start(_app(0), PORT + 1, workers.owner_socket_path(PORT))
+        secondary = await _start(_app(1), PORT)
+        try:
+            async with aiohttp.ClientSession() as session:
+                log_collector.add_log("来自非主 worker 的日志")
+                async with session.get(f"http://127.0.0.1:{PORT}/logs/realtime") as resp:
+                    data = await resp.json()
+                # 请求落在 1 号 worker，由主 worker 处理
+                assert data["worker"] == 0
+
+                # 同一进程内两个应用共用日志收集器：主 worker 收到的副本带 worker 前缀
+                for _ in range(50):
+                    messages = [log["message"] for log in log_collector.get_logs()]
+                    if "[worker 1] 来自非主 worker 的日志" in messages:
+                        break
+                    await asyncio.sleep(0.05)
+                else:
+                    raise AssertionError(f"日志未汇总到主 worker：{messages}")
+
+                # 内部日志接口不能经 TCP 端口访问
+                async with session.post(f"http://127.0.0.1:{PORT + 1}{workers.LOG_INGEST_PATH}",
+                                        json={"worker": 9, "logs": [{"message": "伪造"}]}) as resp:
+                    assert resp.status != 204
+                assert not any("伪造" in log["message"] for log in log_collector.get_logs())
+        finally:
+            await secondary.cleanup()
+            await primary.cleanup()
+            log_collector.clear()
+
+
+def test_non_primary_worker_forwards_logs():
+    asyncio.run(_run())